@@ -0,0 +1,135 @@
+from rackattack import api
+import threading
+import time
+import os
+
+_counter = 0
+_counterLock = threading.Lock()
+
+
+def factory():
+    """
+    A stand-in for the rackattack client, for measuring the test infrastructure itself without a rack. The
+    benchmark puts it in place of rackattack's clientfactory.factory in the processes it starts, see
+    inject/sitecustomize.py. Every allocated node is the same local SSH server, given as
+    RACKTEST_FAKE_RACKATTACK in the form 'username:password@hostname:port'.
+    RACKTEST_FAKE_RACKATTACK_ALLOCATION_DELAY simulates the time rackattack takes to allocate and
+    inaugurate, in seconds
+    """
+    return Client(_parseCredentials(os.environ['RACKTEST_FAKE_RACKATTACK']),
+                  float(os.getenv('RACKTEST_FAKE_RACKATTACK_ALLOCATION_DELAY', 0)))
+
+
+class Client:
+    def __init__(self, credentials, allocationDelay):
+        self._credentials = credentials
+        self._allocationDelay = allocationDelay
+        self.allocations = []
+
+    def allocate(self, requirements, allocationInfo):
+        global _counter
+        with _counterLock:
+            _counter += 1
+            allocationID = "fake-%d-%d" % (os.getpid(), _counter)
+        allocation = Allocation(allocationID, requirements.keys(), self._credentials, self._allocationDelay)
+        self.allocations.append(allocation)
+        return allocation
+
+    def allocateExisting(self, requirements, allocationID):
+        allocation = Allocation(allocationID, requirements.keys(), self._credentials, allocationDelay=0)
+        self.allocations.append(allocation)
+        return allocation
+
+
+class Allocation:
+    def __init__(self, allocationID, names, credentials, allocationDelay):
+        self._id = allocationID
+        self._nodes = dict((name, Node("%s-%s" % (allocationID, name), credentials)) for name in names)
+        self._allocatedAt = time.time()
+        self._readyAt = self._allocatedAt + allocationDelay
+        self._progressCallback = None
+        self._freed = False
+        self._death = None
+
+    def id(self):
+        return self._id
+
+    def registerProgressCallback(self, callback):
+        self._progressCallback = callback
+
+    def dead(self):
+        if self._death is not None:
+            return self._death
+        return "freed" if self._freed else None
+
+    def die(self, reason):
+        "Like rackattack killing the allocation, without waking up wait"
+        self._death = reason
+
+    def freed(self):
+        return self._freed
+
+    def done(self):
+        return time.time() >= self._readyAt
+
+    def wait(self, timeout=None):
+        remaining = self._readyAt - time.time()
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            self._reportProgress()
+            raise Exception("Timeout waiting for fake allocation")
+        time.sleep(max(remaining, 0))
+        self._reportProgress()
+
+    def nodes(self):
+        return dict(self._nodes)
+
+    def free(self):
+        self._freed = True
+
+    def releaseHost(self, name):
+        del self._nodes[name]
+
+    def fetchPostMortemPack(self):
+        return "fakerackattack.postmortem.txt", "allocation %s of the fake rackattack provider\n" % self._id
+
+    def _reportProgress(self):
+        if self._progressCallback is None:
+            return
+        if self.done():
+            percent = 100
+        else:
+            percent = int(100 * (time.time() - self._allocatedAt) / (self._readyAt - self._allocatedAt))
+        self._progressCallback(overallPercent=percent, event=dict())
+
+
+class Node(api.Node):
+    def __init__(self, nodeID, credentials):
+        self._id = nodeID
+        self._credentials = credentials
+
+    def rootSSHCredentials(self):
+        return dict(self._credentials)
+
+    def ipAddress(self):
+        return self._credentials['hostname']
+
+    def primaryMACAddress(self):
+        return "00:00:00:00:00:00"
+
+    def networkInfo(self):
+        return dict(netmask="255.0.0.0", gateway=self._credentials['hostname'],
+                    osmosisServerIP=self._credentials['hostname'])
+
+    def fetchSerialLog(self):
+        return ""
+
+    def id(self):
+        return self._id
+
+
+def _parseCredentials(spec):
+    userPart, addressPart = spec.rsplit('@', 1)
+    username, password = userPart.split(':', 1)
+    hostname, port = addressPart.split(':')
+    return dict(username=username, password=password, hostname=hostname, port=int(port), key=None)
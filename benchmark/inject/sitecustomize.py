@@ -0,0 +1,10 @@
+"""
+Put on the PYTHONPATH of the runner the benchmark starts, so that the runner and every scenario process
+it starts allocate from the fake rackattack provider instead of a rack
+"""
+import os
+
+if os.getenv('RACKTEST_FAKE_RACKATTACK') is not None:
+    from rackattack import clientfactory
+    from benchmark import fakerackattack
+    clientfactory.factory = fakerackattack.factory
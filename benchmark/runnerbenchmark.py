@@ -0,0 +1,208 @@
+#!/usr/bin/python
+"""
+Measures the overhead of the runner, the executioner and the builtin plugins, without a rack: hosts are
+allocated from the fake rackattack provider, and all of them are the local SSH server given with
+--ssh. Results are written as JSON, so that they can be compared between versions
+"""
+from strato.racktest.infra import phasetimings
+from strato.racktest.runner import livereport
+import subprocess
+import argparse
+import tempfile
+import platform
+import datetime
+import logging
+import shutil
+import json
+import time
+import os
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_RUNNER = os.path.join(_ROOT, "runner")
+_FAKE_SOLVENT_DIRECTORY = os.path.join(_ROOT, "benchmark", "bin")
+_INJECT_DIRECTORY = os.path.join(_ROOT, "benchmark", "inject")
+
+EMPTY_SCENARIO = """
+class Test:
+    HOSTS = dict()
+
+    def run(self):
+        pass
+"""
+
+HOST_SCENARIO = """
+from strato.racktest.infra.suite import *
+
+
+class Test:
+    HOSTS = dict(it=dict(rootfs="rootfs-basic"))
+
+    def run(self):
+        host.it.ssh.run.script("true")
+"""
+
+SEED_SCENARIO = """
+from strato.racktest.infra.suite import *
+from benchmark import roundtrip
+import time
+import os
+
+ROUND_TRIPS = %(roundTrips)d
+
+
+class Test:
+    HOSTS = dict(it=dict(rootfs="rootfs-basic"))
+
+    def run(self):
+        latencies = []
+        for i in xrange(ROUND_TRIPS):
+            before = time.time()
+            TS_ASSERT_EQUALS(host.it.seed.runCallable(roundtrip.echo, i)[0], i)
+            latencies.append(time.time() - before)
+        with open(os.environ['BENCHMARK_SEED_LATENCIES'], "a") as f:
+            f.write("".join("%%f\\n" %% latency for latency in latencies))
+"""
+
+SCENARIOS = dict(empty=EMPTY_SCENARIO, host=HOST_SCENARIO)
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--output", default="benchmark.json")
+parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 1000])
+parser.add_argument("--parallel", type=int, nargs="+", default=[1, 4, 16])
+parser.add_argument("--kinds", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+parser.add_argument(
+    "--ssh", default=os.getenv('RACKTEST_FAKE_RACKATTACK'), metavar="USERNAME:PASSWORD@HOSTNAME:PORT",
+    help="local SSH server standing in for every allocated host. Without it, only scenarios that require "
+    "no hosts are measured")
+parser.add_argument("--allocationDelay", type=float, default=0)
+parser.add_argument("--seedRoundTrips", type=int, default=20)
+parser.add_argument(
+    "--runnerArgs", default="", help="additional runner arguments, e.g. '--forkServer --reuseHosts'")
+args = parser.parse_args()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+
+def measureRunner(kind, count, parallel):
+    workDirectory = tempfile.mkdtemp(prefix="racktestbenchmark")
+    try:
+        scenariosRoot = os.path.join(workDirectory, "racktests")
+        os.mkdir(scenariosRoot)
+        for i in xrange(count):
+            with open(os.path.join(scenariosRoot, "%05d_%s.py" % (i, kind)), "w") as f:
+                f.write(SCENARIOS[kind])
+        before = time.time()
+        _runRunner(workDirectory, parallel)
+        took = time.time() - before
+        with open(os.path.join(workDirectory, "report.json")) as f:
+            report = json.load(f)
+    finally:
+        shutil.rmtree(workDirectory, ignore_errors=True)
+    overheads = [entry['timeTook'] - entry['phaseTimings']['phases'].get('run', 0) for entry in report]
+    return dict(
+        kind=kind, count=count, parallel=parallel, seconds=took,
+        passed=len([entry for entry in report if entry['passed']]),
+        scenariosPerMinute=count * 60.0 / took,
+        fixedOverhead=_statistics(overheads),
+        phases=phasetimings.aggregate([entry['phaseTimings'] for entry in report]))
+
+
+def measureSeedRoundTrip():
+    workDirectory = tempfile.mkdtemp(prefix="racktestbenchmark")
+    try:
+        scenariosRoot = os.path.join(workDirectory, "racktests")
+        os.mkdir(scenariosRoot)
+        with open(os.path.join(scenariosRoot, "1_seed.py"), "w") as f:
+            f.write(SEED_SCENARIO % dict(roundTrips=args.seedRoundTrips))
+        latenciesFilename = os.path.join(workDirectory, "latencies")
+        _runRunner(workDirectory, parallel=1, environment=dict(BENCHMARK_SEED_LATENCIES=latenciesFilename))
+        with open(latenciesFilename) as f:
+            latencies = [float(line) for line in f]
+    finally:
+        shutil.rmtree(workDirectory, ignore_errors=True)
+    return dict(roundTrips=len(latencies), first=latencies[0], latency=_statistics(latencies[1:]))
+
+
+def measureLiveReport(count):
+    directory = tempfile.mkdtemp(prefix="racktestbenchmark")
+    try:
+        filename = os.path.join(directory, "live.jsonl")
+        report = livereport.LiveReport(filename)
+        scenarios = ["racktests/%05d_host.py" % i for i in xrange(count)]
+        report.start(scenarios=scenarios, instances=[''], runTimestamp="benchmark")
+        entry = dict(instance='', passed=True, timeTook=1.0, host='localhost', phaseTimings=dict(
+            phases=dict(allocation=1.0, run=1.0), hosts=dict(it=dict(connect=1.0))))
+        before = time.time()
+        for scenario in scenarios:
+            report.append(dict(entry, scenario=scenario))
+        appended = time.time()
+        report.finish(passed=count, total=count)
+        livereport.read(filename)
+        read = time.time()
+        report.compact(os.path.join(directory, "report.json"))
+        compacted = time.time()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return dict(count=count, appendMean=(appended - before) / count, read=read - appended,
+                compact=compacted - read)
+
+
+def _runRunner(workDirectory, parallel, environment=None):
+    configurationFile = os.path.join(workDirectory, "racktest.conf")
+    with open(configurationFile, "w") as f:
+        f.write("USER: racktest-benchmark\n")
+    environment = dict(os.environ, **(environment or dict()))
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [_INJECT_DIRECTORY, _ROOT, os.path.join(_ROOT, "py")] + filter(None, [os.getenv('PYTHONPATH')]))
+    environment['PATH'] = os.pathsep.join([_FAKE_SOLVENT_DIRECTORY, os.environ['PATH']])
+    if args.ssh:
+        environment['RACKTEST_FAKE_RACKATTACK'] = args.ssh
+        environment['RACKTEST_FAKE_RACKATTACK_ALLOCATION_DELAY'] = str(args.allocationDelay)
+    command = [
+        _RUNNER, "--scenariosRoot=racktests", "--configurationFile=" + configurationFile,
+        "--reportFilename=report.json", "--liveReportFilename=livereport.jsonl",
+        "--durationHistoryFilename=durations.json", "--scenarioIndexFilename=index.json",
+        "--parallel=%d" % (parallel if parallel > 1 else 0)] + args.runnerArgs.split()
+    with open(os.path.join(workDirectory, "runner.log"), "w") as log:
+        result = subprocess.call(command, cwd=workDirectory, env=environment, close_fds=True,
+                                 stdout=log, stderr=subprocess.STDOUT)
+    if result != 0:
+        with open(os.path.join(workDirectory, "runner.log")) as log:
+            logging.error("Runner failed:\n%(log)s", dict(log=log.read()[-10000:]))
+
+
+def _statistics(values):
+    if not values:
+        return None
+    return dict(mean=sum(values) / len(values), minimum=min(values), maximum=max(values))
+
+
+def _revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=_ROOT).strip()
+    except:
+        return None
+
+
+kinds = [kind for kind in args.kinds if kind == 'empty' or args.ssh]
+if kinds != args.kinds:
+    logging.warning("No --ssh given, measuring only scenarios that require no hosts")
+results = dict(
+    revision=_revision(), python=platform.python_version(), runnerArgs=args.runnerArgs,
+    timestamp=datetime.datetime.now().isoformat(), allocationDelay=args.allocationDelay,
+    runner=[], seedRoundTrip=None, liveReport=[])
+for count in args.counts:
+    results['liveReport'].append(measureLiveReport(count))
+    for kind in kinds:
+        for parallel in args.parallel:
+            logging.info("Running %(count)d '%(kind)s' scenarios, parallel %(parallel)d", dict(
+                count=count, kind=kind, parallel=parallel))
+            measurement = measureRunner(kind, count, parallel)
+            logging.info("%(scenariosPerMinute).1f scenarios per minute", measurement)
+            results['runner'].append(measurement)
+if args.ssh:
+    results['seedRoundTrip'] = measureSeedRoundTrip()
+temporary = args.output + ".tmp"
+with open(temporary, "w") as f:
+    json.dump(results, f, indent=4, sort_keys=True)
+os.rename(temporary, args.output)
+logging.info("Benchmark results written to %(output)s", dict(output=args.output))
@@ -20,6 +20,14 @@ _creator = seedcreator.SeedCreator
 _seedcache = seedcache.SeedCache(_engine, _creator)
 
 
+def afterFork():
+    "A process forked after this module was imported must not share its parent's cache engine"
+    global _engine
+    global _seedcache
+    _engine = cacheregistry.create(os.getenv('SEED_CACHE', None))
+    _seedcache = seedcache.SeedCache(_engine, _creator)
+
+
 class Seed:
 
     def __init__(self, host):
@@ -1,33 +1,259 @@
-import multiprocessing.pool
+import collections
+import threading
 import logging
+import Queue
+import time
+import sys
+import os
 
 
-def run(jobs, threads=None):
-    if threads is None:
-        threads = len(jobs)
-    pool = multiprocessing.pool.ThreadPool(processes=threads)
-    try:
-        futures = []
-        for job in jobs:
-            kwargs = dict(job)
-            args = ()
-            del kwargs['callback']
-            if 'args' in job:
-                args = job['args']
-                del kwargs['args']
-            futures.append(pool.apply_async(_safeRun, args=(job['callback'], args, kwargs)))
-        for future in futures:
-            future.wait(timeout=2 ** 31)
-        for future in futures:
-            future.get()
-    finally:
-        pool.close()
-
-
-def _safeRun(callback, args, kwargs):
-    try:
-        callback(*args, **kwargs)
-    except:
-        logging.exception("Running %(callback)s on '%(args)s'/'%(kwargs)s'", dict(
-            callback=callback, args=args, kwargs=kwargs))
-        raise
+class TimeoutError(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Future:
+    def __init__(self, description):
+        self._description = description
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._state = 'pending'
+        self._result = None
+        self._failure = None
+        self._seconds = None
+        self._doneCallbacks = []
+
+    def description(self):
+        return self._description
+
+    def cancel(self):
+        "Only a job that did not start yet can be cancelled"
+        with self._lock:
+            if self._state != 'pending':
+                return self._state == 'cancelled'
+            self._state = 'cancelled'
+        self._finish()
+        return True
+
+    def cancelled(self):
+        return self._state == 'cancelled'
+
+    def done(self):
+        return self._done.is_set()
+
+    def seconds(self):
+        "How long the job ran, None until it is done"
+        return self._seconds
+
+    def result(self, timeout=None):
+        if not self._done.wait(2 ** 31 if timeout is None else timeout):
+            raise TimeoutError("'%s' did not finish within %s seconds" % (self._description, timeout))
+        if self._state == 'cancelled':
+            raise Cancelled(self._description)
+        if self._failure is not None:
+            raise self._failure[0], self._failure[1], self._failure[2]
+        return self._result
+
+    def addDoneCallback(self, callback):
+        "Called with the future once it is done, right away if it already is"
+        with self._lock:
+            if not self._done.is_set():
+                self._doneCallbacks.append(callback)
+                return
+        callback(self)
+
+    def _start(self):
+        with self._lock:
+            if self._state != 'pending':
+                return False
+            self._state = 'running'
+            return True
+
+    def _run(self, callback, args, kwargs):
+        before = time.time()
+        try:
+            self._result = callback(*args, **kwargs)
+        except:
+            logging.exception("Running %(callback)s ('%(description)s') on '%(args)s'/'%(kwargs)s'", dict(
+                callback=callback, description=self._description, args=args, kwargs=kwargs))
+            self._failure = sys.exc_info()
+        self._seconds = time.time() - before
+        self._state = 'done'
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._doneCallbacks = self._doneCallbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except:
+                logging.exception("Done callback of '%(description)s' failed",
+                                  dict(description=self._description))
+
+
+class Executor:
+    """
+    A bounded pool of threads, started on demand and kept for the life of the process. When no thread is
+    free, a job submitted with 'startNow', or from one of the pool's threads, gets a thread of its own
+    past the bound, which exits once the job is done, so jobs that must run together, or that wait for
+    jobs they submitted, can not deadlock the pool. A job submitted from one of the pool's threads with
+    'runInlineWhenBusy' runs in the submitting thread instead. Other jobs wait for a free thread. Keeps the
+    count and total seconds of the jobs of each description
+    """
+
+    def __init__(self, maximumThreads):
+        self._maximumThreads = maximumThreads
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._threads = []
+        self._available = 0
+        self._local = threading.local()
+        self._timingsLock = threading.Lock()
+        self._timings = dict()
+
+    def submit(self, callback, args=(), kwargs=None, description=None, startNow=False,
+               runInlineWhenBusy=False):
+        if description is None:
+            description = getattr(callback, '__name__', str(callback))
+        future = Future(description)
+        item = (future, callback, args, kwargs or dict())
+        isWorker = getattr(self._local, 'isWorker', False)
+        with self._condition:
+            if self._available > 0:
+                self._available -= 1
+                whenBusy = None
+            elif len(self._threads) < self._maximumThreads:
+                thread = threading.Thread(target=self._work, name="concurrently%d" % len(self._threads))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+                whenBusy = None
+            elif isWorker and runInlineWhenBusy:
+                whenBusy = 'inline'
+            elif isWorker or startNow:
+                whenBusy = 'extraThread'
+            else:
+                whenBusy = None
+            if whenBusy is None:
+                self._queue.append(item)
+                self._condition.notify()
+        if whenBusy == 'inline':
+            self._execute(*item)
+        elif whenBusy == 'extraThread':
+            thread = threading.Thread(target=self._workOnce, args=item, name="concurrentlyExtra")
+            thread.daemon = True
+            thread.start()
+        return future
+
+    def timings(self):
+        with self._timingsLock:
+            return dict((description, dict(timing)) for description, timing in self._timings.iteritems())
+
+    def threads(self):
+        with self._condition:
+            return len(self._threads)
+
+    def _work(self):
+        self._local.isWorker = True
+        while True:
+            with self._condition:
+                if not self._queue:
+                    self._available += 1
+                    while not self._queue:
+                        self._condition.wait()
+                future, callback, args, kwargs = self._queue.popleft()
+            self._execute(future, callback, args, kwargs)
+
+    def _workOnce(self, future, callback, args, kwargs):
+        self._local.isWorker = True
+        self._execute(future, callback, args, kwargs)
+
+    def _execute(self, future, callback, args, kwargs):
+        if not future._start():
+            return
+        future._run(callback, args, kwargs)
+        with self._timingsLock:
+            timing = self._timings.setdefault(future.description(), dict(count=0, seconds=0))
+            timing['count'] += 1
+            timing['seconds'] += future.seconds()
+
+
+_shared = None
+_sharedPID = None
+_sharedLock = threading.Lock()
+
+
+def shared():
+    "The executor of this process, of up to RACKTEST_MAXIMUM_THREADS threads. A forked child gets its own"
+    global _shared
+    global _sharedPID
+    with _sharedLock:
+        if _shared is None or _sharedPID != os.getpid():
+            _shared = Executor(int(os.getenv('RACKTEST_MAXIMUM_THREADS', 64)))
+            _sharedPID = os.getpid()
+        return _shared
+
+
+def run(jobs, threads=None, description=None, timeout=None, failFast=False, stopTimeout=0):
+    """
+    Runs the jobs on the shared executor, at most 'threads' of them at a time, and waits for all of them.
+    Jobs start right away, even when the executor is busy, so they may wait for each other. Each job is a
+    dictionary of a 'callback', its 'args', and its keyword arguments. Raises the failure of the first
+    failed job, or TimeoutError once 'timeout' seconds passed, after cancelling the jobs that did not
+    start yet. With 'failFast', the first failure is raised as soon as it happens, in the same
+    way, after waiting up to 'stopTimeout' seconds for the jobs still running to stop
+    """
+    if not jobs:
+        return
+    executor = shared()
+    limit = threads or len(jobs)
+    deadline = None if timeout is None else time.time() + timeout
+    finished = Queue.Queue()
+    pending = list(jobs)
+    futures = []
+    running = 0
+    while pending or running > 0:
+        while pending and running < limit:
+            kwargs = dict(pending.pop(0))
+            callback = kwargs.pop('callback')
+            args = kwargs.pop('args', ())
+            future = executor.submit(callback, args, kwargs, description=description, startNow=True)
+            futures.append(future)
+            running += 1
+            future.addDoneCallback(finished.put)
+        try:
+            future = finished.get(timeout=2 ** 31 if deadline is None else max(deadline - time.time(), 0))
+        except Queue.Empty:
+            for future in futures:
+                future.cancel()
+            raise TimeoutError("'%s' did not finish within %s seconds" % (description, timeout))
+        running -= 1
+        if failFast:
+            try:
+                future.result()
+            except:
+                failure = sys.exc_info()
+                for future in futures:
+                    future.cancel()
+                _waitForRunning(futures, stopTimeout, description)
+                raise failure[0], failure[1], failure[2]
+    for future in futures:
+        future.result()
+
+
+def _waitForRunning(futures, timeout, description):
+    deadline = time.time() + timeout
+    for future in futures:
+        try:
+            future.result(timeout=max(deadline - time.time(), 0))
+        except:
+            pass
+    stillRunning = len([future for future in futures if not future.done()])
+    if stillRunning:
+        logging.warning("%(count)d jobs of '%(description)s' are still running after the first failure",
+                        dict(count=stillRunning, description=description))
@@ -8,7 +8,7 @@ class DetachedNode(api.Node):
         self._hostname = hostname
         self._port = port
         self._ipAddress = ipAddress
-        self._id = id
+        self._id = nodeId
 
     def rootSSHCredentials(self):
         return dict(hostname=self._hostname,
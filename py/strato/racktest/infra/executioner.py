@@ -1,21 +1,35 @@
 import logging
 from strato.racktest.infra import suite
 from strato.racktest.infra import rackattackallocation
+from strato.racktest.infra import hostsdefinition
+from strato.racktest.infra import rootfslabel
+from strato.racktest.infra import phasetimings
+from strato.racktest.infra import concurrently
+from strato.racktest.infra import readinessprober
+from strato.racktest.infra import samplingprofiler
 from strato.racktest import hostundertest
 import strato.racktest.hostundertest.host
 from strato.whiteboxtest.infra import timeoutthread
 from strato.common.log import discardinglogger
+from strato.common import log
 from detachednode import DetachedNode
 import os
 import signal
 import time
 import yaml
+import json
 import sys
+import threading
 
 
 class Executioner:
     ABORT_TEST_TIMEOUT_DEFAULT = 10 * 60
     ON_TIMEOUT_CALLBACK_TIMEOUT_DEFAULT = 5 * 60
+    REINAUGURATION_TIMEOUT = 10 * 60
+    SSH_READY_TIMEOUT = 3 * 60
+    DETACHED_CONNECT_TIMEOUT = 5 * 60
+    HOST_SET_UP_STOP_TIMEOUT = 60
+    CLEANUP_THREADS_DEFAULT = 8
     DISCARD_LOGGING_OF = (
         'paramiko',
         'pika',
@@ -25,20 +39,38 @@ class Executioner:
     CREATE_NEW_ALLOCATION = None
     RUN_ON_DETACHED = os.getenv('RUN_ON_DETACHED', 'false').lower() == 'true'
 
-    DEFAULT_RACKATTACK = 'defaultRackattack'
-    MULTICLUSTER_ALLOCATION = 'multicluster'
-    DEFAULT_CLUSTER_NAME = 'cluster1'
+    DEFAULT_RACKATTACK = hostsdefinition.DEFAULT_RACKATTACK
+    MULTICLUSTER_ALLOCATION = hostsdefinition.MULTICLUSTER_ALLOCATION
+    DEFAULT_CLUSTER_NAME = hostsdefinition.DEFAULT_CLUSTER_NAME
 
     def __init__(self, klass):
         self._cleanUpMethods = []
+        self._cleanUpResults = []
         if not hasattr(klass, 'addCleanup'):
             klass.addCleanup = self._addCleanup
         self._test = klass()
         self._testTimeout = getattr(self._test, 'ABORT_TEST_TIMEOUT', self.ABORT_TEST_TIMEOUT_DEFAULT)
+        self._cleanUpThreads = getattr(self._test, 'CLEANUP_THREADS', self.CLEANUP_THREADS_DEFAULT)
         self._onTimeoutCallbackTimeout = getattr(
             self._test, 'ON_TIMEOUT_CALLBACK_TIMEOUT', self.ON_TIMEOUT_CALLBACK_TIMEOUT_DEFAULT)
         self._hostToRackattackMap = self._createHostToRackattackMap(self._test.HOSTS)
         self._allocations = None
+        self._allocationIDs = json.loads(os.getenv('RACKTEST_ALLOCATION_IDS', '{}'))
+        self._hostsToReinaugurate = json.loads(os.getenv('RACKTEST_REINAUGURATE_HOSTS', '[]'))
+        self._scenarioReportFilename = os.getenv('RACKTEST_SCENARIO_REPORT_FILENAME')
+        self._deferFree = self._scenarioReportFilename is not None and \
+            os.getenv('RACKTEST_DEFER_FREE', 'false').lower() == 'true'
+        self._deferredFrees = []
+        self._phaseTimings = phasetimings.PhaseTimings()
+        self._nodeIDs = dict()
+        self._hostSetUpFailures = []
+        self._hostSetUpAbort = threading.Event()
+        self._hostsLock = threading.Lock()
+        self._setUpHostNames = set()
+        self._testTimerLock = threading.Lock()
+        self._testTimerArmed = False
+        self._profile = os.getenv('RACKTEST_PROFILE', samplingprofiler.NEVER)
+        self._profiler = None
 
     def host(self, name):
         return self._hosts[name]
@@ -47,6 +79,39 @@ class Executioner:
         return self._hosts
 
     def executeTestScenario(self):
+        self._startProfiler()
+        try:
+            self._executeTestScenario()
+        except:
+            if self._profile in (samplingprofiler.FAILURE, samplingprofiler.ALWAYS):
+                self._dumpProfile()
+            raise
+        finally:
+            rackattackallocation.waitForPostMortems()
+            self._writeScenarioReport()
+        if self._profile == samplingprofiler.ALWAYS:
+            self._dumpProfile()
+
+    def _startProfiler(self):
+        if self._profile == samplingprofiler.NEVER:
+            return
+        if self._profile not in samplingprofiler.MODES:
+            logging.error("Unknown RACKTEST_PROFILE '%(profile)s', not profiling",
+                          dict(profile=self._profile))
+            return
+        self._profiler = samplingprofiler.SamplingProfiler(
+            interval=float(os.getenv('RACKTEST_PROFILE_INTERVAL', 0.02)))
+        self._profiler.start()
+
+    def _dumpProfile(self):
+        if self._profiler is None:
+            return
+        try:
+            self._profiler.dump(os.path.join(log.config.LOGS_DIRECTORY, "profile.folded"))
+        except:
+            logging.exception("Unable to dump the profile of the scenario")
+
+    def _executeTestScenario(self):
         discardinglogger.discardLogsOf(self.DISCARD_LOGGING_OF)
         self._hosts = dict()
         suite.findHost = self.host
@@ -60,8 +125,7 @@ class Executioner:
         if not self.RUN_ON_DETACHED:
             logging.progress("Allocating hosts...")
             self._allocations = self._createAllocations()
-            timeoutthread.TimeoutThread(self._testTimeout, self._testTimedOut)
-            logging.info("Test timer armed. Timeout in %(seconds)d seconds", dict(seconds=self._testTimeout))
+            self._armTestTimer()
             logging.progress("Done allocating hosts.")
         else:
             logging.progress("Attempting connection to detached nodes...")
@@ -69,39 +133,96 @@ class Executioner:
             self._setUp()
             self._run()
         finally:
-            self._tearDown()
-            self._cleanUp()
-            for allocation in self._allocations.values():
-                wasAllocationFreedSinceAllHostsWereReleased = not bool(allocation.nodes())
-                if not wasAllocationFreedSinceAllHostsWereReleased:
-                    try:
-                        self._tryFreeAllocation(allocation)
-                    except:
-                        logging.exception("Unable to free allocation, hosts: "
-                                          "%(_nodes)s may still be allocated",
-                                          dict(_nodes=','.join(
-                                              [node.id() for node in allocation.nodes().values()])))
-                        raise Exception('Unable to free allocation')
-                else:
-                    logging.info('Not freeing allocation')
+            with self._phaseTimings.measure('tearDown'):
+                self._tearDown()
+            with self._phaseTimings.measure('cleanUp'):
+                self._cleanUp()
+            with self._phaseTimings.measure('free'):
+                self._freeAllocations()
+
+    def _writeScenarioReport(self):
+        if self._scenarioReportFilename is None:
+            return
+        try:
+            with open(self._scenarioReportFilename, "w") as f:
+                json.dump(dict(phaseTimings=self._phaseTimings.asDict(), nodes=self._nodeIDs,
+                               deferredFrees=self._deferredFrees, cleanUps=self._cleanUpResults,
+                               tasks=concurrently.shared().timings()), f)
+        except:
+            logging.exception("Unable to write the scenario report for the test runner")
+
+    def _freeAllocations(self):
+        if self.RUN_ON_DETACHED:
+            return
+        if self._allocationIDs:
+            logging.info("Allocations were created by the test runner, leaving it to free them")
+            return
+        for rackattack, allocation in self._allocations.iteritems():
+            wasAllocationFreedSinceAllHostsWereReleased = not bool(allocation.nodes())
+            if not wasAllocationFreedSinceAllHostsWereReleased and self._deferFree:
+                logging.info("Handing the free of the allocation from %(rackattack)s to the test runner",
+                             dict(rackattack=rackattack))
+                self._deferredFrees.append(dict(
+                    rackattack=rackattack, allocationID=allocation.allocationID(),
+                    hosts=self._createRackattackToHostMap(self._test.HOSTS)[rackattack]))
+            elif not wasAllocationFreedSinceAllHostsWereReleased:
+                try:
+                    self._tryFreeAllocation(allocation)
+                except:
+                    logging.exception("Unable to free allocation, hosts: "
+                                      "%(_nodes)s may still be allocated",
+                                      dict(_nodes=','.join(
+                                          [node.id() for node in allocation.nodes().values()])))
+                    raise Exception('Unable to free allocation')
+            else:
+                logging.info('Not freeing allocation')
 
     def _cleanUp(self):
+        """
+        Cleanups run last in first out. Consecutive cleanups that were added with a 'cleanupGroup' run
+        together: each group in its own thread, last in first out within the group
+        """
         if not self._cleanUpMethods:
             return
         logging.info("Performing cleanup...")
         while self._cleanUpMethods:
-            callback, args, kwargs = self._cleanUpMethods.pop()
+            cleanUpMethod = self._cleanUpMethods.pop()
+            if cleanUpMethod[3] is None:
+                self._cleanUpGroup([cleanUpMethod])
+                continue
+            groups = dict()
+            groups.setdefault(cleanUpMethod[3], []).append(cleanUpMethod)
+            while self._cleanUpMethods and self._cleanUpMethods[-1][3] is not None:
+                cleanUpMethod = self._cleanUpMethods.pop()
+                groups.setdefault(cleanUpMethod[3], []).append(cleanUpMethod)
+            concurrently.run([dict(callback=self._cleanUpGroup, args=(group,)) for group in groups.values()],
+                             threads=min(len(groups), self._cleanUpThreads))
+        logging.info("Cleanup done.")
+
+    def _cleanUpGroup(self, cleanUpMethods):
+        for callback, args, kwargs, group in cleanUpMethods:
             logging.info("Invoking cleanup method '%(callback)s with (%(args)s, %(kwargs)s...",
                          dict(callback=callback, args=args, kwargs=kwargs))
+            before = time.time()
+            failed = False
             try:
                 callback(*args, **kwargs)
             except:
+                failed = True
                 logging.exception("An error has occurred during the cleanup method '%(callback)s'. Skipping",
                                   dict(callback=callback))
-        logging.info("Cleanup done.")
+            self._cleanUpResults.append(dict(
+                callback=getattr(callback, '__name__', str(callback)), group=group,
+                seconds=time.time() - before, failed=failed))
 
     def _addCleanup(self, callback, *args, **kwargs):
-        self._cleanUpMethods.append((callback, args, kwargs))
+        """
+        Cleanups run last in first out. Those given the same 'cleanupGroup', e.g. the host they clean, keep
+        that order among themselves, but may run concurrently with the cleanups of other groups that were
+        added next to them
+        """
+        group = kwargs.pop('cleanupGroup', None)
+        self._cleanUpMethods.append((callback, args, kwargs, group))
 
     def _releaseHost(self, name):
         hostRackattack = self._hostToRackattackMap[name]
@@ -116,6 +237,9 @@ class Executioner:
             "Timeout: test is running for more than %(seconds)ds, calling 'onTimeout' and arming "
             " additional timer. "
             "You might need to increase the scenario ABORT_TEST_TIMEOUT", dict(seconds=self._testTimeout))
+        logging.error("Stacks of all threads at the timeout:\n%(stacks)s",
+                      dict(stacks=samplingprofiler.formatThreadStacks()))
+        self._dumpProfile()
         timeoutthread.TimeoutThread(self._onTimeoutCallbackTimeout, self._killSelf)
         timeoutthread.TimeoutThread(self._onTimeoutCallbackTimeout + 5, self._killSelfHard)
         try:
@@ -155,6 +279,7 @@ class Executioner:
     def _setUpHost(self, name):
         hostRackattack = self._hostToRackattackMap[name]
         node = self._allocations[hostRackattack].nodes()[name]
+        self._nodeIDs[name] = node.id()
         host = hostundertest.host.Host(node, name)
         credentials = host.node.rootSSHCredentials()
         address = "%(hostname)s:%(port)s" % credentials
@@ -162,53 +287,118 @@ class Executioner:
                      dict(name=name, server=node.id(), address=address))
         logging.debug("Full credentials of host: %(credentials)s", dict(credentials=credentials))
         try:
-            host.ssh.waitForTCPServer(timeout=3 * 60)
-            host.ssh.connect()
+            secondsToReady = readinessprober.shared().waitForSSH(
+                name, credentials['hostname'], credentials['port'], timeout=self.SSH_READY_TIMEOUT,
+                abort=self._hostSetUpAbort)
+            self._phaseTimings.record('waitForSSH', secondsToReady, host=name)
+            with self._phaseTimings.measure('connect', host=name):
+                host.ssh.connect()
+            if self._hostSetUpAbort.is_set():
+                raise readinessprober.Aborted(name)
         except:
+            if self._hostSetUpAbort.is_set():
+                logging.info("Stopped setting up host '%(name)s', since setting up another host failed",
+                             dict(name=name))
+                raise
+            self._hostSetUpAbort.set()
             logging.error(
                 "Rootfs did not wake up after inauguration. Saving serial file in postmortem dir "
                 "host %(id)s name %(name)s", dict(id=host.node.id(), name=name))
             host.logbeam.postMortemSerial()
             raise
         logging.info("Connected to %(node)s.", dict(node=name))
-        self._hosts[name] = host
-        getattr(self._test, 'setUpHost', lambda x: x)(name)
+        try:
+            self._raiseIfHostSetUpAborted(name)
+            if name in self._hostsToReinaugurate:
+                with self._phaseTimings.measure('reinaugurate', host=name):
+                    self._reinaugurateHost(host)
+            with self._hostsLock:
+                self._raiseIfHostSetUpAborted(name)
+                self._hosts[name] = host
+            with self._phaseTimings.measure('setUpHost', host=name):
+                getattr(self._test, 'setUpHost', lambda x: x)(name)
+            with self._hostsLock:
+                self._setUpHostNames.add(name)
+        except:
+            self._hostSetUpAbort.set()
+            raise
+
+    def _raiseIfHostSetUpAborted(self, name):
+        "Hosts whose allocation is about to be freed must not be used anymore"
+        if self._hostSetUpAbort.is_set():
+            logging.info("Stopped setting up host '%(name)s', since setting up another host failed",
+                         dict(name=name))
+            raise readinessprober.Aborted(name)
+
+    def _reinaugurateHost(self, host):
+        import strato.racktest.hostundertest.optionalplugins.inauguratorplugin
+        hostRackattack = self._hostToRackattackMap[host.name]
+        requirements = self._createRackattackToHostMap(self._test.HOSTS)[hostRackattack][host.name]
+        pair = (requirements['rootfs'], requirements.get('product', 'rootfs'))
+        label = rootfslabel.resolve([pair], phaseTimings=self._phaseTimings)[pair].label()
+        logging.info("Host '%(name)s' was reused from a previous scenario, reinaugurating it with "
+                     "'%(label)s'...", dict(name=host.name, label=label))
+        host.inaugurator.reinaugurate(rawLabel=label)
+        host.ssh.waitForTCPServer(timeout=self.REINAUGURATION_TIMEOUT)
+        host.ssh.connect()
+        logging.info("Reinaugurated host '%(name)s'.", dict(name=host.name))
 
     def _setUpDetachedClusters(self):
         with open("clusters.conf", "r") as confFile:
             detachedClusters = yaml.load(confFile)
-        clusters = {}
+        nodes = dict()
+        nodeToClusterMap = dict()
         for clusterName in detachedClusters.keys():
-            clusters[clusterName] = {}
             for nodeName, nodeInfo in detachedClusters[clusterName]['nodes'].iteritems():
-                node = DetachedNode(username=nodeInfo['credentials']['username'],
-                                    password=nodeInfo['credentials']['password'],
-                                    hostname=nodeInfo['credentials']['hostname'],
-                                    port=nodeInfo['credentials']['port'],
-                                    ipAddress=nodeInfo['ipAddress'],
-                                    nodeId=nodeInfo['nodeId'])
-                host = hostundertest.host.Host(node, nodeName)
-                self._hosts[nodeName] = host
-                try:
-                    host.ssh.waitForTCPServer()
-                    host.ssh.connect()
-                except:
-                    logging.error("Could not connect to detached servers")
-                    raise
-                clusters[clusterName][nodeName] = host
+                nodes[nodeName] = DetachedNode(username=nodeInfo['credentials']['username'],
+                                               password=nodeInfo['credentials']['password'],
+                                               hostname=nodeInfo['credentials']['hostname'],
+                                               port=nodeInfo['credentials']['port'],
+                                               ipAddress=nodeInfo['ipAddress'],
+                                               nodeId=nodeInfo['nodeId'])
+                nodeToClusterMap[nodeName] = clusterName
+                self._nodeIDs[nodeName] = nodeInfo['nodeId']
+        deadline = time.time() + self.DETACHED_CONNECT_TIMEOUT
+        with self._phaseTimings.measure('setUpHosts'):
+            concurrently.run([dict(callback=self._setUpDetachedHost, args=(nodeName, node, deadline))
+                              for nodeName, node in nodes.iteritems()])
+        clusters = dict((clusterName, {}) for clusterName in detachedClusters.keys())
+        for nodeName, clusterName in nodeToClusterMap.iteritems():
+            clusters[clusterName][nodeName] = self._hosts[nodeName]
         return clusters
 
+    def _setUpDetachedHost(self, name, node, deadline):
+        "All detached hosts are connected concurrently, and must be ready by the same deadline"
+        host = hostundertest.host.Host(node, name)
+        credentials = node.rootSSHCredentials()
+        try:
+            secondsToReady = readinessprober.shared().waitForSSH(
+                name, credentials['hostname'], credentials['port'], timeout=max(deadline - time.time(), 0))
+            self._phaseTimings.record('waitForSSH', secondsToReady, host=name)
+            with self._phaseTimings.measure('connect', host=name):
+                host.ssh.connect()
+        except:
+            logging.error("Could not connect to detached host '%(name)s' (%(hostname)s:%(port)s)",
+                          dict(name=name, hostname=credentials['hostname'], port=credentials['port']))
+            raise
+        logging.info("Connected to %(node)s.", dict(node=name))
+        self._hosts[name] = host
+        with self._phaseTimings.measure('setUpHost', host=name):
+            getattr(self._test, 'setUpHost', lambda x: x)(name)
+
     def _setUp(self):
         logging.info("Setting up test in '%(filename)s'", dict(filename=self._filename()))
         if self.RUN_ON_DETACHED:
             self._test._clusters = self._setUpDetachedClusters()
         else:
-            for allocation in self._allocations.values():
-                allocation.runOnEveryHost(self._setUpHost, "Setting up host")
+            if self._hostSetUpFailures:
+                failure = self._hostSetUpFailures[0]
+                raise failure[0], failure[1], failure[2]
             if not hasattr(self._test, '_clusters'):
                 self._test._clusters = self._getClusters()
         try:
-            getattr(self._test, 'setUp', lambda: None)()
+            with self._phaseTimings.measure('setUp'):
+                getattr(self._test, 'setUp', lambda: None)()
         except:
             logging.exception(
                 "Failed setting up test in '%(filename)s'", dict(filename=self._filename()))
@@ -218,7 +408,8 @@ class Executioner:
     def _run(self):
         logging.progress("Running test in '%(filename)s'", dict(filename=self._filename()))
         try:
-            self._test.run()
+            with self._phaseTimings.measure('run'):
+                self._test.run()
             suite.anamnesis['testSucceeded'] = True
             logging.success(
                 "Test completed successfully, in '%(filename)s', with %(asserts)d successfull asserts",
@@ -243,28 +434,124 @@ class Executioner:
             suite.outputExceptionStackTrace()
             raise
         tearDownHost = getattr(self._test, 'tearDownHost', lambda x: x)
+        if self.RUN_ON_DETACHED:
+            concurrently.run([dict(callback=tearDownHost, args=(name,)) for name in self._hosts])
+            return
         for allocation in self._allocations.values():
             allocation.runOnEveryHost(tearDownHost, "Tearing down host")
 
     def _createAllocations(self):
+        """
+        Allocates from all rackattacks concurrently. The hosts of each allocation are set up as soon as
+        it is done, while other rackattacks may still be allocating. The test timer is armed once the last
+        allocation is done, so that waiting for allocations does not count against ABORT_TEST_TIMEOUT
+        """
         rackattackToHostMap = self._createRackattackToHostMap(self._test.HOSTS)
-        allocations = dict()
-        for rackattack, hostsFromRackattack in rackattackToHostMap.iteritems():
-            logging.progress('Allocating %(_hosts)s from Rackattack %(_rackattack)s', dict(
-                _hosts=hostsFromRackattack.keys(), _rackattack=rackattack))
-            try:
-                allocations[rackattack] = rackattackallocation.RackAttackAllocation(
-                    hosts=hostsFromRackattack)
-            except Exception:
-                logging.error('failed to allocate from %(_rackattack)s, '
-                              'freeing all allocations',
-                              dict(_rackattack=rackattack))
-                for allocation in allocations:
-                    self._tryFreeAllocation(allocation)
+        self._allocations = dict()
+        self._allocationCount = len(rackattackToHostMap)
+        allocationDurations = []
+        allocationFailures = []
+        abort = threading.Event()
+        try:
+            concurrently.run([
+                dict(callback=self._allocateFromRackattack,
+                     args=(rackattack, hostsFromRackattack, abort, allocationDurations, allocationFailures))
+                for rackattack, hostsFromRackattack in rackattackToHostMap.iteritems()])
+        except Exception:
+            if self._allocationIDs:
                 raise
-            logging.progress(
-                'Finished allocating hosts from Rackattack %(_rackattack)s', dict(_rackattack=rackattack))
-        return allocations
+            logging.error('failed to allocate from all rackattacks, freeing all allocations')
+            for allocation in self._allocations.values():
+                self._tearDownSetUpHostsOf(allocation)
+            if self._hosts:
+                self._cleanUp()
+            for allocation in self._allocations.values():
+                if allocation.nodes():
+                    self._tryFreeAllocation(allocation)
+            failures = self._hostSetUpFailures + allocationFailures
+            if failures:
+                failure = failures[0]
+                raise failure[0], failure[1], failure[2]
+            raise
+        finally:
+            self._phaseTimings.record('allocation', max(allocationDurations or [0]))
+        return self._allocations
+
+    def _allocateFromRackattack(self, rackattack, hostsFromRackattack, abort, allocationDurations,
+                                allocationFailures):
+        logging.progress('Allocating %(_hosts)s from Rackattack %(_rackattack)s', dict(
+            _hosts=hostsFromRackattack.keys(), _rackattack=rackattack))
+        before = time.time()
+        try:
+            allocation = rackattackallocation.RackAttackAllocation(
+                hosts=hostsFromRackattack, allocationID=self._allocationIDs.get(rackattack), abort=abort,
+                phaseTimings=self._phaseTimings)
+        except rackattackallocation.AllocationAborted:
+            logging.info('Aborted allocation from %(_rackattack)s', dict(_rackattack=rackattack))
+            raise
+        except Exception:
+            logging.error('failed to allocate from %(_rackattack)s, aborting allocation from other '
+                          'rackattacks', dict(_rackattack=rackattack))
+            allocationFailures.append(sys.exc_info())
+            abort.set()
+            raise
+        finally:
+            allocationDurations.append(time.time() - before)
+        self._allocations[rackattack] = allocation
+        logging.progress(
+            'Finished allocating hosts from Rackattack %(_rackattack)s', dict(_rackattack=rackattack))
+        if len(self._allocations) == self._allocationCount:
+            self._armTestTimer()
+        self._setUpHostsOf(allocation, abort)
+
+    def _setUpHostsOf(self, allocation, abort):
+        """
+        The first host that fails stops setting up the others, the allocation is freed once they stopped,
+        and allocations still in progress from other rackattacks are aborted. Failures are raised later by
+        _setUp, so that the test is torn down and its other allocations freed
+        """
+        try:
+            with self._phaseTimings.measure('setUpHosts'):
+                allocation.runOnEveryHost(self._setUpHost, "Setting up host", failFast=True,
+                                          stopTimeout=self.HOST_SET_UP_STOP_TIMEOUT)
+        except:
+            logging.exception("Failed setting up hosts")
+            self._hostSetUpFailures.append(sys.exc_info())
+            self._hostSetUpAbort.set()
+            abort.set()
+            if not self._allocationIDs:
+                self._freeAllocationOfFailedHosts(allocation)
+
+    def _freeAllocationOfFailedHosts(self, allocation):
+        names = allocation.nodes().keys()
+        logging.info("Freeing the allocation of %(names)s right away", dict(names=names))
+        self._tearDownSetUpHostsOf(allocation)
+        self._tryFreeAllocation(allocation)
+        with self._hostsLock:
+            for name in names:
+                self._hosts.pop(name, None)
+
+    def _tearDownSetUpHostsOf(self, allocation):
+        "Hosts that finished setUpHost are torn down before their allocation is freed, though no test ran"
+        with self._hostsLock:
+            names = [name for name in allocation.nodes() if name in self._setUpHostNames]
+            self._setUpHostNames.difference_update(names)
+        if not names:
+            return
+        tearDownHost = getattr(self._test, 'tearDownHost', lambda x: x)
+        try:
+            concurrently.run([dict(callback=tearDownHost, args=(name,)) for name in names],
+                             description="Tearing down host")
+        except:
+            logging.exception("Failed tearing down hosts %(names)s", dict(names=names))
+
+    def _armTestTimer(self):
+        with self._testTimerLock:
+            if self._testTimerArmed:
+                return
+            self._testTimerArmed = True
+        timeoutthread.TimeoutThread(self._testTimeout, self._testTimedOut)
+        logging.info("Test timer armed. Timeout in %(seconds)d seconds", dict(seconds=self._testTimeout))
 
     def _getClusters(self):
         clusters = dict()
@@ -277,53 +564,13 @@ class Executioner:
         return clusters
 
     def _createHostToClusterMap(self, clustersDefinition):
-        hostToClusterMap = dict()
-        if clustersDefinition.get(self.MULTICLUSTER_ALLOCATION, False):
-            for clusterName, clusterHosts in clustersDefinition.iteritems():
-                if clusterName == self.MULTICLUSTER_ALLOCATION:
-                    continue
-                for name in clusterHosts:
-                    hostToClusterMap[name] = clusterName
-        else:
-            [hostToClusterMap.setdefault(name, self.DEFAULT_CLUSTER_NAME)
-             for name in clustersDefinition]
-        return hostToClusterMap
+        return hostsdefinition.hostToClusterMap(clustersDefinition)
 
     def _createRackattackToHostMap(self, clustersDefinition):
-        rackattackToHostMap = dict()
-        if clustersDefinition.get(self.MULTICLUSTER_ALLOCATION, False):
-            for clusterName, clusterHosts in clustersDefinition.iteritems():
-                if clusterName == self.MULTICLUSTER_ALLOCATION:
-                    continue
-                for name, parameters in clusterHosts.iteritems():
-                    requiredRackattack = parameters.get('rackattack', self.DEFAULT_RACKATTACK)
-                    rackattackHosts = rackattackToHostMap.setdefault(requiredRackattack, {})
-                    rackattackHosts[name] = parameters
-        else:
-            for name, parameters in clustersDefinition.iteritems():
-                requiredRackattack = parameters.get('rackattack', self.DEFAULT_RACKATTACK)
-                rackattackHosts = rackattackToHostMap.setdefault(requiredRackattack, {})
-
-                rackattackHosts[name] = parameters
-        return rackattackToHostMap
+        return hostsdefinition.rackattackToHostMap(clustersDefinition)
 
     def _createHostToRackattackMap(self, clustersDefinition):
-        hostToRackAttackMap = dict()
-        if clustersDefinition.get(self.MULTICLUSTER_ALLOCATION, False):
-            for clusterName, clusterHosts in clustersDefinition.iteritems():
-                if clusterName == self.MULTICLUSTER_ALLOCATION:
-                    continue
-                for name, parameters in clusterHosts.iteritems():
-                    requiredRackattack = parameters.get('rackattack', self.DEFAULT_RACKATTACK)
-                    if name in hostToRackAttackMap:
-                        logging.error('node %(_nodeName)s appears more than once', dict(_nodeName=name))
-                        raise Exception('node names must be unique')
-                    hostToRackAttackMap[name] = requiredRackattack
-        else:
-            for name, parameters in clustersDefinition.iteritems():
-                requiredRackattack = parameters.get('rackattack', self.DEFAULT_RACKATTACK)
-                hostToRackAttackMap[name] = requiredRackattack
-        return hostToRackAttackMap
+        return hostsdefinition.hostToRackattackMap(clustersDefinition)
 
     def _tryFreeAllocation(self, allocation):
         try:
@@ -0,0 +1,65 @@
+import logging
+
+DEFAULT_RACKATTACK = 'defaultRackattack'
+MULTICLUSTER_ALLOCATION = 'multicluster'
+DEFAULT_CLUSTER_NAME = 'cluster1'
+
+
+def isMulticluster(clustersDefinition):
+    return bool(clustersDefinition.get(MULTICLUSTER_ALLOCATION, False))
+
+
+def hostToClusterMap(clustersDefinition):
+    result = dict()
+    if isMulticluster(clustersDefinition):
+        for clusterName, clusterHosts in clustersDefinition.iteritems():
+            if clusterName == MULTICLUSTER_ALLOCATION:
+                continue
+            for name in clusterHosts:
+                result[name] = clusterName
+    else:
+        [result.setdefault(name, DEFAULT_CLUSTER_NAME) for name in clustersDefinition]
+    return result
+
+
+def rackattackToHostMap(clustersDefinition):
+    result = dict()
+    if isMulticluster(clustersDefinition):
+        for clusterName, clusterHosts in clustersDefinition.iteritems():
+            if clusterName == MULTICLUSTER_ALLOCATION:
+                continue
+            for name, parameters in clusterHosts.iteritems():
+                requiredRackattack = parameters.get('rackattack', DEFAULT_RACKATTACK)
+                rackattackHosts = result.setdefault(requiredRackattack, {})
+                rackattackHosts[name] = parameters
+    else:
+        for name, parameters in clustersDefinition.iteritems():
+            requiredRackattack = parameters.get('rackattack', DEFAULT_RACKATTACK)
+            rackattackHosts = result.setdefault(requiredRackattack, {})
+            rackattackHosts[name] = parameters
+    return result
+
+
+def hostToRackattackMap(clustersDefinition):
+    result = dict()
+    if isMulticluster(clustersDefinition):
+        for clusterName, clusterHosts in clustersDefinition.iteritems():
+            if clusterName == MULTICLUSTER_ALLOCATION:
+                continue
+            for name, parameters in clusterHosts.iteritems():
+                requiredRackattack = parameters.get('rackattack', DEFAULT_RACKATTACK)
+                if name in result:
+                    logging.error('node %(_nodeName)s appears more than once', dict(_nodeName=name))
+                    raise Exception('node names must be unique')
+                result[name] = requiredRackattack
+    else:
+        for name, parameters in clustersDefinition.iteritems():
+            requiredRackattack = parameters.get('rackattack', DEFAULT_RACKATTACK)
+            result[name] = requiredRackattack
+    return result
+
+
+def hostsDemand(clustersDefinition):
+    "Number of hosts required from each rackattack"
+    return dict((rackattack, len(hosts))
+                for rackattack, hosts in rackattackToHostMap(clustersDefinition).iteritems())
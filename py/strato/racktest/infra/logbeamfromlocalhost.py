@@ -24,6 +24,12 @@ def beam(*args, **kwargs):
     logbeam.upload.Upload().upload(*args, **kwargs)
 
 
+def beamsIntoLocalLogsDirectory():
+    "Whether beamed files end up in this process's logs directory, as no other logbeam is configured"
+    _configureBeamFromLocal()
+    return not _previousLogbeamConfigExisted
+
+
 def logbeamConfigurationForPeer(myHostnameAsPeerSeesIt, under):
     _configureBeamFromLocal()
     assert _previousLogbeamConfigExisted is not None
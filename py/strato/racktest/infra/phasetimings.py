@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+import threading
+import time
+
+
+class PhaseTimings:
+    """
+    Wall clock seconds spent in each phase of a scenario, overall and per host. Measuring the same phase
+    more than once accumulates. Counters (e.g. cache hits) are kept alongside, and only reported once
+    counted
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases = dict()
+        self._hosts = dict()
+        self._counters = dict()
+
+    @contextmanager
+    def measure(self, phase, host=None):
+        before = time.time()
+        try:
+            yield
+        finally:
+            self.record(phase, time.time() - before, host=host)
+
+    def record(self, phase, seconds, host=None):
+        with self._lock:
+            phases = self._phases if host is None else self._hosts.setdefault(host, dict())
+            phases[phase] = phases.get(phase, 0) + seconds
+
+    def count(self, counter, increment=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + increment
+
+    def asDict(self):
+        with self._lock:
+            result = dict(phases=dict(self._phases),
+                          hosts=dict((host, dict(phases)) for host, phases in self._hosts.iteritems()))
+            if self._counters:
+                result['counters'] = dict(self._counters)
+            return result
+
+
+def aggregate(timingsList):
+    """
+    Summarizes the 'phases' of many scenarios: total, count, mean and maximum seconds per phase. Per host
+    phases are summarized under their phase name, once per host
+    """
+    samples = dict()
+    for timings in timingsList:
+        for phase, seconds in timings.get('phases', {}).iteritems():
+            samples.setdefault(phase, []).append(seconds)
+        for phases in timings.get('hosts', {}).values():
+            for phase, seconds in phases.iteritems():
+                samples.setdefault(phase, []).append(seconds)
+    return dict((phase, dict(total=sum(values), count=len(values), mean=sum(values) / len(values),
+                             maximum=max(values)))
+                for phase, values in samples.iteritems())
@@ -8,46 +8,88 @@ import tempfile
 import os
 import shutil
 import time
+import threading
+import gzip
+import sys
 from strato.racktest.infra import logbeamfromlocalhost
+from strato.common import log
+
+_POST_MORTEM_CHUNK_SIZE = 1024 * 1024
+_POST_MORTEM_WAIT_DEFAULT = 30
+_postMortems = []
+_postMortemsLock = threading.Lock()
+
+
+class AllocationAborted(Exception):
+    pass
 
 
 class RackAttackAllocation:
     _NO_PROGRESS_TIMEOUT = 5 * 60
+    _WAIT_TIMEOUT = 60
+    _CHECK_INTERVAL = 1
 
-    def __init__(self, hosts, allocationID=None):
+    def __init__(self, hosts, allocationID=None, abort=None, phaseTimings=None):
         self._hosts = hosts
+        self._abort = abort
+        self._phaseTimings = phaseTimings
+        self._condition = threading.Condition()
         self._overallPercent = 0
+        self._lastProgress = time.time()
+        self._waiting = True
+        self._allocated = False
+        self._waitFailure = None
         self._client = clientfactory.factory()
         if allocationID is None:
             self._allocation = self._client.allocate(
                 requirements=self._rackattackRequirements(), allocationInfo=self._rackattackAllocationInfo())
+            self._allocationID = self._allocation.id()
         else:
             self._allocation = self._client.allocateExisting(
                 requirements=self._rackattackRequirements(), allocationID=allocationID)
+            self._allocationID = allocationID
         self._allocation.registerProgressCallback(self._progress)
 #       self._allocation.setForceReleaseCallback()
         try:
             self._waitForAllocation()
+        except AllocationAborted:
+            if allocationID is None:
+                logging.info("Allocation aborted, freeing it")
+                self._tryFree()
+            raise
         except:
             logging.exception("Allocation failed, attempting post mortem")
-            self._postMortemAllocation()
+            self._postMortemAllocationInBackground()
             raise
         self._nodes = self._allocation.nodes()
 
     def nodes(self):
         return self._nodes
 
+    def allocationID(self):
+        return self._allocationID
+
     def free(self):
         self._allocation.free()
+        self._nodes = dict()
+
+    def _tryFree(self):
+        try:
+            self._allocation.free()
+        except:
+            logging.exception("Unable to free aborted allocation")
 
     def _rackattackRequirements(self):
         result = {}
+        labels = rootfslabel.resolve(
+            [(requirements['rootfs'], requirements.get('product', 'rootfs'))
+             for requirements in self._hosts.values()], phaseTimings=self._phaseTimings)
         for name, requirements in self._hosts.iteritems():
             pool = None
             if "pool" in requirements:
                 pool = requirements["pool"]
             serverIDWildcard = requirements.get("serverIDWildcard", "")
-            rootfs = rootfslabel.RootfsLabel(requirements['rootfs'], requirements.get('product', 'rootfs'))
+            rootfs = labels[(requirements['rootfs'], requirements.get('product', 'rootfs'))]
             hardwareConstraints = dict(requirements)
             del hardwareConstraints['rootfs']
             result[name] = api.Requirement(
@@ -60,10 +102,10 @@ class RackAttackAllocation:
         nice = max(nice, float(os.environ.get('RACKTEST_MINIMUM_NICE_FOR_RACKATTACK', 0)))
         return api.AllocationInfo(user=config.USER, purpose="racktest", nice=nice)
 
-    def runOnEveryHost(self, callback, description):
+    def runOnEveryHost(self, callback, description, failFast=False, stopTimeout=0):
         concurrently.run([
             dict(callback=callback, args=(name,))
-            for name in self._nodes])
+            for name in self._nodes], description=description, failFast=failFast, stopTimeout=stopTimeout)
 
     def releaseHost(self, name):
         if name not in self._nodes:
@@ -73,7 +115,15 @@ class RackAttackAllocation:
             self.free()
         else:
             self._allocation.releaseHost(name)
-        del self._nodes[name]
+            del self._nodes[name]
+
+    def _postMortemAllocationInBackground(self):
+        "Lets the failure propagate, and other allocations be freed, while the pack is fetched"
+        thread = threading.Thread(target=self._postMortemAllocation)
+        thread.daemon = True
+        with _postMortemsLock:
+            _postMortems.append(thread)
+        thread.start()
 
     def _postMortemAllocation(self):
         try:
@@ -81,39 +131,135 @@ class RackAttackAllocation:
         except:
             logging.exception("Unable to get post mortem pack from rackattack provider")
             return
-        tempDir = tempfile.mkdtemp()
+        compress = os.getenv('RACKTEST_COMPRESS_POST_MORTEM', 'false').lower() == 'true'
+        if compress:
+            filename += ".gz"
         try:
-            fullPath = os.path.join(tempDir, filename)
-            with open(fullPath, 'wb') as f:
-                f.write(contents)
-            logbeamfromlocalhost.beam([fullPath])
-        finally:
-            shutil.rmtree(tempDir, ignore_errors=True)
-        logging.info("Beamed post mortem pack into %(filename)s", dict(filename=filename))
+            if logbeamfromlocalhost.beamsIntoLocalLogsDirectory():
+                _writeInChunks(os.path.join(log.config.LOGS_DIRECTORY, filename), contents, compress)
+                logging.info("Wrote post mortem pack into %(filename)s", dict(filename=filename))
+                return
+            tempDir = tempfile.mkdtemp()
+            try:
+                fullPath = os.path.join(tempDir, filename)
+                _writeInChunks(fullPath, contents, compress)
+                logbeamfromlocalhost.beam([fullPath])
+            finally:
+                shutil.rmtree(tempDir, ignore_errors=True)
+            logging.info("Beamed post mortem pack into %(filename)s", dict(filename=filename))
+        except:
+            logging.exception("Unable to save post mortem pack %(filename)s", dict(filename=filename))
 
     def _progress(self, overallPercent, event):
-        self._overallPercent = overallPercent
+        with self._condition:
+            if overallPercent != self._overallPercent:
+                self._overallPercent = overallPercent
+                self._lastProgress = time.time()
+                self._condition.notify_all()
 
     def _waitForAllocation(self):
+        """
+        A background thread blocks in the allocation's wait, and wakes this one up the moment the
+        allocation is done or died. Meanwhile, progress is logged as reported by the progress callback,
+        and the abort event, the allocation's death and the no progress timeout are checked every
+        _CHECK_INTERVAL, since the wait may not return as soon as the allocation died
+        """
         logging.info("Waiting for all nodes to be allocated...")
-        INTERVAL = 5
+        waiter = threading.Thread(target=self._waitInBackground)
+        waiter.daemon = True
+        waiter.start()
         lastOverallPercent = 0
-        lastOverallPercentChange = time.time()
-        while self._allocation.dead() is None:
-            try:
-                self._allocation.wait(timeout=INTERVAL)
-                return
-            except:
-                if self._overallPercent != lastOverallPercent:
-                    lastOverallPercent = self._overallPercent
-                    lastOverallPercentChange = time.time()
+        try:
+            while True:
+                with self._condition:
+                    if not self._allocated and self._waitFailure is None:
+                        self._condition.wait(self._CHECK_INTERVAL)
+                    allocated, failure = self._allocated, self._waitFailure
+                    overallPercent, lastProgress = self._overallPercent, self._lastProgress
+                if allocated:
+                    return
+                if failure is not None:
+                    raise failure[0], failure[1], failure[2]
+                dead = self._allocation.dead()
+                if dead is not None:
+                    raise Exception(dead)
+                if self._abort is not None and self._abort.is_set():
+                    raise AllocationAborted()
+                if overallPercent != lastOverallPercent:
+                    lastOverallPercent = overallPercent
                     if lastOverallPercent < 100:
                         msg = "Allocation %(percent)s%% complete"
                     else:
                         msg = "Allocation %(percent)s%% complete, but still waiting for the 'go-ahead' " \
                               "from Rackattack..."
                     logging.progress(msg, dict(percent=lastOverallPercent))
-                if time.time() > lastOverallPercentChange + self._NO_PROGRESS_TIMEOUT:
+                if time.time() > lastProgress + self._NO_PROGRESS_TIMEOUT:
                     raise Exception("Allocation progress hanged at %(percent)s%% for %(seconds)s seconds",
                                     dict(percent=lastOverallPercent, seconds=self._NO_PROGRESS_TIMEOUT))
-        raise Exception(self._allocation.dead())
+        finally:
+            with self._condition:
+                self._waiting = False
+
+    def _waitInBackground(self):
+        """
+        The allocation's wait raises both when it timed out and when the allocation failed, so a wait that
+        raised well before its timeout is taken as a failure
+        """
+        while True:
+            with self._condition:
+                if not self._waiting:
+                    return
+            before = time.time()
+            try:
+                self._allocation.wait(timeout=self._WAIT_TIMEOUT)
+            except:
+                failure = sys.exc_info()
+                if time.time() - before >= 0.9 * self._WAIT_TIMEOUT and self._allocation.dead() is None:
+                    continue
+                if self._allocation.dead() is not None:
+                    try:
+                        raise Exception(self._allocation.dead())
+                    except:
+                        failure = sys.exc_info()
+                with self._condition:
+                    self._waitFailure = failure
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._allocated = True
+                self._condition.notify_all()
+            return
+
+
+def freeExisting(allocationID):
+    "Frees an allocation made by another process, without resolving labels or waiting for the allocation"
+    clientfactory.factory().allocateExisting(requirements=dict(), allocationID=allocationID).free()
+
+
+def waitForPostMortems(timeout=None):
+    """
+    Waits for the post mortem packs of failed allocations to be saved, up to 'timeout' seconds
+    (RACKTEST_POST_MORTEM_WAIT by default), so that a failed scenario does not hold its runner slot for
+    long. Packs still being saved after that are abandoned when the process exits
+    """
+    if timeout is None:
+        timeout = float(os.getenv('RACKTEST_POST_MORTEM_WAIT', _POST_MORTEM_WAIT_DEFAULT))
+    with _postMortemsLock:
+        threads = list(_postMortems)
+        del _postMortems[:]
+    if threads:
+        logging.info("Waiting for %(count)d post mortem packs to be saved", dict(count=len(threads)))
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+    unfinished = len([thread for thread in threads if thread.is_alive()])
+    if unfinished:
+        logging.warning("Gave up waiting for %(count)d post mortem packs after %(seconds)s seconds, they "
+                        "may be missing or incomplete", dict(count=unfinished, seconds=timeout))
+
+
+def _writeInChunks(filename, contents, compress):
+    "Writes chunk by chunk, so compressing does not hold a second copy of the whole pack in memory"
+    with (gzip.open(filename, 'wb') if compress else open(filename, 'wb')) as f:
+        for offset in xrange(0, len(contents), _POST_MORTEM_CHUNK_SIZE):
+            f.write(contents[offset: offset + _POST_MORTEM_CHUNK_SIZE])
@@ -0,0 +1,254 @@
+import threading
+import logging
+import socket
+import select
+import errno
+import time
+import sys
+import os
+
+SSH_BANNER_PREFIX = "SSH-"
+
+
+class Aborted(Exception):
+    pass
+
+
+class ReadinessProber:
+    """
+    Waits for the SSH servers of many hosts from a single thread: every pending endpoint gets a
+    non-blocking connect, retried with exponential backoff, and a host is ready only once its server
+    sent the SSH banner, not merely accepted the connection. 'onReady(name, secondsToReady)' is called
+    from the prober's thread the moment a host is ready, or with None once its timeout passed or probing
+    it failed, e.g. since its hostname does not resolve
+    """
+    _INITIAL_BACKOFF = 0.1
+    _MAXIMUM_BACKOFF = 5
+    _ATTEMPT_TIMEOUT = 10
+    _BANNER_MAXIMUM_LENGTH = 256
+    _ABORT_CHECK_INTERVAL = 0.2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        self._targets = dict()
+        self._added = []
+        self._removed = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, name, hostname, port, onReady, timeout):
+        "Returns a handle for unwatch"
+        target = _Target(name, (hostname, port), onReady, timeout, self._INITIAL_BACKOFF)
+        with self._lock:
+            self._added.append(target)
+        os.write(self._wakeupWrite, "x")
+        return target
+
+    def unwatch(self, handle):
+        "Stops probing the host, without calling its 'onReady'"
+        with self._lock:
+            self._removed.append(handle)
+        os.write(self._wakeupWrite, "x")
+
+    def waitForSSH(self, name, hostname, port, timeout, abort=None):
+        """
+        Blocks until the host is ready and returns the seconds it took, raises if the timeout passed, and
+        Aborted once the 'abort' event is set
+        """
+        done = threading.Event()
+        result = []
+
+        def onReady(unused, secondsToReady):
+            result.append(secondsToReady)
+            done.set()
+        handle = self.watch(name, hostname, port, onReady, timeout)
+        deadline = time.time() + timeout
+        while not done.is_set():
+            if abort is not None and abort.is_set():
+                self.unwatch(handle)
+                raise Aborted(name)
+            if time.time() >= deadline:
+                self.unwatch(handle)
+                break
+            done.wait(min(self._ABORT_CHECK_INTERVAL, max(deadline - time.time(), 0)))
+        if not result or result[0] is None:
+            if handle.failure is not None:
+                raise Exception("Probing the SSH server of '%s' (%s:%s) failed: %s" % (
+                    name, hostname, port, handle.failure))
+            raise Exception("SSH server of '%s' (%s:%s) not ready within %s seconds" % (
+                name, hostname, port, timeout))
+        return result[0]
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        os.write(self._wakeupWrite, "x")
+
+    def _loop(self):
+        poller = select.poll()
+        poller.register(self._wakeupRead, select.POLLIN)
+        while True:
+            with self._lock:
+                if self._closed:
+                    break
+                added, self._added = self._added, []
+                removed, self._removed = self._removed, []
+            for target in added:
+                self._targets[id(target)] = target
+            for target in removed:
+                if id(target) in self._targets:
+                    self._disconnect(target, poller)
+                    del self._targets[id(target)]
+            now = time.time()
+            for target in self._targets.values():
+                try:
+                    self._advance(target, poller, now)
+                except:
+                    self._failed(target, poller)
+            try:
+                events = poller.poll(int(self._pollTimeout() * 1000) + 1)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            byDescriptor = dict((target.descriptor(), target) for target in self._targets.values()
+                                if target.socket is not None)
+            for descriptor, event in events:
+                if descriptor == self._wakeupRead:
+                    os.read(self._wakeupRead, 4096)
+                elif descriptor in byDescriptor and id(byDescriptor[descriptor]) in self._targets:
+                    try:
+                        self._handleEvent(byDescriptor[descriptor], event, poller)
+                    except:
+                        self._failed(byDescriptor[descriptor], poller)
+        for target in self._targets.values():
+            self._disconnect(target, poller)
+        os.close(self._wakeupRead)
+        os.close(self._wakeupWrite)
+
+    def _advance(self, target, poller, now):
+        if now >= target.deadline:
+            self._disconnect(target, poller)
+            self._finish(target, None)
+        elif target.socket is not None and now >= target.attemptDeadline:
+            self._retry(target, poller)
+        elif target.socket is None and now >= target.nextAttempt:
+            self._connect(target, poller)
+
+    def _connect(self, target, poller):
+        target.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        target.socket.setblocking(0)
+        target.banner = ""
+        target.attemptDeadline = time.time() + self._ATTEMPT_TIMEOUT
+        result = target.socket.connect_ex(target.address)
+        if result == 0:
+            poller.register(target.descriptor(), select.POLLIN)
+        elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            target.connecting = True
+            poller.register(target.descriptor(), select.POLLOUT)
+        else:
+            self._retry(target, poller)
+
+    def _handleEvent(self, target, event, poller):
+        if target.connecting:
+            target.connecting = False
+            if target.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                self._retry(target, poller)
+                return
+            poller.modify(target.descriptor(), select.POLLIN)
+            return
+        try:
+            data = target.socket.recv(self._BANNER_MAXIMUM_LENGTH)
+        except socket.error:
+            self._retry(target, poller)
+            return
+        target.banner += data
+        if target.banner.startswith(SSH_BANNER_PREFIX):
+            self._disconnect(target, poller)
+            self._finish(target, time.time() - target.startedAt)
+        elif not data or not SSH_BANNER_PREFIX.startswith(target.banner) or \
+                len(target.banner) >= self._BANNER_MAXIMUM_LENGTH:
+            self._retry(target, poller)
+
+    def _retry(self, target, poller):
+        self._disconnect(target, poller)
+        target.nextAttempt = time.time() + target.backoff
+        target.backoff = min(target.backoff * 2, self._MAXIMUM_BACKOFF)
+
+    def _disconnect(self, target, poller):
+        if target.socket is None:
+            return
+        try:
+            poller.unregister(target.descriptor())
+        except KeyError:
+            pass
+        target.socket.close()
+        target.socket = None
+        target.connecting = False
+
+    def _failed(self, target, poller):
+        logging.exception("Probing the SSH server of '%(name)s' (%(address)s) failed", dict(
+            name=target.name, address=target.address))
+        target.failure = sys.exc_info()[1]
+        try:
+            self._disconnect(target, poller)
+        except:
+            logging.exception("Unable to close the probe of '%(name)s'", dict(name=target.name))
+            target.socket = None
+        if id(target) in self._targets:
+            self._finish(target, None)
+
+    def _finish(self, target, secondsToReady):
+        del self._targets[id(target)]
+        try:
+            target.onReady(target.name, secondsToReady)
+        except:
+            logging.exception("Readiness callback of '%(name)s' failed", dict(name=target.name))
+
+    def _pollTimeout(self):
+        if not self._targets:
+            return self._MAXIMUM_BACKOFF
+        now = time.time()
+        deadlines = []
+        for target in self._targets.values():
+            deadlines.append(target.deadline)
+            deadlines.append(target.attemptDeadline if target.socket is not None else target.nextAttempt)
+        return min(max(min(deadlines) - now, 0), self._MAXIMUM_BACKOFF)
+
+
+class _Target:
+    def __init__(self, name, address, onReady, timeout, backoff):
+        self.name = name
+        self.address = address
+        self.onReady = onReady
+        self.startedAt = time.time()
+        self.deadline = self.startedAt + timeout
+        self.nextAttempt = self.startedAt
+        self.attemptDeadline = None
+        self.backoff = backoff
+        self.socket = None
+        self.connecting = False
+        self.banner = ""
+        self.failure = None
+
+    def descriptor(self):
+        return self.socket.fileno()
+
+
+_shared = None
+_sharedPID = None
+_sharedLock = threading.Lock()
+
+
+def shared():
+    "The prober of this process, started on first use. A forked child gets its own"
+    global _shared
+    global _sharedPID
+    with _sharedLock:
+        if _shared is None or _sharedPID != os.getpid():
+            _shared = ReadinessProber()
+            _sharedPID = os.getpid()
+        return _shared
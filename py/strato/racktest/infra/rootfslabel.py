@@ -1,6 +1,19 @@
 from upseto import gitwrapper
 from upseto import run
+from strato.racktest.infra import concurrently
 import subprocess
+import threading
+import tempfile
+import hashlib
+import logging
+import json
+import stat
+import time
+import os
+
+_DEFAULT_CACHE_FILENAME = os.path.join(os.path.expanduser("~"), ".cache", "racktest", "rootfslabels.json")
+_DEFAULT_CACHE_TTL = 10 * 60
+_MANIFEST_FILENAME = "solvent.manifest"
 
 
 class RootfsLabel:
@@ -35,3 +48,141 @@ class RootfsLabel:
     def _labelExists(self, label):
         with open("/dev/null", "w") as out:
             return subprocess.call(["solvent", "labelexists", "--label", label], stdout=out, stderr=out) == 0
+
+
+class _ResolvedLabel:
+    def __init__(self, label, hint):
+        self._label = label
+        self._hint = hint
+
+    def label(self):
+        return self._label
+
+    def imageHint(self):
+        return self._hint
+
+
+class LabelCache:
+    """
+    Resolved labels in a JSON file shared by all racktest processes of the user, each valid for 'ttl'
+    seconds. Writes replace the file atomically, so concurrent processes may lose each other's entries,
+    but never corrupt the file. The labels are trusted as they are, so the file's directory is created
+    accessible only by the user, and a file that is not owned by the user, or that others may write, is
+    ignored
+    """
+
+    def __init__(self, filename, ttl):
+        self._filename = filename
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    def get(self, keys):
+        "The entries of the keys that are cached and did not expire"
+        now = time.time()
+        with self._lock:
+            entries = self._load()
+        return dict((key, entries[key]) for key in keys
+                    if key in entries and now - entries[key]['resolvedAt'] < self._ttl)
+
+    def put(self, entries):
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            current = dict((key, entry) for key, entry in self._load().iteritems()
+                           if now - entry['resolvedAt'] < self._ttl)
+            for key, entry in entries.iteritems():
+                current[key] = dict(entry, resolvedAt=now)
+            directory = os.path.dirname(self._filename) or "."
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0700)
+            descriptor, temporary = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self._filename))
+            try:
+                with os.fdopen(descriptor, "w") as f:
+                    json.dump(current, f)
+                os.rename(temporary, self._filename)
+            except:
+                if os.path.exists(temporary):
+                    os.unlink(temporary)
+                raise
+
+    def _load(self):
+        if not os.path.exists(self._filename):
+            return dict()
+        try:
+            with open(self._filename) as f:
+                status = os.fstat(f.fileno())
+                if status.st_uid != os.getuid() or status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                    logging.warning(
+                        "Ignoring the rootfs label cache '%(filename)s', since it is not owned by this "
+                        "user, or others may write it", dict(filename=self._filename))
+                    return dict()
+                return json.load(f)
+        except:
+            logging.exception("Unable to read the rootfs label cache '%(filename)s', ignoring it",
+                              dict(filename=self._filename))
+            return dict()
+
+
+def resolve(rootfsAndProducts, phaseTimings=None):
+    """
+    Resolves many (rootfs, product) pairs at once: each distinct pair is looked up in the label cache
+    (disabled by RACKTEST_ROOTFS_LABEL_CACHE_TTL=0), and the missing ones are resolved concurrently.
+    Labels are cached by the current directory and the contents of its solvent.manifest, from which
+    solvent prints them, and "THIS" by the git HEAD of the current directory. Returns a dictionary from
+    each pair to an object with label() and imageHint(), like RootfsLabel's
+    """
+    before = time.time()
+    distinct = set(rootfsAndProducts)
+    ttl = float(os.getenv('RACKTEST_ROOTFS_LABEL_CACHE_TTL', _DEFAULT_CACHE_TTL))
+    cache = LabelCache(os.getenv('RACKTEST_ROOTFS_LABEL_CACHE', _DEFAULT_CACHE_FILENAME), ttl)
+    keys = dict((pair, _cacheKey(*pair)) for pair in distinct) if ttl > 0 else dict()
+    try:
+        found = cache.get(filter(None, keys.values()))
+    except:
+        logging.exception("Unable to read the rootfs label cache, resolving all labels")
+        found = dict()
+    result = dict()
+    missing = []
+    for pair in distinct:
+        key = keys.get(pair)
+        if key in found:
+            result[pair] = _ResolvedLabel(found[key]['label'], found[key]['hint'])
+        else:
+            missing.append(pair)
+    resolved = dict()
+    concurrently.run([dict(callback=_resolveInto, args=(rootfs, product, resolved))
+                      for rootfs, product in missing])
+    result.update(resolved)
+    try:
+        cache.put(dict((keys[pair], dict(label=rootfsLabel.label(), hint=rootfsLabel.imageHint()))
+                       for pair, rootfsLabel in resolved.iteritems() if keys.get(pair) is not None))
+    except:
+        logging.exception("Unable to update the rootfs label cache")
+    if phaseTimings is not None:
+        phaseTimings.record('resolveLabels', time.time() - before)
+        phaseTimings.count('labelCacheHits', len(distinct) - len(missing))
+        phaseTimings.count('labelCacheMisses', len(missing))
+    return result
+
+
+def _resolveInto(rootfs, product, resolved):
+    resolved[(rootfs, product)] = RootfsLabel(rootfs, product)
+
+
+def _cacheKey(rootfs, product):
+    if rootfs != "THIS":
+        return "%s/%s/%s/%s" % (rootfs, product, os.getcwd(), _manifestDigest())
+    try:
+        head = run.run(["git", "rev-parse", "HEAD"]).strip()
+    except:
+        logging.exception("Unable to find the git HEAD, not caching the label of 'THIS'")
+        return None
+    return "THIS/%s/%s/%s" % (product, os.getcwd(), head)
+
+
+def _manifestDigest():
+    if not os.path.exists(_MANIFEST_FILENAME):
+        return "nomanifest"
+    with open(_MANIFEST_FILENAME) as f:
+        return hashlib.sha1(f.read()).hexdigest()
@@ -0,0 +1,95 @@
+import traceback
+import threading
+import logging
+import time
+import sys
+import os
+
+NEVER = 'never'
+TIMEOUT = 'timeout'
+FAILURE = 'failure'
+ALWAYS = 'always'
+MODES = (NEVER, TIMEOUT, FAILURE, ALWAYS)
+
+
+class SamplingProfiler:
+    """
+    Records the stacks of all threads every 'interval' seconds from a background thread, and counts how
+    many times each stack was seen. The counts are written in the folded stacks format read by
+    flamegraph.pl and speedscope: one line per stack, the thread name and the frames from the outermost
+    one joined by ';', followed by the count
+    """
+
+    def __init__(self, interval=0.02):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._counts = dict()
+        self._samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sampleLoop, name="samplingprofiler")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def samples(self):
+        with self._lock:
+            return self._samples
+
+    def folded(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def dump(self, filename):
+        folded = self.folded()
+        with open(filename, "w") as f:
+            for stack, count in sorted(folded.iteritems(), key=lambda item: item[1], reverse=True):
+                f.write("%s %d\n" % (stack, count))
+        logging.info("Wrote %(samples)d profiler samples of %(stacks)d distinct stacks into "
+                     "'%(filename)s'", dict(samples=self.samples(), stacks=len(folded), filename=filename))
+
+    def _sampleLoop(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self._sample()
+            except:
+                logging.exception("Unable to sample thread stacks, stopping the profiler")
+                return
+
+    def _sample(self):
+        names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        ownIdent = self._thread.ident
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == ownIdent:
+                continue
+            stacks.append(";".join([names.get(ident, str(ident))] + _frames(frame)))
+        with self._lock:
+            self._samples += 1
+            for stack in stacks:
+                self._counts[stack] = self._counts.get(stack, 0) + 1
+
+
+def _frames(frame):
+    result = []
+    while frame is not None:
+        code = frame.f_code
+        result.append("%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+        frame = frame.f_back
+    result.reverse()
+    return result
+
+
+def formatThreadStacks():
+    "The current stack of every thread, formatted like a traceback"
+    names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append("Thread '%s' (%s):\n" % (names.get(ident, "unknown"), ident))
+        lines.extend(traceback.format_stack(frame))
+    return "".join(lines)
@@ -11,13 +11,30 @@ import sys
 import glob
 import re
 import errno
+import hashlib
+import zipfile
+import zlib
+import time
+import tempfile
+import StringIO
+
+_OBJECTS_DIR = 'objects'
+_GC_GRACE_SECONDS = 60 * 60
 
 
 class FileCache(object):
+    """
+    Seeds are kept in a content addressed store: each member of a seed's egg is stored once, zlib
+    compressed, under the SHA1 of its contents, however many seeds share it. A key's manifest lists the
+    members of its egg, and the egg is reassembled from them on get. Code that is not a zip file is
+    stored as a single object. Seeds installed before are still read from their '.code' files
+    """
 
     def __init__(self, cacheDir):
         self._cacheDir = cacheDir
         self._ensure_dir(self._cacheDir)
+        self._objectsDir = os.path.join(self._cacheDir, _OBJECTS_DIR)
+        self._ensure_dir(self._objectsDir)
 
     def _ensure_dir(self, d):
         try:
@@ -93,7 +110,8 @@ class FileCache(object):
                 return True
 
         uniqueLockFiles = [f for f in os.listdir(self._cacheDir)
-                           if not (f.endswith('.code') or f.endswith('.deps') or f.endswith('.lock'))]
+                           if not (f.endswith('.code') or f.endswith('.deps') or f.endswith('.lock') or
+                                   f.endswith('.manifest') or f.startswith('.tmp') or f == _OBJECTS_DIR)]
         for uniqueLockFile in uniqueLockFiles:
             if _isSameUniqueLock(uniqueLockFile):
                 pid = _getPidFromUniqueFile(uniqueLockFile)
@@ -105,25 +123,77 @@ class FileCache(object):
             return json.loads(f.read())
 
     def _storeManifest(self, key, manifest):
-        path = self._manifestFileName(key)
-        with open(path, 'w') as f:
-            f.write(json.dumps(manifest))
+        self._writeAtomically(self._manifestFileName(key), json.dumps(manifest))
+
+    def _writeAtomically(self, path, contents):
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                f.write(contents)
+            os.rename(temporary, path)
+        except:
+            self._unlinkIfExists(temporary)
+            raise
+
+    def _objectFileName(self, objectHash):
+        return os.path.join(self._objectsDir, objectHash[:2], objectHash)
 
-    def _storeCode(self, key, code):
-        seedFile = self._seedFileName(key)
-        with open(seedFile, 'wb') as f:
-            return f.write(code)
+    def _storeObject(self, contents):
+        objectHash = hashlib.sha1(contents).hexdigest()
+        path = self._objectFileName(objectHash)
+        if os.path.exists(path):
+            os.utime(path, None)
+            return objectHash
+        self._ensure_dir(os.path.dirname(path))
+        self._writeAtomically(path, zlib.compress(contents, 6))
+        return objectHash
+
+    def _loadObject(self, objectHash):
+        with open(self._objectFileName(objectHash), 'rb') as f:
+            contents = zlib.decompress(f.read())
+        if hashlib.sha1(contents).hexdigest() != objectHash:
+            raise Exception("Seed cache object %s is corrupt" % objectHash)
+        return contents
+
+    def _storeCode(self, code):
+        "The manifest entries describing the stored code"
+        if not zipfile.is_zipfile(StringIO.StringIO(code)):
+            return {'blob': self._storeObject(code)}
+        members = []
+        egg = zipfile.ZipFile(StringIO.StringIO(code))
+        for info in egg.infolist():
+            members.append({'name': info.filename, 'object': self._storeObject(egg.read(info.filename)),
+                            'date_time': list(info.date_time), 'compress_type': info.compress_type,
+                            'external_attr': info.external_attr, 'create_system': info.create_system})
+        return {'members': members, 'comment': base64.b64encode(egg.comment)}
+
+    def _assembleCode(self, manifest):
+        if 'blob' in manifest:
+            return self._loadObject(manifest['blob'])
+        output = StringIO.StringIO()
+        egg = zipfile.ZipFile(output, 'w')
+        for member in manifest['members']:
+            info = zipfile.ZipInfo(member['name'], tuple(member['date_time']))
+            info.compress_type = member['compress_type']
+            info.external_attr = member['external_attr']
+            info.create_system = member['create_system']
+            egg.writestr(info, self._loadObject(member['object']))
+        egg.comment = base64.b64decode(manifest['comment'])
+        egg.close()
+        return output.getvalue()
 
     def get(self, key):
         sanitizedKey = key.hash
-        seedFile = self._seedFileName(sanitizedKey)
-        if not os.path.exists(seedFile):
+        if not os.path.exists(self._manifestFileName(sanitizedKey)):
             return None
         try:
             if not self._validateDependencies(sanitizedKey):
                 logging.debug('Seed for key %(key)s is outdated', dict(key=key))
                 return None
-            with open(seedFile, 'r') as f:
+            manifest = self._loadManifest(sanitizedKey)
+            if 'members' in manifest or 'blob' in manifest:
+                return self._assembleCode(manifest)
+            with open(self._seedFileName(sanitizedKey), 'r') as f:
                 return f.read()
         except:
             logging.warn("Failed to validate and fetch seed for key %(key)s",
@@ -134,8 +204,37 @@ class FileCache(object):
         sanitizedKey = seedKey.hash
         logging.debug('Installing seed for key %(key)s - sanitized %(sanitized)s',
                       dict(key=seedKey, sanitized=sanitizedKey))
-        self._storeCode(sanitizedKey, seedEntry['code'])
-        self._storeManifest(sanitizedKey, {'deps': seedEntry['deps'], 'key':  seedKey.__repr__()})
+        manifest = self._storeCode(seedEntry['code'])
+        manifest.update({'deps': seedEntry['deps'], 'key':  seedKey.__repr__()})
+        self._storeManifest(sanitizedKey, manifest)
+        self._unlinkIfExists(self._seedFileName(sanitizedKey))
+
+    def collectGarbage(self, graceSeconds=_GC_GRACE_SECONDS):
+        """
+        Removes the objects no manifest refers to. Objects written or reused in the last 'graceSeconds' are
+        kept, since their manifest may still be being installed. Returns the number of bytes freed
+        """
+        referenced = set()
+        for manifestFile in glob.iglob(self._cacheDir + '/*.manifest'):
+            try:
+                with open(manifestFile) as f:
+                    manifest = json.load(f)
+            except:
+                logging.warning("Unable to read %(manifestFile)s, ignoring it",
+                                dict(manifestFile=manifestFile))
+                continue
+            referenced.update(member['object'] for member in manifest.get('members', []))
+            if 'blob' in manifest:
+                referenced.add(manifest['blob'])
+        freed = 0
+        now = time.time()
+        for objectFile in glob.iglob(self._objectsDir + '/*/*'):
+            objectHash = os.path.basename(objectFile)
+            if objectHash in referenced or now - os.path.getmtime(objectFile) < graceSeconds:
+                continue
+            freed += os.path.getsize(objectFile)
+            os.unlink(objectFile)
+        return freed
 
     def clean(self):
         if self._cacheDir is None or self._cacheDir == '':
@@ -143,8 +242,11 @@ class FileCache(object):
         shutil.rmtree(self._cacheDir, ignore_errors=True)
 
     def traverse(self):
-        for codeFile in glob.iglob(self._cacheDir + '/*.code'):
-            keyName = codeFile[len(self._cacheDir) + 1:-len('.code')]
+        keyNames = set()
+        for suffix in ('.manifest', '.code'):
+            for path in glob.iglob(self._cacheDir + '/*' + suffix):
+                keyNames.add(path[len(self._cacheDir) + 1:-len(suffix)])
+        for keyName in sorted(keyNames):
             lockFile = self._lockFileName(keyName)
             try:
                 manifest = self._loadManifest(keyName)
@@ -184,12 +286,17 @@ if __name__ == '__main__':
     commandGroup.add_argument('--clear', action='store_true', default=False)
     commandGroup.add_argument('--display', action='store_true', default=True)
     commandGroup.add_argument('--fix-locked', dest='fix_locked', action='store_true', default=False)
+    commandGroup.add_argument('--gc', action='store_true', default=False,
+                              help='remove the stored egg members no seed refers to anymore')
 
     args = parser.parse_args()
     cache = FileCache(args.root)
     if args.clear:
         cache.clean()
         sys.exit(0)
+    if args.gc:
+        print 'Freed %d bytes' % cache.collectGarbage()
+        sys.exit(0)
     if args.fix_locked:
         for keyName, seedArgs, deps, lockFile in cache.traverse():
             if lockFile.is_locked() and not cache._isLockingProcessAliveForLockFile(lockFile):
@@ -0,0 +1,151 @@
+from strato.racktest.infra import rackattackallocation
+from strato.racktest.infra import hostsdefinition
+from strato.racktest.infra import concurrently
+import threading
+import importlib
+import logging
+import json
+
+
+class AllocationPool:
+    """
+    Allocates hosts in the runner on behalf of scenarios that declare REUSABLE_HOSTS = True, and keeps
+    them allocated after such a scenario passes, so that a following scenario with the same host names
+    and hardware constraints can use them instead of allocating and inaugurating its own. A reused host
+    goes through the reset hook, and is reinaugurated by the scenario process if the rootfs differs.
+    Reusable scenarios must therefore not release their hosts
+    """
+
+    def __init__(self, resetHook=None):
+        self._resetHook = _resolveHook(resetHook) if resetHook else None
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def acquire(self, hosts):
+        lease = self._takeIdle(hosts)
+        if lease is not None:
+            return lease
+        return allocate(hosts)
+
+    def release(self, lease, reusable):
+        if not reusable:
+            lease.free()
+            return
+        with self._lock:
+            self._idle.append(lease)
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for lease in idle:
+            lease.free()
+
+    def _takeIdle(self, hosts):
+        with self._lock:
+            compatible = [lease for lease in self._idle if lease.isCompatible(hosts)]
+            if not compatible:
+                return None
+            lease = compatible[0]
+            self._idle.remove(lease)
+        logging.info("Reusing hosts %(hosts)s allocated for a previous scenario", dict(hosts=lease.hosts))
+        if self._resetHook is not None:
+            try:
+                self._resetHook(lease.nodes())
+            except:
+                logging.exception("Host reset hook failed, not reusing hosts %(hosts)s",
+                                  dict(hosts=lease.hosts))
+                lease.free()
+                return None
+        return lease.reusedFor(hosts)
+
+
+def allocate(hosts):
+    "Allocates the hosts in the runner. The returned lease is passed to the scenario process"
+    logging.info("Allocating hosts %(hosts)s in the runner", dict(hosts=hosts))
+    allocations = dict()
+    abort = threading.Event()
+    try:
+        concurrently.run([
+            dict(callback=_allocateFromRackattack, args=(rackattack, hostsOfRackattack, allocations, abort))
+            for rackattack, hostsOfRackattack in hostsdefinition.rackattackToHostMap(hosts).iteritems()])
+    except:
+        for allocation in allocations.values():
+            _tryFree(allocation)
+        raise
+    return Lease(hosts, allocations, hostsToReinaugurate=[])
+
+
+def _allocateFromRackattack(rackattack, hostsFromRackattack, allocations, abort):
+    try:
+        allocations[rackattack] = rackattackallocation.RackAttackAllocation(
+            hosts=hostsFromRackattack, abort=abort)
+    except rackattackallocation.AllocationAborted:
+        raise
+    except:
+        abort.set()
+        raise
+
+
+class Lease:
+    def __init__(self, hosts, allocations, hostsToReinaugurate):
+        self.hosts = hosts
+        self._allocations = allocations
+        self._hostsToReinaugurate = hostsToReinaugurate
+
+    def environment(self):
+        allocationIDs = dict((rackattack, allocation.allocationID())
+                             for rackattack, allocation in self._allocations.iteritems())
+        return dict(RACKTEST_ALLOCATION_IDS=json.dumps(allocationIDs),
+                    RACKTEST_REINAUGURATE_HOSTS=json.dumps(self._hostsToReinaugurate))
+
+    def nodes(self):
+        result = dict()
+        for allocation in self._allocations.values():
+            result.update(allocation.nodes())
+        return result
+
+    def isCompatible(self, hosts):
+        return _hardwareRequirements(self.hosts) == _hardwareRequirements(hosts)
+
+    def reusedFor(self, hosts):
+        mine = _rootfsPerHost(self.hosts)
+        theirs = _rootfsPerHost(hosts)
+        hostsToReinaugurate = sorted(name for name in theirs if theirs[name] != mine[name])
+        return Lease(hosts, self._allocations, hostsToReinaugurate)
+
+    def free(self):
+        for allocation in self._allocations.values():
+            _tryFree(allocation)
+
+
+def _hardwareRequirements(hosts):
+    result = dict()
+    for rackattack, hostsFromRackattack in hostsdefinition.rackattackToHostMap(hosts).iteritems():
+        for name, parameters in hostsFromRackattack.iteritems():
+            constraints = dict(parameters)
+            constraints.pop('rootfs', None)
+            constraints.pop('product', None)
+            result[name] = (rackattack, constraints)
+    return result
+
+
+def _rootfsPerHost(hosts):
+    result = dict()
+    for hostsFromRackattack in hostsdefinition.rackattackToHostMap(hosts).values():
+        for name, parameters in hostsFromRackattack.iteritems():
+            result[name] = (parameters['rootfs'], parameters.get('product', 'rootfs'))
+    return result
+
+
+def _resolveHook(spec):
+    moduleName, callableName = spec.split(':')
+    return getattr(importlib.import_module(moduleName), callableName)
+
+
+def _tryFree(allocation):
+    try:
+        allocation.free()
+    except:
+        logging.exception("Unable to free allocation, hosts: %(nodes)s may still be allocated",
+                          dict(nodes=','.join(node.id() for node in allocation.nodes().values())))
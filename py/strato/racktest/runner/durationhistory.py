@@ -0,0 +1,59 @@
+import json
+import os
+import logging
+
+
+class DurationHistory:
+    _MAXIMUM_SAMPLES_PER_SCENARIO = 10
+
+    def __init__(self, filename, defaultEstimate):
+        self._filename = filename
+        self._defaultEstimate = defaultEstimate
+        self._durations = self._load()
+
+    def exists(self):
+        return os.path.exists(self._filename)
+
+    def estimate(self, scenario):
+        durations = self._durations.get(scenario)
+        if not durations:
+            return self._defaultEstimate
+        return sum(durations) / len(durations)
+
+    def importReport(self, reportFilename):
+        try:
+            with open(reportFilename) as f:
+                results = json.load(f)
+        except:
+            logging.exception("Unable to import scenario durations from '%(filename)s'",
+                              dict(filename=reportFilename))
+            return
+        self.update(results)
+        logging.info("Imported %(count)d scenario durations from '%(filename)s'",
+                     dict(count=len(results), filename=reportFilename))
+
+    def update(self, results):
+        for result in results:
+            durations = self._durations.setdefault(result['scenario'], [])
+            durations.append(result['timeTook'])
+            del durations[: -self._MAXIMUM_SAMPLES_PER_SCENARIO]
+
+    def save(self):
+        directory = os.path.dirname(self._filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary = self._filename + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self._durations, f)
+        os.rename(temporary, self._filename)
+
+    def _load(self):
+        if not self.exists():
+            return dict()
+        try:
+            with open(self._filename) as f:
+                return json.load(f)
+        except:
+            logging.exception("Unable to read duration history '%(filename)s', starting a new one",
+                              dict(filename=self._filename))
+            return dict()
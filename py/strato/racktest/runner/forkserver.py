@@ -0,0 +1,253 @@
+import subprocess
+import traceback
+import threading
+import tempfile
+import logging
+import shutil
+import socket
+import select
+import signal
+import random
+import errno
+import json
+import time
+import sys
+import os
+
+
+class ForkServer:
+    """
+    Runs scenarios in children forked from a single pre-warmed process, which already imported the
+    executioner, rackattack and the host plugins, instead of starting a fresh interpreter per scenario
+    """
+    _CONNECT_TIMEOUT = 60
+    _WAIT_INTERVAL = 1
+
+    def __init__(self, configurationFile):
+        self._tempDir = tempfile.mkdtemp(suffix=".racktestforkserver")
+        socketPath = os.path.join(self._tempDir, "socket")
+        self._popen = subprocess.Popen(
+            ['python', _serverFilename(), configurationFile, socketPath], close_fds=True)
+        self._socket = self._connect(socketPath)
+        self._sendLock = threading.Lock()
+        self._requestsLock = threading.Lock()
+        self._requests = dict()
+        self._nextID = 0
+        self._reader = threading.Thread(target=self._readReplies)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def run(self, scenario, instance, environment=None):
+        "Returns the exit code of the scenario's process"
+        done = threading.Event()
+        exitCodes = []
+
+        def onExit(exitCode):
+            exitCodes.append(exitCode)
+            done.set()
+        self.start(scenario, instance, environment, onExit)
+        while not done.is_set():
+            done.wait(self._WAIT_INTERVAL)
+        if exitCodes[0] is None:
+            raise Exception("Fork server exited while running '%s'" % scenario)
+        return exitCodes[0]
+
+    def start(self, scenario, instance, environment, onExit):
+        """
+        Starts running the scenario and returns an ID for it. 'onExit' is called from another thread with
+        the exit code of the scenario's process, or with None if the fork server exited
+        """
+        if environment is None:
+            environment = dict(os.environ)
+        with self._requestsLock:
+            requestID = self._nextID
+            self._nextID += 1
+            self._requests[requestID] = dict(pid=None, onExit=onExit)
+        line = json.dumps(dict(
+            id=requestID, scenario=scenario, instance=instance,
+            environment=environment, cwd=os.getcwd())) + "\n"
+        with self._sendLock:
+            self._socket.sendall(line)
+        return requestID
+
+    def pid(self, requestID):
+        "The pid of the scenario's process, None until it was forked or after it exited"
+        with self._requestsLock:
+            request = self._requests.get(requestID)
+            return None if request is None else request['pid']
+
+    def pids(self):
+        with self._requestsLock:
+            return [request['pid'] for request in self._requests.values() if request['pid'] is not None]
+
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
+        if self._popen.poll() is None:
+            self._popen.terminate()
+            self._popen.wait()
+        shutil.rmtree(self._tempDir, ignore_errors=True)
+
+    def _connect(self, socketPath):
+        before = time.time()
+        while time.time() - before < self._CONNECT_TIMEOUT:
+            if self._popen.poll() is not None:
+                raise Exception("Fork server exited with code %d while starting" % self._popen.returncode)
+            if os.path.exists(socketPath):
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                connection.connect(socketPath)
+                return connection
+            time.sleep(0.1)
+        raise Exception("Fork server did not start within %d seconds" % self._CONNECT_TIMEOUT)
+
+    def _readReplies(self):
+        try:
+            for reply in _lines(self._socket):
+                with self._requestsLock:
+                    if 'pid' in reply:
+                        self._requests[reply['id']]['pid'] = reply['pid']
+                        continue
+                    request = self._requests.pop(reply['id'])
+                request['onExit'](reply['exitCode'])
+        except:
+            logging.exception("Lost connection to the fork server")
+        with self._requestsLock:
+            requests = self._requests.values()
+            self._requests = dict()
+        for request in requests:
+            request['onExit'](None)
+
+
+def _serverFilename():
+    filename = os.path.abspath(__file__)
+    if filename.endswith(".pyc"):
+        filename = filename[: -1]
+    return filename
+
+
+def _lines(connection):
+    buffer = ""
+    while True:
+        data = connection.recv(64 * 1024)
+        if not data:
+            return
+        buffer += data
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            yield json.loads(line)
+
+
+class _Server:
+    _REAP_INTERVAL = 1
+
+    def __init__(self, socketPath):
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(socketPath)
+        self._listener.listen(1)
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        self._children = dict()
+        self._buffer = ""
+        self._connection = None
+
+    def serve(self):
+        signal.signal(signal.SIGCHLD, self._childExited)
+        signal.siginterrupt(signal.SIGCHLD, False)
+        self._connection, unused = self._listener.accept()
+        while True:
+            try:
+                readable, unused, unused = select.select(
+                    [self._connection, self._wakeupRead], [], [], self._REAP_INTERVAL)
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                readable = []
+            if self._wakeupRead in readable:
+                os.read(self._wakeupRead, 4096)
+            if self._connection in readable:
+                data = self._connection.recv(64 * 1024)
+                if not data:
+                    return
+                self._buffer += data
+                while "\n" in self._buffer:
+                    line, self._buffer = self._buffer.split("\n", 1)
+                    self._fork(json.loads(line))
+            self._reap()
+
+    def _childExited(self, *args):
+        os.write(self._wakeupWrite, "x")
+
+    def _fork(self, request):
+        pid = os.fork()
+        if pid == 0:
+            exitCode = 1
+            try:
+                exitCode = self._runChild(request)
+            finally:
+                os._exit(exitCode)
+        self._children[pid] = request['id']
+        self._reply(dict(id=request['id'], pid=pid))
+
+    def _reap(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid == 0:
+                return
+            if pid not in self._children:
+                continue
+            if os.WIFSIGNALED(status):
+                exitCode = -os.WTERMSIG(status)
+            else:
+                exitCode = os.WEXITSTATUS(status)
+            self._reply(dict(id=self._children.pop(pid), exitCode=exitCode))
+
+    def _reply(self, reply):
+        self._connection.sendall(json.dumps(reply) + "\n")
+
+    def _runChild(self, request):
+        from strato.racktest.infra import handlekill
+        from strato.racktest.runner import single
+        from strato.racktest.hostundertest.builtinplugins import seed
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        self._listener.close()
+        self._connection.close()
+        os.close(self._wakeupRead)
+        os.close(self._wakeupWrite)
+        os.environ.clear()
+        os.environ.update(dict((key.encode('utf-8'), value.encode('utf-8'))
+                               for key, value in request['environment'].iteritems()))
+        os.chdir(request['cwd'])
+        random.seed()
+        handlekill._register()
+        seed.afterFork()
+        try:
+            single.runSingleScenario(str(request['scenario']), str(request['instance']))
+            return 0
+        except SystemExit as e:
+            if e.code is None:
+                return 0
+            return e.code if isinstance(e.code, int) else 1
+        except:
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    from strato.racktest.infra import config
+    config.load(sys.argv[1])
+    # Imported here, once, so that each forked child finds them already loaded
+    from strato.racktest.infra import handlekill
+    from strato.racktest.runner import single
+    from strato.racktest.hostundertest.builtinplugins import seed
+    import strato.racktest.hostundertest.optionalplugins.inauguratorplugin
+    _Server(sys.argv[2]).serve()
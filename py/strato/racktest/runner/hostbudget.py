@@ -0,0 +1,89 @@
+import threading
+import logging
+
+
+class HostBudget:
+    """
+    Bookkeeping of the hosts in use from each rackattack, against a per rackattack budget. Hosts may be
+    reserved for a job ahead of its admission, e.g. while they are preallocated, under a key identifying
+    the job. Thread safe
+    """
+
+    def __init__(self, defaultBudget, budgets=None):
+        self._defaultBudget = defaultBudget
+        self._budgets = dict(budgets or {})
+        self._lock = threading.Lock()
+        self._inUse = dict()
+        self._reservations = dict()
+
+    def budget(self, rackattack):
+        return self._budgets.get(rackattack, self._defaultBudget)
+
+    def clamped(self, hosts):
+        "A demand exceeding the budget is reduced to the whole budget, so it can run alone"
+        result = dict()
+        for rackattack, count in hosts.iteritems():
+            if count > self.budget(rackattack):
+                logging.warning(
+                    "Job requires %(count)d hosts from %(rackattack)s, which is more than its budget of "
+                    "%(budget)d hosts. It will run when no other job uses %(rackattack)s",
+                    dict(count=count, rackattack=rackattack, budget=self.budget(rackattack)))
+                count = self.budget(rackattack)
+            result[rackattack] = count
+        return result
+
+    def fits(self, hosts):
+        with self._lock:
+            return self._fits(hosts)
+
+    def take(self, hosts):
+        with self._lock:
+            self._take(hosts)
+
+    def give(self, hosts):
+        with self._lock:
+            self._give(hosts)
+
+    def reserve(self, key, hosts):
+        "Takes the hosts for the job 'key' ahead of its admission, if they fit. Returns whether they did"
+        with self._lock:
+            if key in self._reservations or not self._fits(hosts):
+                return False
+            self._take(hosts)
+            self._reservations[key] = hosts
+            return True
+
+    def unreserve(self, key):
+        "Gives back the hosts reserved for the job 'key', unless it was admitted since"
+        with self._lock:
+            hosts = self._reservations.pop(key, None)
+            if hosts is not None:
+                self._give(hosts)
+
+    def admit(self, key, hosts):
+        """
+        Takes the hosts of the job 'key', in place of its reservation if it has one, or if they fit.
+        Returns whether the job was admitted
+        """
+        with self._lock:
+            reserved = self._reservations.pop(key, None)
+            if reserved is not None:
+                self._give(reserved)
+            elif not self._fits(hosts):
+                return False
+            self._take(hosts)
+            return True
+
+    def _fits(self, hosts):
+        for rackattack, count in hosts.iteritems():
+            if self._inUse.get(rackattack, 0) + count > self.budget(rackattack):
+                return False
+        return True
+
+    def _take(self, hosts):
+        for rackattack, count in hosts.iteritems():
+            self._inUse[rackattack] = self._inUse.get(rackattack, 0) + count
+
+    def _give(self, hosts):
+        for rackattack, count in hosts.iteritems():
+            self._inUse[rackattack] -= count
@@ -0,0 +1,43 @@
+from strato.racktest.infra import hostsdefinition
+import logging
+import subprocess
+import tempfile
+import json
+import imp
+import os
+
+
+def query(configurationFile, scenarios):
+    """
+    Returns a dictionary mapping each scenario filename to the number of hosts it requires from each
+    rackattack, or to None if its HOSTS could not be read. Scenarios are imported in a separate process,
+    the same way single.py imports them, so the runner itself never executes scenario code
+    """
+    if not scenarios:
+        return dict()
+    with tempfile.NamedTemporaryFile(suffix=".hostsdemand.json") as output:
+        subprocess.check_call(
+            ['python', __file__.replace('.pyc', '.py'), configurationFile, output.name] + list(scenarios),
+            close_fds=True)
+        with open(output.name) as f:
+            return json.load(f)
+
+
+def _scenarioHostsDemand(scenarioFilename, index):
+    try:
+        module = imp.load_source('hostsdemand_scenario%d' % index, scenarioFilename)
+        return hostsdefinition.hostsDemand(module.Test.HOSTS)
+    except:
+        logging.exception("Unable to read HOSTS of '%(scenarioFilename)s'",
+                          dict(scenarioFilename=scenarioFilename))
+        return None
+
+
+if __name__ == "__main__":
+    import sys
+    from strato.racktest.infra import config
+    config.load(sys.argv[1])
+    demands = dict((scenario, _scenarioHostsDemand(scenario, index))
+                   for index, scenario in enumerate(sys.argv[3:]))
+    with open(sys.argv[2], "w") as f:
+        json.dump(demands, f)
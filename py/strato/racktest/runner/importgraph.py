@@ -0,0 +1,178 @@
+from strato.racktest.infra.seed import filecache
+import subprocess
+import logging
+import json
+import ast
+import sys
+import os
+
+
+class ImportGraph:
+    """
+    Which files each python file depends on: the modules it imports, as found on sys.path, and, for
+    modules whose callables were seeded, the files their seed manifests list. Only files under 'root' are
+    followed. The imports of each file are cached in an index file, by modification time
+    """
+    _FORMAT_VERSION = 1
+
+    def __init__(self, root, indexFilename, searchPath=None, seedCacheDirectory=None):
+        self._root = os.path.abspath(root)
+        self._indexFilename = indexFilename
+        self._searchPath = [os.path.abspath(path) for path in (searchPath or sys.path) if path != '']
+        if os.getcwd() not in self._searchPath:
+            self._searchPath.insert(0, os.getcwd())
+        self._entries = self._load()
+        self._dirty = False
+        self._seedDependencies = _seedDependencies(seedCacheDirectory or filecache.fileCacheDir())
+
+    def dependencies(self, filename):
+        "All files under the root the file transitively depends on, including itself"
+        result = set()
+        pending = [os.path.abspath(filename)]
+        while pending:
+            current = pending.pop()
+            if current in result:
+                continue
+            result.add(current)
+            pending.extend(self._directDependencies(current))
+            pending.extend(self._seedDependencies.get(current, []))
+        return result
+
+    def save(self):
+        if not self._dirty:
+            return
+        temporary = self._indexFilename + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(dict(version=self._FORMAT_VERSION, entries=self._entries), f)
+        os.rename(temporary, self._indexFilename)
+        self._dirty = False
+
+    def _directDependencies(self, filename):
+        if not os.path.exists(filename):
+            return []
+        mtime = os.path.getmtime(filename)
+        entry = self._entries.get(filename)
+        if entry is None or entry['mtime'] != mtime:
+            entry = dict(mtime=mtime, dependencies=self._resolveImports(filename))
+            self._entries[filename] = entry
+            self._dirty = True
+        return entry['dependencies']
+
+    def _resolveImports(self, filename):
+        result = set()
+        for moduleName in importedModules(filename):
+            for resolved in self._resolve(moduleName):
+                if resolved.startswith(self._root + os.sep):
+                    result.add(resolved)
+        return sorted(result)
+
+    def _resolve(self, moduleName):
+        "The module's file and the __init__.py files of its packages, from the first path it is found on"
+        parts = moduleName.split('.')
+        for directory in self._searchPath:
+            found = []
+            for i in xrange(1, len(parts) + 1):
+                base = os.path.join(directory, *parts[:i])
+                if os.path.exists(os.path.join(base, "__init__.py")):
+                    found.append(os.path.join(base, "__init__.py"))
+                elif i == len(parts) and os.path.exists(base + ".py"):
+                    found.append(base + ".py")
+                else:
+                    break
+            if found:
+                return found
+        return []
+
+    def _load(self):
+        if not os.path.exists(self._indexFilename):
+            return dict()
+        try:
+            with open(self._indexFilename) as f:
+                data = json.load(f)
+        except:
+            logging.exception("Unable to read import graph '%(filename)s', rebuilding it",
+                              dict(filename=self._indexFilename))
+            return dict()
+        if data.get('version') != self._FORMAT_VERSION:
+            return dict()
+        return data['entries']
+
+
+def importedModules(filename):
+    """
+    Names of the modules a file may import. 'from a import b' yields both 'a' and 'a.b', since b may be a
+    submodule. Relative imports are resolved against the file's package
+    """
+    try:
+        with open(filename) as f:
+            tree = ast.parse(f.read(), filename)
+    except (SyntaxError, IOError):
+        logging.exception("Unable to parse '%(filename)s', ignoring its imports", dict(filename=filename))
+        return []
+    package = _packageOf(filename)
+    result = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                result.add(alias.name)
+                if package is not None:
+                    result.add(package + '.' + alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level > 0 and package is not None:
+                parent = package.split('.')
+                parent = parent[: len(parent) - node.level + 1]
+                base = '.'.join(filter(None, parent + [base]))
+            elif package is not None and base:
+                result.add(package + '.' + base)
+            if base:
+                result.add(base)
+            for alias in node.names:
+                if alias.name != '*':
+                    result.add('.'.join(filter(None, [base, alias.name])))
+    return sorted(result)
+
+
+def _packageOf(filename):
+    "The dotted package name of the file's directory, None if it is not in a package"
+    directory = os.path.dirname(os.path.abspath(filename))
+    parts = []
+    while os.path.exists(os.path.join(directory, "__init__.py")):
+        parts.insert(0, os.path.basename(directory))
+        directory = os.path.dirname(directory)
+    return '.'.join(parts) if parts else None
+
+
+def _seedDependencies(seedCacheDirectory):
+    "Maps each seeded callable's file to the files listed in its seed manifest"
+    result = dict()
+    if not os.path.isdir(seedCacheDirectory):
+        return result
+    for keyName, seedArgs, deps, lockFile in filecache.FileCache(seedCacheDirectory).traverse():
+        if seedArgs is None or not isinstance(deps, dict):
+            continue
+        callableFile = os.path.abspath(seedArgs[0])
+        if callableFile.endswith(".pyc"):
+            callableFile = callableFile[: -1]
+        result.setdefault(callableFile, set()).update(
+            dependency[: -1] if dependency.endswith(".pyc") else dependency for dependency in deps)
+    return result
+
+
+def changedFiles(specifications, root):
+    """
+    Each specification is either a file name, or a git revision range whose changed files are taken
+    (e.g. 'origin/master..HEAD', or 'HEAD~3' for everything changed since then, including the working
+    tree). Returns absolute paths
+    """
+    result = set()
+    for specification in specifications:
+        if os.path.exists(specification):
+            result.add(os.path.abspath(specification))
+            continue
+        gitRoot = subprocess.check_output(
+            ["git", "rev-parse", "--show-toplevel"], cwd=root, close_fds=True).strip()
+        output = subprocess.check_output(
+            ["git", "diff", "--name-only", specification], cwd=root, close_fds=True)
+        result.update(os.path.join(gitRoot, line) for line in output.splitlines() if line.strip())
+    return result
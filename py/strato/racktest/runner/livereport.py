@@ -0,0 +1,95 @@
+import threading
+import json
+import os
+
+HEADER = 'header'
+RESULT = 'result'
+FOOTER = 'footer'
+LATE_FAILURE = 'lateFailure'
+
+
+class LiveReport:
+    """
+    Live report in JSON lines format: a header record listing the scenarios and instances of the run,
+    one record appended per finished scenario, and a footer record once the run is done. Work done for a
+    scenario after its result was appended (e.g. freeing its hosts in the background) appends a late
+    failure record if it fails. Readers can tail the file and only parse the lines added since their
+    last read
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._lock = threading.Lock()
+
+    def start(self, scenarios, instances, runTimestamp):
+        self._write("w", dict(
+            type=HEADER, scenarios=scenarios, instances=instances, runTimestamp=runTimestamp))
+
+    def append(self, result):
+        self._write("a", dict(result, type=RESULT))
+
+    def lateFailure(self, scenario, instance, description):
+        self._write("a", dict(type=LATE_FAILURE, scenario=scenario, instance=instance,
+                              description=description))
+
+    def finish(self, passed, total, phases=None):
+        record = dict(type=FOOTER, passed=passed, total=total)
+        if phases is not None:
+            record['phases'] = phases
+        self._write("a", record)
+
+    def compact(self, reportFilename):
+        header, results, footer = read(self._filename)
+        temporary = reportFilename + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(results, f)
+        os.rename(temporary, reportFilename)
+
+    def _write(self, mode, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self._filename, mode) as f:
+                f.write(line)
+
+
+def read(filename):
+    """
+    Returns the header, the results and the footer (None while the run is still going) found in the
+    live report. Late failures are listed under 'lateFailures' of the results of their scenario. A
+    partially written last line is ignored
+    """
+    header, footer = None, None
+    results = []
+    lateFailures = []
+    records, unused = tail(filename)
+    for record in records:
+        recordType = record.pop('type')
+        if recordType == HEADER:
+            header = record
+        elif recordType == RESULT:
+            results.append(record)
+        elif recordType == FOOTER:
+            footer = record
+        elif recordType == LATE_FAILURE:
+            lateFailures.append(record)
+    for lateFailure in lateFailures:
+        key = (lateFailure['scenario'], lateFailure['instance'])
+        for result in results:
+            if (result['scenario'], result['instance']) == key:
+                result.setdefault('lateFailures', []).append(lateFailure['description'])
+    return header, results, footer
+
+
+def tail(filename, offset=0):
+    """
+    Returns the records appended to the live report since 'offset', and the offset to continue from
+    """
+    records = []
+    with open(filename) as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            records.append(json.loads(line))
+            offset += len(line)
+    return records, offset
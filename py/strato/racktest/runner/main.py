@@ -6,24 +6,44 @@ configurelogging.configureLogging('racktest.runner', forceDirectory=config.TEST_
 import logging
 import argparse
 import sys
-import glob
 import time
-import json
 import re
 import os
-import subprocess
+import tempfile
+import json
 from strato.racktest.infra import suite
-from strato.racktest.infra import concurrently
 from strato.racktest.infra import handlekill
+from strato.racktest.infra import hostsdefinition
+from strato.racktest.infra import phasetimings
+from strato.racktest.infra import rackattackallocation
+from strato.racktest.infra import samplingprofiler
 from strato.racktest import runner
+from strato.racktest.runner import durationhistory
+from strato.racktest.runner import hostbudget
+from strato.racktest.runner import hostsdemand
+from strato.racktest.runner import livereport
+from strato.racktest.runner import scenarioindex
+from strato.racktest.runner import forkserver
+from strato.racktest.runner import allocationpool
+from strato.racktest.runner import preallocator
+from strato.racktest.runner import runhistory
+from strato.racktest.runner import importgraph
+from strato.racktest.runner import scenarioloop
+from strato.racktest.runner import reaper
+import strato.racktest
 import atexit
 import signal
-import threading
 import datetime
 
 _defaultReport = os.path.join(config.TEST_LOGS_DIR, "racktestrunnerreport.json")
-_defaultLiveReport = os.path.join(config.TEST_LOGS_DIR, "racktestrunnerlivereport.json")
+_defaultLiveReport = os.path.join(config.TEST_LOGS_DIR, "racktestrunnerlivereport.jsonl")
+_defaultDurationHistory = ".racktestdurations.json"
+_defaultScenarioIndex = ".racktestscenarioindex.json"
+_defaultRunHistory = ".racktestrunhistory.sqlite"
+_defaultImportGraph = ".racktestimportgraph.json"
 _single = os.path.join(os.path.dirname(runner.__file__), "single.py")
+_DEFAULT_ABORT_TEST_TIMEOUT = 10 * 60
+_HELPER_THREADS = 4
 
 parser = argparse.ArgumentParser(
     description="run Integration test scenarios. If no arguments given, run all rack scenarios")
@@ -31,12 +51,73 @@ parser.add_argument(
     "--interactOnAssert", help="go into interact mode on assert", action='store_true')
 parser.add_argument("--regex", default="", help="run all scenarios matching the regular expression")
 parser.add_argument('--listOnly', action='store_true', help='list scenarios and exit')
-parser.add_argument('--liveReportFilename', default=_defaultLiveReport)
+parser.add_argument(
+    '--liveReportFilename', default=_defaultLiveReport,
+    help="JSON lines file, appended with a record per finished scenario")
 parser.add_argument("--reportFilename", default=_defaultReport)
 parser.add_argument("--scenariosRoot", default="racktests")
+parser.add_argument(
+    "--scenarioIndexFilename", default=_defaultScenarioIndex,
+    help="cache of the metadata statically extracted from the scenario files")
+parser.add_argument(
+    "--affectedBy", nargs="+", default=None, metavar="REVISIONS_OR_FILE",
+    help="run only scenarios that transitively import, or seed, one of the given files, or one of the "
+    "files changed in the given git revision range (e.g. origin/master..HEAD). Changes to the test "
+    "infrastructure itself select all scenarios")
+parser.add_argument(
+    "--importGraphFilename", default=_defaultImportGraph,
+    help="cache of the imports of each file, used by --affectedBy")
 parser.add_argument("--configurationFile", default="/etc/racktest.conf")
 parser.add_argument("--parallel", type=int, default=0)
 parser.add_argument("--repeat", type=int, default=0)
+parser.add_argument(
+    "--scenarioTimeoutMargin", type=int, default=60 * 60, metavar="SECONDS",
+    help="the runner terminates a scenario process running for longer than its ABORT_TEST_TIMEOUT plus "
+    "this margin, which also covers waiting for the allocation. Scenarios whose ABORT_TEST_TIMEOUT can "
+    "not be read statically are left to their own timer. 0 disables")
+parser.add_argument(
+    "--forkServer", action='store_true',
+    help="fork scenario processes from a pre-warmed process instead of starting a new interpreter for each")
+parser.add_argument(
+    "--maxHosts", type=int, default=0,
+    help="run scenarios in parallel as long as the hosts they require from each rackattack do not exceed "
+    "this number. --parallel, if given, still limits the number of concurrent scenarios")
+parser.add_argument(
+    "--maxHostsPerRackattack", action="append", default=[], metavar="RACKATTACK=COUNT",
+    help="override --maxHosts for a specific rackattack (as named by the 'rackattack' host parameter)")
+parser.add_argument(
+    "--durationHistoryFilename", default=_defaultDurationHistory,
+    help="per scenario duration history, used to start the longest scenarios first when running in parallel")
+parser.add_argument(
+    "--defaultDurationEstimate", type=float, default=5 * 60,
+    help="expected duration in seconds of scenarios without any duration history")
+parser.add_argument(
+    "--importDurationsFrom", nargs="*", default=[],
+    help="previous runner report files to add to the duration history")
+parser.add_argument(
+    "--runHistoryFilename", default=_defaultRunHistory,
+    help="SQLite database the results of every run are added to. Report regressions with "
+    "'python -m strato.racktest.runner.runhistory'. Pass an empty string to disable")
+parser.add_argument(
+    "--reuseHosts", action='store_true',
+    help="allocate hosts in the runner for scenarios that declare REUSABLE_HOSTS = True, and hand them to "
+    "a following scenario with compatible HOSTS instead of freeing them")
+parser.add_argument(
+    "--hostResetHook", default=None, metavar="MODULE:CALLABLE",
+    help="with --reuseHosts, called with a dictionary of the reused rackattack nodes before reusing them")
+parser.add_argument(
+    "--preallocate", type=int, default=0, metavar="COUNT",
+    help="allocate hosts in the runner for up to COUNT scenarios ahead in the queue, while the current "
+    "scenarios are still running")
+parser.add_argument(
+    "--deferFree", action='store_true',
+    help="let scenarios exit without waiting for rackattack to free their hosts, and free them from the "
+    "runner in the background meanwhile. Frees that fail even after retries are marked in the report")
+parser.add_argument(
+    "--profile", choices=samplingprofiler.MODES, default=samplingprofiler.NEVER,
+    help="sample the stacks of the scenario processes, and write them in the folded stacks format of "
+    "flame graphs into 'profile.folded' in the scenario's logs directory when the scenario times out, "
+    "also when it fails, or always")
 args = parser.parse_args()
 if args.interactOnAssert:
     suite.enableInteractOnAssert()
@@ -46,39 +127,118 @@ config.load(args.configurationFile)
 class Runner:
     def __init__(self, args):
         self._args = args
-        self._liveReportLock = threading.Lock()
-        self._pids = []
+        self._liveReport = livereport.LiveReport(args.liveReportFilename)
+        self._loop = None
+        self._forkServer = None
         atexit.register(self._killSubprocesses)
+        self._allocationPool = None
+        if args.reuseHosts:
+            self._allocationPool = allocationpool.AllocationPool(args.hostResetHook)
+            atexit.register(self._allocationPool.close)
+        self._preallocator = None
+        self._reaper = reaper.Reaper() if args.deferFree else None
         if args.repeat == 0:
             self._instances = ['']
         else:
             self._instances = ['_try%d' % i for i in xrange(args.repeat)]
+        self._scenarioIndex = scenarioindex.ScenarioIndex(args.scenariosRoot, args.scenarioIndexFilename)
         self._scenarios = self._matchingScenarios()
         if len(self._scenarios) == 0:
             raise Exception("No scenarios files found")
         self._results = []
+        self._durationHistory = self._loadDurationHistory()
         os.environ['RUN_TIMESTAMP'] = datetime.datetime.now().strftime("%Y_%m_%d__%H_%M_%S_%f")
 
     def _killSubprocesses(self):
-        for pid in self._pids:
+        if self._loop is None:
+            return
+        for pid in self._loop.pids():
             try:
-                os.kill(signal.SIGTERM, pid)
+                os.kill(pid, signal.SIGTERM)
             except OSError as ex:
                 logging.warn("Could not kill scenario subprocess %(pid)s: %(message)s",
                              dict(pid=pid, message=ex))
 
     def runSequential(self):
-        for scenario in self._scenarios:
-            for instance in self._instances:
-                self._runScenario(scenario, instance)
+        self._startLiveReport()
+        self._startForkServer()
+        jobs = self._jobs()
+        self._startPreallocator(jobs)
+        self._runLoop(jobs, maximumConcurrent=1)
 
     def runParallel(self):
         os.environ['RACKTEST_MINIMUM_NICE_FOR_RACKATTACK'] = "1.0"
-        jobs = []
+        self._startLiveReport()
+        self._startForkServer()
+        jobs = self._jobs()
+        jobs.sort(key=lambda job: self._durationHistory.estimate(job['scenario']), reverse=True)
+        budget = self._hostBudget(jobs) if self._args.maxHosts else None
+        self._startPreallocator(jobs, hostBudget=budget)
+        self._runLoop(jobs, maximumConcurrent=self._args.parallel or None, hostBudget=budget)
+
+    def _jobs(self):
+        return [dict(scenario=scenario, instance=instance, timeout=self._scenarioTimeout(scenario))
+                for scenario in self._scenarios for instance in self._instances]
+
+    def _runLoop(self, jobs, maximumConcurrent, hostBudget=None):
+        helperThreads = _HELPER_THREADS
+        mayBlockOnAllocation = self._allocationPool is not None or self._preallocator is not None
+        if mayBlockOnAllocation:
+            helperThreads = min(maximumConcurrent or len(jobs), len(jobs))
+        self._loop = scenarioloop.ScenarioLoop(
+            prepare=self._prepareScenario, finish=self._finishScenario, command=self._command,
+            maximumConcurrent=maximumConcurrent, helperThreads=helperThreads, hostBudget=hostBudget,
+            forkServer=self._forkServer)
+        self._loop.run(jobs)
+
+    def _hostBudget(self, jobs):
+        demands = self._hostsDemands()
+        for job in jobs:
+            demand = demands.get(job['scenario'])
+            if demand is None:
+                logging.warning(
+                    "Host demand of '%(scenario)s' is unknown, scheduling it as requiring no hosts",
+                    dict(scenario=job['scenario']))
+                demand = dict()
+            job['hosts'] = demand
+        budgets = dict()
+        for override in self._args.maxHostsPerRackattack:
+            rackattack, count = override.split('=')
+            budgets[rackattack] = int(count)
+        return hostbudget.HostBudget(defaultBudget=self._args.maxHosts, budgets=budgets)
+
+    def _scenarioTimeout(self, scenario):
+        if not self._args.scenarioTimeoutMargin:
+            return None
+        metadata = self._scenarioIndex.metadata(scenario)
+        abortTestTimeout = metadata['abortTestTimeout']
+        if abortTestTimeout is None:
+            if not metadata['defaultAbortTestTimeout']:
+                logging.info("ABORT_TEST_TIMEOUT of '%(scenario)s' could not be read statically, the runner "
+                             "will not terminate it", dict(scenario=scenario))
+                return None
+            abortTestTimeout = _DEFAULT_ABORT_TEST_TIMEOUT
+        return abortTestTimeout + self._args.scenarioTimeoutMargin
+
+    def _hostsDemands(self):
+        demands = dict()
         for scenario in self._scenarios:
-            for instance in self._instances:
-                jobs.append(dict(callback=self._runScenario, scenario=scenario, instance=instance))
-        concurrently.run(jobs, threads=self._args.parallel)
+            hosts = self._scenarioIndex.metadata(scenario)['hosts']
+            if hosts is not None:
+                demands[scenario] = hostsdefinition.hostsDemand(hosts)
+        self._saveScenarioIndex()
+        notStatic = [scenario for scenario in self._scenarios if scenario not in demands]
+        if notStatic:
+            logging.info("HOSTS of %(count)d scenarios could not be read statically, importing them",
+                         dict(count=len(notStatic)))
+            demands.update(hostsdemand.query(self._args.configurationFile, notStatic))
+        return demands
+
+    def _saveScenarioIndex(self):
+        try:
+            self._scenarioIndex.save()
+        except:
+            logging.exception("Unable to save scenario index")
 
     def printScenarios(self):
         for scenario in self._scenarios:
@@ -97,51 +257,213 @@ class Runner:
         return [res['scenario'] for res in self._results if not res['passed']]
 
     def writeReport(self):
-        with open(self._args.reportFilename, "w") as f:
-            json.dump(self._results, f)
+        self._liveReport.finish(passed=self.passedCount(), total=self.total(), phases=self.phases())
+        self._liveReport.compact(self._args.reportFilename)
+
+    def phases(self):
+        return phasetimings.aggregate([res['phaseTimings'] for res in self._results])
+
+    def logPhases(self):
+        phases = self.phases()
+        for phase in sorted(phases, key=lambda phase: phases[phase]['total'], reverse=True):
+            logging.info(
+                "Phase %(phase)s: %(total).1fs total, %(mean).1fs mean, %(maximum).1fs maximum over "
+                "%(count)d measurements", dict(phases[phase], phase=phase))
+
+    def saveDurationHistory(self):
+        self._durationHistory.update(self._results)
+        try:
+            self._durationHistory.save()
+        except:
+            logging.exception("Unable to save scenario duration history")
+
+    def saveRunHistory(self):
+        if not self._args.runHistoryFilename:
+            return
+        try:
+            history = runhistory.RunHistory(self._args.runHistoryFilename)
+            try:
+                history.record(os.environ['RUN_TIMESTAMP'], self._results)
+            finally:
+                history.close()
+        except:
+            logging.exception("Unable to save the run history")
+
+    def _loadDurationHistory(self):
+        history = durationhistory.DurationHistory(
+            self._args.durationHistoryFilename, self._args.defaultDurationEstimate)
+        reports = list(self._args.importDurationsFrom)
+        isPreviousReportNotInHistoryYet = not history.exists() and os.path.exists(self._args.reportFilename)
+        if isPreviousReportNotInHistoryYet:
+            reports.append(self._args.reportFilename)
+        for report in reports:
+            history.importReport(report)
+        return history
 
     def _matchingScenarios(self):
-        root = self._args.scenariosRoot
-        scenarios = \
-            glob.glob(root + "/*.py") + \
-            glob.glob(root + "/*/*.py") + \
-            glob.glob(root + "/*/*/*.py") + \
-            glob.glob(root + "/*/*/*/*.py")
-        for scenario in scenarios:
-            if scenario.endswith("/__init__.py"):
-                raise Exception("'__init__.py' must not be found under the scenarios directory")
-        scenarios.sort()
-        return [s for s in scenarios if re.search(self._args.regex, s) is not None]
-
-    def _dumpLiveReport(self):
-        with self._liveReportLock:
-            everything = dict(
-                results=self._results, scenarios=self._scenarios, instances=self._instances)
-            with open(self._args.liveReportFilename, "w") as f:
-                json.dump(everything, f)
-
-    def _runScenario(self, scenario, instance):
-        before = time.time()
-        popen = subprocess.Popen(
-            ['python', _single, args.configurationFile, scenario, instance], close_fds=True)
-        self._pids.append(popen.pid)
-        result = popen.wait()
-        self._pids.remove(popen.pid)
-        took = time.time() - before
-        self._results.append(dict(
-            scenario=scenario, instance=instance, passed=result == 0, timeTook=took, host='localhost'))
-        self._dumpLiveReport()
+        scenarios = self._scenarioIndex.scenarios()
+        scenarios = [s for s in scenarios if re.search(self._args.regex, s) is not None]
+        if self._args.affectedBy is not None:
+            scenarios = self._affectedScenarios(scenarios)
+        return scenarios
+
+    def _affectedScenarios(self, scenarios):
+        changed = importgraph.changedFiles(self._args.affectedBy, root=os.getcwd())
+        infrastructure = os.path.dirname(os.path.abspath(strato.racktest.__file__)) + os.sep
+        changedInfrastructure = [filename for filename in changed if filename.startswith(infrastructure)]
+        if changedInfrastructure:
+            logging.info("Test infrastructure changed (%(files)s), running all scenarios",
+                         dict(files=", ".join(sorted(changedInfrastructure))))
+            return scenarios
+        graph = importgraph.ImportGraph(os.getcwd(), self._args.importGraphFilename)
+        affected = [scenario for scenario in scenarios if graph.dependencies(scenario) & changed]
+        try:
+            graph.save()
+        except:
+            logging.exception("Unable to save import graph")
+        logging.info("%(affected)d of %(total)d scenarios are affected by %(changed)d changed files",
+                     dict(affected=len(affected), total=len(scenarios), changed=len(changed)))
+        return affected
+
+    def _startLiveReport(self):
+        self._liveReport.start(
+            scenarios=self._scenarios, instances=self._instances, runTimestamp=os.environ['RUN_TIMESTAMP'])
+
+    def _startForkServer(self):
+        if not self._args.forkServer:
+            return
+        logging.info("Starting the scenario fork server...")
+        self._forkServer = forkserver.ForkServer(self._args.configurationFile)
+        atexit.register(self._forkServer.close)
+
+    def _startPreallocator(self, jobs, hostBudget=None):
+        if not self._args.preallocate:
+            return
+        preallocations = [dict(key=(job['scenario'], job['instance']), hosts=self._preallocatableHosts(job))
+                          for job in jobs]
+        self._preallocator = preallocator.Preallocator(
+            preallocations, maximumOutstanding=self._args.preallocate, hostBudget=hostBudget)
+        atexit.register(self._preallocator.close)
+
+    def _preallocatableHosts(self, job):
+        if self._isReusable(job['scenario']):
+            return None
+        return self._scenarioIndex.metadata(job['scenario'])['hosts']
+
+    def _prepareScenario(self, job):
+        job['startedAt'] = time.time()
+        try:
+            job['lease'] = self._leaseHosts(job['scenario'], job['instance'])
+        except:
+            logging.exception("Unable to allocate hosts for '%(scenario)s'", dict(scenario=job['scenario']))
+            raise
+        environment = dict(os.environ)
+        if job['lease'] is not None:
+            environment.update(job['lease'].environment())
+        descriptor, job['scenarioReportFilename'] = tempfile.mkstemp(
+            suffix=".json", prefix="racktestscenario")
+        os.close(descriptor)
+        environment['RACKTEST_SCENARIO_REPORT_FILENAME'] = job['scenarioReportFilename']
+        if self._reaper is not None:
+            environment['RACKTEST_DEFER_FREE'] = 'true'
+        if self._args.profile != samplingprofiler.NEVER:
+            environment['RACKTEST_PROFILE'] = self._args.profile
+        return environment
+
+    def _finishScenario(self, job, exitCode):
+        scenarioReport = _emptyScenarioReport()
+        if job.get('scenarioReportFilename') is not None:
+            scenarioReport = self._readScenarioReport(job['scenarioReportFilename'])
+        if job.get('lease') is not None:
+            self._returnLease(job['scenario'], job['lease'], passed=exitCode == 0)
+        took = time.time() - job['startedAt']
+        entry = dict(
+            scenario=job['scenario'], instance=job['instance'], passed=exitCode == 0, timeTook=took,
+            host='localhost', phaseTimings=scenarioReport['phaseTimings'], nodes=scenarioReport['nodes'],
+            cleanUps=scenarioReport.get('cleanUps', []), tasks=scenarioReport.get('tasks', dict()))
+        self._results.append(entry)
+        self._liveReport.append(entry)
+        for deferredFree in scenarioReport.get('deferredFrees', []):
+            self._submitDeferredFree(job, deferredFree)
+
+    def _submitDeferredFree(self, job, deferredFree):
+        "The hosts count against the host budget until they are freed, or freeing them was given up"
+        hosts = {deferredFree['rackattack']: len(deferredFree['hosts'])}
+        self._loop.holdHosts(hosts)
+
+        def free():
+            rackattackallocation.freeExisting(deferredFree['allocationID'])
+            self._loop.releaseHosts(hosts)
+
+        def onFailure(description):
+            self._loop.releaseHosts(hosts)
+            self._liveReport.lateFailure(job['scenario'], job['instance'], description)
+        self._reaper.submit(
+            "free allocation %(allocationID)s from %(rackattack)s" % deferredFree, free, onFailure)
+
+    def closeReaper(self):
+        "Waits for the hosts of finished scenarios to be freed"
+        if self._reaper is not None:
+            logging.info("Waiting for the remaining allocations to be freed")
+            self._reaper.close()
+
+    def _command(self, job):
+        return ['python', _single, self._args.configurationFile, job['scenario'], job['instance']]
+
+    def _readScenarioReport(self, filename):
+        try:
+            with open(filename) as f:
+                contents = f.read()
+            return json.loads(contents) if contents else _emptyScenarioReport()
+        except:
+            logging.exception("Unable to read the phase timings of the scenario")
+            return _emptyScenarioReport()
+        finally:
+            os.unlink(filename)
+
+    def _leaseHosts(self, scenario, instance):
+        if self._preallocator is not None:
+            lease = self._preallocator.claim((scenario, instance))
+            if lease is not None:
+                return lease
+        if not self._isReusable(scenario):
+            return None
+        return self._allocationPool.acquire(self._scenarioIndex.metadata(scenario)['hosts'])
+
+    def _returnLease(self, scenario, lease, passed):
+        if self._isReusable(scenario):
+            self._allocationPool.release(lease, reusable=passed)
+        else:
+            lease.free()
+
+    def _isReusable(self, scenario):
+        if self._allocationPool is None:
+            return False
+        metadata = self._scenarioIndex.metadata(scenario)
+        return metadata['reusableHosts'] and metadata['hosts'] is not None
+
+
+def _emptyScenarioReport():
+    return dict(phaseTimings=dict(phases=dict(), hosts=dict()), nodes=dict(), deferredFrees=[],
+                cleanUps=[], tasks=dict())
 
 
 runner = Runner(args)
 if args.listOnly:
     runner.printScenarios()
     sys.exit(0)
-if args.parallel:
-    runner.runParallel()
-else:
-    runner.runSequential()
+try:
+    if args.parallel or args.maxHosts:
+        runner.runParallel()
+    else:
+        runner.runSequential()
+except KeyboardInterrupt:
+    logging.error("Interrupted, reporting only the scenarios that finished")
+runner.closeReaper()
 runner.writeReport()
+runner.saveDurationHistory()
+runner.saveRunHistory()
+runner.logPhases()
 if runner.passedCount() < runner.total():
     logging.error(
         "%(failed)d tests Failed. %(passed)d/%(total)d Passed",
@@ -0,0 +1,99 @@
+from strato.racktest.runner import allocationpool
+from strato.racktest.infra import hostsdefinition
+import threading
+import logging
+
+
+class Preallocator:
+    """
+    Allocates hosts for the scenarios next in the queue while the current ones are still running, so
+    that a scenario's allocation wait overlaps the run of the scenarios before it. At most
+    'maximumOutstanding' allocations are held that no scenario has claimed yet. With a 'hostBudget', the
+    hosts of each preallocation are reserved there under the job's key until the job is admitted, and
+    the next job waits until its hosts fit. Jobs are dictionaries with a 'key' identifying the job and
+    its 'hosts', in the order they are expected to start
+    """
+    _WAIT_INTERVAL = 1
+
+    def __init__(self, jobs, maximumOutstanding, hostBudget=None):
+        self._queue = [job for job in jobs if job['hosts'] is not None]
+        self._maximumOutstanding = maximumOutstanding
+        self._hostBudget = hostBudget
+        self._condition = threading.Condition()
+        self._preallocations = dict()
+        self._outstanding = 0
+        self._closed = False
+        thread = threading.Thread(target=self._preallocateAhead)
+        thread.daemon = True
+        thread.start()
+
+    def claim(self, key):
+        "Returns the lease preallocated for the job, or None if the job should allocate by itself"
+        with self._condition:
+            self._queue = [job for job in self._queue if job['key'] != key]
+            preallocation = self._preallocations.pop(key, None)
+            self._condition.notify_all()
+            if preallocation is None:
+                return None
+            self._unreserve(key)
+            while not preallocation['done']:
+                self._condition.wait(self._WAIT_INTERVAL)
+            if preallocation['lease'] is not None:
+                self._outstanding -= 1
+                self._condition.notify_all()
+            return preallocation['lease']
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            unclaimed = [preallocation['lease'] for preallocation in self._preallocations.values()
+                         if preallocation['done'] and preallocation['lease'] is not None]
+            for key in self._preallocations:
+                self._unreserve(key)
+            self._preallocations = dict()
+            self._condition.notify_all()
+        for lease in unclaimed:
+            lease.free()
+
+    def _preallocateAhead(self):
+        with self._condition:
+            while not self._closed and self._queue:
+                if self._outstanding >= self._maximumOutstanding or not self._reserve(self._queue[0]):
+                    self._condition.wait(self._WAIT_INTERVAL)
+                    continue
+                job = self._queue.pop(0)
+                preallocation = dict(lease=None, done=False)
+                self._preallocations[job['key']] = preallocation
+                self._outstanding += 1
+                thread = threading.Thread(target=self._preallocate, args=(job, preallocation))
+                thread.daemon = True
+                thread.start()
+
+    def _preallocate(self, job, preallocation):
+        logging.info("Preallocating hosts for %(key)s", dict(key=job['key']))
+        try:
+            lease = allocationpool.allocate(job['hosts'])
+        except:
+            logging.exception("Preallocation for %(key)s failed, the scenario will allocate by itself",
+                              dict(key=job['key']))
+            lease = None
+        with self._condition:
+            unclaimed = self._closed
+            if lease is None or unclaimed:
+                self._outstanding -= 1
+                self._unreserve(job['key'])
+            preallocation['lease'] = None if unclaimed else lease
+            preallocation['done'] = True
+            self._condition.notify_all()
+        if unclaimed and lease is not None:
+            lease.free()
+
+    def _reserve(self, job):
+        if self._hostBudget is None:
+            return True
+        hosts = self._hostBudget.clamped(hostsdefinition.hostsDemand(job['hosts']))
+        return self._hostBudget.reserve(job['key'], hosts)
+
+    def _unreserve(self, key):
+        if self._hostBudget is not None:
+            self._hostBudget.unreserve(key)
@@ -0,0 +1,59 @@
+import threading
+import logging
+import Queue
+import time
+
+
+class Reaper:
+    """
+    Does work handed back by finished scenario processes, such as freeing their allocations, in the
+    background, so the next scenario can start meanwhile. Up to 'maximumQueued' items wait in the queue,
+    and submitting more blocks until there is room. Each item is attempted up to 'attempts' times with
+    exponential backoff, after which 'onFailure(description)' is called
+    """
+
+    def __init__(self, maximumQueued=64, attempts=3, threads=2, initialBackoff=5):
+        self._queue = Queue.Queue(maxsize=maximumQueued)
+        self._attempts = attempts
+        self._initialBackoff = initialBackoff
+        self._threads = [threading.Thread(target=self._work) for i in xrange(threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, description, callback, onFailure=None):
+        self._queue.put(dict(description=description, callback=callback, onFailure=onFailure))
+
+    def close(self):
+        "Waits for all submitted work to be done"
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(1)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._attempt(item)
+
+    def _attempt(self, item):
+        backoff = self._initialBackoff
+        for attempt in xrange(1, self._attempts + 1):
+            try:
+                item['callback']()
+                return
+            except:
+                logging.exception("Attempt %(attempt)d of %(attempts)d to %(description)s failed", dict(
+                    attempt=attempt, attempts=self._attempts, description=item['description']))
+            if attempt < self._attempts:
+                time.sleep(backoff)
+                backoff *= 2
+        logging.error("Gave up trying to %(description)s", dict(description=item['description']))
+        if item['onFailure'] is not None:
+            try:
+                item['onFailure'](item['description'])
+            except:
+                logging.exception("Failure callback of '%(description)s' failed", item)
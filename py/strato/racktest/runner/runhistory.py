@@ -0,0 +1,143 @@
+import sqlite3
+import logging
+import math
+import os
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    scenario TEXT NOT NULL,
+    instance TEXT NOT NULL,
+    runTimestamp TEXT NOT NULL,
+    passed INTEGER NOT NULL,
+    timeTook REAL NOT NULL,
+    allocation REAL,
+    PRIMARY KEY (scenario, instance, runTimestamp));
+CREATE TABLE IF NOT EXISTS nodes (
+    scenario TEXT NOT NULL,
+    instance TEXT NOT NULL,
+    runTimestamp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    nodeID TEXT NOT NULL,
+    PRIMARY KEY (scenario, instance, runTimestamp, name));
+CREATE INDEX IF NOT EXISTS resultsByRun ON results (runTimestamp);
+CREATE INDEX IF NOT EXISTS nodesByNodeID ON nodes (nodeID);
+"""
+
+METRICS = ('timeTook', 'allocation')
+
+
+class RunHistory:
+    """
+    Results of all runs in a local SQLite database, one row per scenario instance per run (as identified
+    by RUN_TIMESTAMP), along with the rackattack nodes each of its hosts ran on
+    """
+
+    def __init__(self, filename):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._connection = sqlite3.connect(filename)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def record(self, runTimestamp, results):
+        with self._connection:
+            for result in results:
+                key = (result['scenario'], result['instance'], runTimestamp)
+                phases = result.get('phaseTimings', dict()).get('phases', dict())
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                    key + (int(result['passed']), result['timeTook'], phases.get('allocation')))
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?)",
+                    [key + (name, nodeID) for name, nodeID in result.get('nodes', dict()).iteritems()])
+
+    def runs(self):
+        "Run timestamps, oldest first"
+        return [row[0] for row in self._connection.execute(
+            "SELECT DISTINCT runTimestamp FROM results ORDER BY runTimestamp")]
+
+    def samples(self, scenario, instance, metric, before=None, passedOnly=True):
+        "Values of 'metric' for the scenario instance in previous runs, oldest first"
+        if metric not in METRICS:
+            raise ValueError(metric)
+        query = "SELECT %s FROM results WHERE scenario = ? AND instance = ? AND %s IS NOT NULL" % (
+            metric, metric)
+        parameters = [scenario, instance]
+        if before is not None:
+            query += " AND runTimestamp < ?"
+            parameters.append(before)
+        if passedOnly:
+            query += " AND passed = 1"
+        query += " ORDER BY runTimestamp"
+        return [row[0] for row in self._connection.execute(query, parameters)]
+
+    def nodes(self, scenario, instance, runTimestamp):
+        return dict(self._connection.execute(
+            "SELECT name, nodeID FROM nodes WHERE scenario = ? AND instance = ? AND runTimestamp = ?",
+            (scenario, instance, runTimestamp)))
+
+    def regressions(self, runTimestamp=None, deviations=3.0, minimumSamples=5, minimumRelativeChange=0.2):
+        """
+        Scenario instances of the run (the latest one by default) whose duration or allocation wait is
+        outside the distribution of their own previous passing runs: further from the mean than 'deviations'
+        standard deviations, and by at least 'minimumRelativeChange' of the mean
+        """
+        if runTimestamp is None:
+            runs = self.runs()
+            if not runs:
+                return []
+            runTimestamp = runs[-1]
+        found = []
+        rows = self._connection.execute(
+            "SELECT scenario, instance, timeTook, allocation FROM results WHERE runTimestamp = ? "
+            "ORDER BY scenario, instance", (runTimestamp,)).fetchall()
+        for scenario, instance, timeTook, allocation in rows:
+            for metric, value in zip(METRICS, (timeTook, allocation)):
+                if value is None:
+                    continue
+                samples = self.samples(scenario, instance, metric, before=runTimestamp)
+                if len(samples) < minimumSamples:
+                    continue
+                mean, deviation = _meanAndDeviation(samples)
+                tolerance = max(deviations * deviation, minimumRelativeChange * mean)
+                if abs(value - mean) > tolerance:
+                    found.append(dict(
+                        scenario=scenario, instance=instance, runTimestamp=runTimestamp, metric=metric,
+                        value=value, mean=mean, deviation=deviation, samples=len(samples),
+                        nodes=self.nodes(scenario, instance, runTimestamp)))
+        return found
+
+
+def _meanAndDeviation(samples):
+    mean = sum(samples) / len(samples)
+    variance = sum((sample - mean) ** 2 for sample in samples) / len(samples)
+    return mean, math.sqrt(variance)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(
+        description="report scenarios whose duration or allocation wait moved outside their history")
+    parser.add_argument("--runHistoryFilename", default=".racktestrunhistory.sqlite")
+    parser.add_argument("--runTimestamp", default=None, help="the run to check, the latest by default")
+    parser.add_argument("--deviations", type=float, default=3.0)
+    parser.add_argument("--minimumSamples", type=int, default=5)
+    parser.add_argument("--minimumRelativeChange", type=float, default=0.2)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    history = RunHistory(args.runHistoryFilename)
+    found = history.regressions(
+        runTimestamp=args.runTimestamp, deviations=args.deviations, minimumSamples=args.minimumSamples,
+        minimumRelativeChange=args.minimumRelativeChange)
+    history.close()
+    for regression in found:
+        logging.warning(
+            "%(scenario)s%(instance)s: %(metric)s was %(value).1fs, historically %(mean).1fs +- "
+            "%(deviation).1fs over %(samples)d runs (nodes: %(nodes)s)", regression)
+    if not found:
+        logging.info("No regressions found")
+    sys.exit(1 if found else 0)
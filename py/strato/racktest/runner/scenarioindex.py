@@ -0,0 +1,227 @@
+from strato.racktest.infra import hostsdefinition
+import logging
+import json
+import ast
+import os
+
+
+class ScenarioIndex:
+    """
+    Discovers the scenario files under a root directory and extracts their metadata (HOSTS,
+    ABORT_TEST_TIMEOUT and the rootfs labels used) from their syntax tree, without importing them.
+    Metadata is cached in an index file and re-extracted only for files whose modification time changed
+    """
+    _TEST_CLASS_NAME = 'Test'
+    _FORMAT_VERSION = 3
+
+    def __init__(self, root, indexFilename):
+        self._root = root
+        self._indexFilename = indexFilename
+        self._entries = self._load()
+        self._dirty = False
+
+    def scenarios(self):
+        result = []
+        for dirPath, dirNames, fileNames in os.walk(self._root):
+            dirNames[:] = [name for name in dirNames if not name.startswith('.')]
+            for fileName in fileNames:
+                if not fileName.endswith(".py") or fileName.startswith('.'):
+                    continue
+                if fileName == "__init__.py":
+                    raise Exception("'__init__.py' must not be found under the scenarios directory")
+                result.append(os.path.join(dirPath, fileName))
+        result.sort()
+        return result
+
+    def metadata(self, scenario):
+        mtime = os.path.getmtime(scenario)
+        entry = self._entries.get(scenario)
+        if entry is None or entry['mtime'] != mtime or entry.get('version') != self._FORMAT_VERSION:
+            entry = dict(mtime=mtime, version=self._FORMAT_VERSION, metadata=extractMetadata(scenario))
+            self._entries[scenario] = entry
+            self._dirty = True
+        return entry['metadata']
+
+    def save(self):
+        if not self._dirty:
+            return
+        temporary = self._indexFilename + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self._entries, f)
+        os.rename(temporary, self._indexFilename)
+        self._dirty = False
+
+    def _load(self):
+        if not os.path.exists(self._indexFilename):
+            return dict()
+        try:
+            with open(self._indexFilename) as f:
+                return json.load(f)
+        except:
+            logging.exception("Unable to read scenario index '%(filename)s', rebuilding it",
+                              dict(filename=self._indexFilename))
+            return dict()
+
+
+class _NotStatic(Exception):
+    pass
+
+
+def extractMetadata(scenario):
+    """
+    Returns a dictionary with 'hosts', 'abortTestTimeout', 'rootfsLabels' and 'reusableHosts'. A value
+    that can not be evaluated statically is None. 'defaultAbortTestTimeout' is True only when the Test
+    class certainly does not override ABORT_TEST_TIMEOUT: it has no base classes and nothing in the file
+    assigns it
+    """
+    result = dict(hosts=None, abortTestTimeout=None, defaultAbortTestTimeout=False, rootfsLabels=None,
+                  reusableHosts=False)
+    try:
+        with open(scenario) as f:
+            tree = ast.parse(f.read(), scenario)
+    except SyntaxError:
+        logging.exception("Unable to parse scenario '%(scenario)s'", dict(scenario=scenario))
+        return result
+    moduleNamespace = _staticNamespace(tree.body, dict())
+    testClasses = [node for node in tree.body
+                   if isinstance(node, ast.ClassDef) and node.name == ScenarioIndex._TEST_CLASS_NAME]
+    if not testClasses:
+        return result
+    classNamespace = _staticNamespace(testClasses[-1].body, moduleNamespace)
+    result['hosts'] = classNamespace.get('HOSTS')
+    result['abortTestTimeout'] = classNamespace.get('ABORT_TEST_TIMEOUT')
+    result['defaultAbortTestTimeout'] = \
+        all(isinstance(base, ast.Name) and base.id == 'object' for base in testClasses[-1].bases) and \
+        not _assigns(tree, 'ABORT_TEST_TIMEOUT')
+    result['reusableHosts'] = classNamespace.get('REUSABLE_HOSTS') is True
+    if result['hosts'] is not None:
+        try:
+            result['rootfsLabels'] = sorted(set(
+                parameters['rootfs']
+                for hosts in hostsdefinition.rackattackToHostMap(result['hosts']).values()
+                for parameters in hosts.values()))
+        except (KeyError, AttributeError, TypeError):
+            result['hosts'] = None
+    return result
+
+
+def _staticNamespace(body, enclosing):
+    namespace = dict()
+    for statement in body:
+        environment = dict(enclosing, **namespace)
+        if isinstance(statement, ast.Assign):
+            try:
+                value = _evaluate(statement.value, environment)
+            except (_NotStatic, TypeError, ValueError, ZeroDivisionError):
+                value = None
+            for target in statement.targets:
+                if isinstance(target, ast.Name):
+                    namespace[target.id] = value
+        elif isinstance(statement, ast.Expr) and _isDictUpdate(statement.value):
+            name = statement.value.func.value.id
+            try:
+                if not isinstance(environment.get(name), dict):
+                    raise _NotStatic()
+                updated = dict(environment[name])
+                updated.update(_evaluate(statement.value.args[0], environment))
+                namespace[name] = updated
+            except (_NotStatic, TypeError, ValueError, ZeroDivisionError):
+                namespace[name] = None
+    return namespace
+
+
+def _assigns(tree, name):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        elif isinstance(node, ast.AugAssign):
+            targets = [node.target]
+        else:
+            continue
+        for target in targets:
+            for element in ast.walk(target):
+                if isinstance(element, ast.Name) and element.id == name or \
+                        isinstance(element, ast.Attribute) and element.attr == name:
+                    return True
+    return False
+
+
+def _isDictUpdate(node):
+    return isinstance(node, ast.Call) and \
+        isinstance(node.func, ast.Attribute) and \
+        isinstance(node.func.value, ast.Name) and \
+        node.func.attr == 'update' and \
+        len(node.args) == 1 and not node.keywords
+
+
+_CONSTANTS = {'True': True, 'False': False, 'None': None}
+_BINARY_OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.Mod: lambda a, b: a % b}
+_CALLABLES = {'dict': dict, 'range': range, 'xrange': range, 'list': list, 'tuple': tuple, 'set': set}
+
+
+def _evaluate(node, environment):
+    if isinstance(node, ast.Str):
+        return node.s
+    if isinstance(node, ast.Num):
+        return node.n
+    if isinstance(node, ast.Name):
+        if node.id in _CONSTANTS:
+            return _CONSTANTS[node.id]
+        if environment.get(node.id) is None:
+            raise _NotStatic()
+        return environment[node.id]
+    if isinstance(node, ast.Dict):
+        return dict((_evaluate(key, environment), _evaluate(value, environment))
+                    for key, value in zip(node.keys, node.values))
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_evaluate(element, environment) for element in node.elts]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_evaluate(node.operand, environment)
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        return _BINARY_OPERATORS[type(node.op)](
+            _evaluate(node.left, environment), _evaluate(node.right, environment))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _CALLABLES:
+        if node.starargs is not None or node.kwargs is not None:
+            raise _NotStatic()
+        args = [_evaluate(arg, environment) for arg in node.args]
+        kwargs = dict((keyword.arg, _evaluate(keyword.value, environment)) for keyword in node.keywords)
+        try:
+            return _CALLABLES[node.func.id](*args, **kwargs)
+        except (TypeError, ValueError):
+            raise _NotStatic()
+    if isinstance(node, ast.DictComp):
+        return dict((_evaluate(node.key, inner), _evaluate(node.value, inner))
+                    for inner in _comprehensionEnvironments(node.generators, environment))
+    if isinstance(node, ast.ListComp):
+        return [_evaluate(node.elt, inner)
+                for inner in _comprehensionEnvironments(node.generators, environment)]
+    raise _NotStatic()
+
+
+def _comprehensionEnvironments(generators, environment):
+    if not generators:
+        yield environment
+        return
+    generator = generators[0]
+    for item in _evaluate(generator.iter, environment):
+        inner = dict(environment)
+        _bind(generator.target, item, inner)
+        if all(_evaluate(condition, inner) for condition in generator.ifs):
+            for result in _comprehensionEnvironments(generators[1:], inner):
+                yield result
+
+
+def _bind(target, value, environment):
+    if isinstance(target, ast.Name):
+        environment[target.id] = value
+    elif isinstance(target, (ast.Tuple, ast.List)) and \
+            isinstance(value, (list, tuple)) and len(target.elts) == len(value):
+        for element, elementValue in zip(target.elts, value):
+            _bind(element, elementValue, environment)
+    else:
+        raise _NotStatic()
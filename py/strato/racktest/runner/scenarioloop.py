@@ -0,0 +1,314 @@
+from contextlib import contextmanager
+import multiprocessing.pool
+import subprocess
+import collections
+import threading
+import logging
+import select
+import signal
+import fcntl
+import errno
+import time
+import sys
+import os
+
+
+class ScenarioLoop:
+    """
+    Runs scenario processes from a single thread, instead of a thread blocked on each process: the loop
+    sleeps until SIGCHLD, a timeout or a completion wakes it up. Preparing a scenario (e.g. leasing its
+    hosts) and finishing it (e.g. returning them and reporting the result) may block, so they run on a
+    bounded pool of helper threads that post their completion back to the loop.
+
+    Each job is a dictionary with a 'scenario', an 'instance', and optionally 'hosts' (the hosts demanded
+    from each rackattack, checked against 'hostBudget', unless reserved there under the job's
+    (scenario, instance)) and 'timeout' (wall clock seconds, after which the scenario process is
+    terminated). 'prepare(job)' returns the environment of the scenario process,
+    'finish(job, exitCode)' is called once the process exited, with None if it never ran. On Ctrl-C,
+    running scenarios are terminated and finished before KeyboardInterrupt propagates, scenarios still
+    being prepared are finished without running, and a second Ctrl-C kills them. SIGINT raises
+    KeyboardInterrupt while the loop runs, whatever handler was installed before, e.g. handlekill's, which
+    exits. Must run in the main thread, since it handles SIGCHLD and SIGINT
+    """
+    _KILL_GRACE = 60
+    _WAKEUP_INTERVAL = 5
+
+    def __init__(self, prepare, finish, command, maximumConcurrent=None, helperThreads=4,
+                 hostBudget=None, forkServer=None):
+        self._prepare = prepare
+        self._finish = finish
+        self._command = command
+        self._maximumConcurrent = maximumConcurrent
+        self._helperThreads = helperThreads
+        self._hostBudget = hostBudget
+        self._forkServer = forkServer
+        self._wakeupRead, self._wakeupWrite = os.pipe()
+        for descriptor in (self._wakeupRead, self._wakeupWrite):
+            fcntl.fcntl(descriptor, fcntl.F_SETFL, fcntl.fcntl(descriptor, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._completions = collections.deque()
+        self._lock = threading.Lock()
+        self._running = []
+        self._active = 0
+        self._failures = []
+        self._cancelling = False
+        self._deferringInterrupt = 0
+        self._interruptDeferred = False
+
+    def run(self, jobs):
+        pending = list(jobs)
+        if self._hostBudget is not None:
+            pending = [dict(job, hosts=self._hostBudget.clamped(job.get('hosts') or {})) for job in pending]
+        helpers = multiprocessing.pool.ThreadPool(processes=self._helperThreads)
+        previousHandler = signal.signal(signal.SIGCHLD, lambda *args: None)
+        signal.siginterrupt(signal.SIGCHLD, False)
+        previousIntHandler = signal.signal(signal.SIGINT, self._interrupted)
+        signal.set_wakeup_fd(self._wakeupWrite)
+        try:
+            try:
+                self._loop(pending, helpers)
+            except KeyboardInterrupt:
+                logging.warning("Interrupted, terminating %(count)d running scenarios",
+                                dict(count=len(self._running)))
+                del pending[:]
+                self._cancelling = True
+                self._cancel(helpers)
+                raise
+        finally:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, previousHandler)
+            signal.signal(signal.SIGINT, previousIntHandler)
+            helpers.close()
+        if self._failures:
+            raise self._failures[0][0], self._failures[0][1], self._failures[0][2]
+
+    def holdHosts(self, hosts):
+        """
+        Keeps 'hosts' counted against the host budget, e.g. when the scenario that used them finished but
+        they are not freed yet, until releaseHosts. Thread safe
+        """
+        self._complete('held', None, (hosts, None))
+
+    def releaseHosts(self, hosts):
+        self._complete('released', None, (hosts, None))
+
+    def pids(self):
+        with self._lock:
+            return filter(None, [self._pid(process) for process in self._running])
+
+    def _loop(self, pending, helpers):
+        while pending or self._active > 0:
+            self._admit(pending, helpers)
+            self._sleep()
+            self._handleCompletions(helpers)
+            self._reap(helpers)
+            self._enforceTimeouts()
+
+    def _cancel(self, helpers):
+        with self._lock:
+            running = list(self._running)
+        for process in running:
+            self._signal(process, signal.SIGTERM)
+            process['killAt'] = time.time() + self._KILL_GRACE
+        try:
+            while self._active > 0:
+                self._sleep()
+                self._handleCompletions(helpers)
+                self._reap(helpers)
+                self._enforceTimeouts()
+        except KeyboardInterrupt:
+            logging.warning("Interrupted again, killing running scenarios")
+            with self._lock:
+                running = list(self._running)
+            for process in running:
+                self._signal(process, signal.SIGKILL)
+
+    def _interrupted(self, signalNumber, frame):
+        if self._deferringInterrupt:
+            self._interruptDeferred = True
+            return
+        self._interruptDeferred = False
+        raise KeyboardInterrupt()
+
+    @contextmanager
+    def _uninterruptible(self):
+        "Ctrl-C is raised after the block, so that jobs are neither lost nor counted twice in _active"
+        self._deferringInterrupt += 1
+        try:
+            yield
+        finally:
+            self._deferringInterrupt -= 1
+        if not self._deferringInterrupt and self._interruptDeferred:
+            self._interruptDeferred = False
+            raise KeyboardInterrupt()
+
+    def _admit(self, pending, helpers):
+        while pending:
+            if self._maximumConcurrent and self._active >= self._maximumConcurrent:
+                return
+            with self._uninterruptible():
+                job = self._admitFirst(pending)
+                if job is None:
+                    return
+                pending.remove(job)
+                self._active += 1
+                helpers.apply_async(self._inHelper, args=('prepared', job, self._prepare, (job,)))
+
+    def _admitFirst(self, pending):
+        "The first pending job that the host budget admits, taking its hosts"
+        for job in pending:
+            if self._hostBudget is None or \
+                    self._hostBudget.admit((job['scenario'], job['instance']), job['hosts']):
+                return job
+        return None
+
+    def _inHelper(self, kind, job, callback, args):
+        try:
+            result = (callback(*args), None)
+        except:
+            logging.exception("Running %(callback)s for '%(scenario)s' failed", dict(
+                callback=callback, scenario=job['scenario']))
+            result = (None, sys.exc_info())
+        self._complete(kind, job, result)
+
+    def _complete(self, kind, job, result):
+        self._completions.append((kind, job, result))
+        self._wakeUp()
+
+    def _wakeUp(self):
+        try:
+            os.write(self._wakeupWrite, "x")
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _sleep(self):
+        timeout = self._secondsToNextDeadline()
+        try:
+            readable, unused, unused = select.select([self._wakeupRead], [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if readable:
+            try:
+                os.read(self._wakeupRead, 4096)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def _secondsToNextDeadline(self):
+        with self._lock:
+            deadlines = [process['killAt'] or process['terminateAt'] for process in self._running]
+        deadlines = filter(None, deadlines)
+        if not deadlines:
+            return self._WAKEUP_INTERVAL
+        return min(max(min(deadlines) - time.time(), 0), self._WAKEUP_INTERVAL)
+
+    def _handleCompletions(self, helpers):
+        while self._completions:
+            with self._uninterruptible():
+                self._handleCompletion(self._completions.popleft(), helpers)
+
+    def _handleCompletion(self, completion, helpers):
+        kind, job, (result, failure) = completion
+        if kind == 'prepared':
+            if failure is None and not self._cancelling:
+                self._spawn(job, environment=result, helpers=helpers)
+            else:
+                self._finishJob(job, None, helpers)
+        elif kind == 'exited':
+            self._exited(self._runningProcess(job), result, helpers)
+        elif kind == 'finished':
+            self._active -= 1
+            if self._hostBudget is not None:
+                self._hostBudget.give(job['hosts'])
+            if failure is not None:
+                self._failures.append(failure)
+        elif kind == 'held' and self._hostBudget is not None:
+            self._hostBudget.take(result)
+        elif kind == 'released' and self._hostBudget is not None:
+            self._hostBudget.give(result)
+
+    def _spawn(self, job, environment, helpers):
+        timeout = job.get('timeout')
+        process = dict(job=job, popen=None, requestID=None, exited=False, killAt=None,
+                       terminateAt=time.time() + timeout if timeout else None)
+        try:
+            if self._forkServer is not None:
+                with self._lock:
+                    self._running.append(process)
+                process['requestID'] = self._forkServer.start(
+                    job['scenario'], job['instance'], environment,
+                    lambda exitCode: self._complete('exited', job, (exitCode, None)))
+            else:
+                process['popen'] = subprocess.Popen(self._command(job), close_fds=True, env=environment)
+                with self._lock:
+                    self._running.append(process)
+        except:
+            logging.exception("Unable to start '%(scenario)s'", dict(scenario=job['scenario']))
+            with self._lock:
+                if process in self._running:
+                    self._running.remove(process)
+            self._finishJob(job, None, helpers)
+
+    def _reap(self, helpers):
+        with self._lock:
+            running = [process for process in self._running if process['popen'] is not None]
+        for process in running:
+            exitCode = process['popen'].poll()
+            if exitCode is not None:
+                self._exited(process, exitCode, helpers)
+
+    def _exited(self, process, exitCode, helpers):
+        if process is None or process['exited']:
+            return
+        with self._uninterruptible():
+            process['exited'] = True
+            with self._lock:
+                self._running.remove(process)
+            self._finishJob(process['job'], exitCode, helpers)
+
+    def _finishJob(self, job, exitCode, helpers):
+        helpers.apply_async(self._inHelper, args=('finished', job, self._finish, (job, exitCode)))
+
+    def _enforceTimeouts(self):
+        now = time.time()
+        with self._lock:
+            running = list(self._running)
+        for process in running:
+            if process['killAt'] is not None and now >= process['killAt']:
+                logging.error("'%(scenario)s' did not exit after SIGTERM, killing it", dict(
+                    scenario=process['job']['scenario']))
+                self._signal(process, signal.SIGKILL)
+                process['killAt'] = None
+            elif process['terminateAt'] is not None and now >= process['terminateAt']:
+                logging.error("'%(scenario)s' is running for more than %(seconds)ss, terminating it", dict(
+                    scenario=process['job']['scenario'], seconds=process['job']['timeout']))
+                self._signal(process, signal.SIGTERM)
+                process['terminateAt'] = None
+                process['killAt'] = now + self._KILL_GRACE
+
+    def _runningProcess(self, job):
+        with self._lock:
+            for process in self._running:
+                if process['job'] is job:
+                    return process
+        return None
+
+    def _pid(self, process):
+        if process['popen'] is not None:
+            return process['popen'].pid
+        if process['requestID'] is not None:
+            return self._forkServer.pid(process['requestID'])
+        return None
+
+    def _signal(self, process, signalNumber):
+        pid = self._pid(process)
+        if pid is None:
+            return
+        try:
+            os.kill(pid, signalNumber)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                logging.warning("Could not signal scenario process %(pid)s: %(message)s",
+                                dict(pid=pid, message=e))
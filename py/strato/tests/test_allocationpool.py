@@ -0,0 +1,55 @@
+import unittest
+import json
+import mock
+from strato.racktest.runner import allocationpool
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('strato.racktest.infra.rackattackallocation.RackAttackAllocation')
+        self.allocationClass = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.allocationClass.return_value.allocationID.return_value = 17
+
+    def test_reusesCompatibleHosts(self):
+        tested = allocationpool.AllocationPool()
+        lease = tested.acquire(dict(it=dict(rootfs='rootfs-basic', minimumRAMGB=4)))
+        self.assertEquals(self.allocationClass.call_count, 1)
+        tested.release(lease, reusable=True)
+        lease = tested.acquire(dict(it=dict(rootfs='rootfs-basic', minimumRAMGB=4)))
+        self.assertEquals(self.allocationClass.call_count, 1)
+        environment = lease.environment()
+        self.assertEquals(json.loads(environment['RACKTEST_ALLOCATION_IDS']), dict(defaultRackattack=17))
+        self.assertEquals(json.loads(environment['RACKTEST_REINAUGURATE_HOSTS']), [])
+
+    def test_differentRootfsIsReinaugurated(self):
+        tested = allocationpool.AllocationPool()
+        tested.release(tested.acquire(dict(it=dict(rootfs='rootfs-basic'))), reusable=True)
+        lease = tested.acquire(dict(it=dict(rootfs='rootfs-vanilla')))
+        self.assertEquals(self.allocationClass.call_count, 1)
+        self.assertEquals(json.loads(lease.environment()['RACKTEST_REINAUGURATE_HOSTS']), ['it'])
+
+    def test_incompatibleHardwareIsNotReused(self):
+        tested = allocationpool.AllocationPool()
+        tested.release(tested.acquire(dict(it=dict(rootfs='rootfs-basic'))), reusable=True)
+        tested.acquire(dict(it=dict(rootfs='rootfs-basic', minimumRAMGB=4)))
+        tested.acquire(dict(other=dict(rootfs='rootfs-basic')))
+        self.assertEquals(self.allocationClass.call_count, 3)
+
+    def test_notReusableIsFreed(self):
+        tested = allocationpool.AllocationPool()
+        tested.release(tested.acquire(dict(it=dict(rootfs='rootfs-basic'))), reusable=False)
+        self.assertEquals(self.allocationClass.return_value.free.call_count, 1)
+        tested.acquire(dict(it=dict(rootfs='rootfs-basic')))
+        self.assertEquals(self.allocationClass.call_count, 2)
+
+    def test_closeFreesIdleHosts(self):
+        tested = allocationpool.AllocationPool()
+        tested.release(tested.acquire(dict(it=dict(rootfs='rootfs-basic'))), reusable=True)
+        tested.close()
+        self.assertEquals(self.allocationClass.return_value.free.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+import threading
+import mock
+import time
+from strato.racktest.infra import concurrently
+
+
+class Test(unittest.TestCase):
+
+    def test_runWaitsForAllJobs(self):
+        results = []
+        concurrently.run([dict(callback=results.append, args=(i,)) for i in xrange(20)])
+        self.assertEquals(sorted(results), range(20))
+
+    def test_runRaisesTheFirstFailure(self):
+        def fail(number):
+            raise ValueError(number)
+        with self.assertRaises(ValueError):
+            concurrently.run([dict(callback=fail, args=(1,)), dict(callback=lambda: None)])
+
+    def test_runHonorsThreadsLimit(self):
+        lock = threading.Lock()
+        state = dict(running=0, maximum=0)
+
+        def job():
+            with lock:
+                state['running'] += 1
+                state['maximum'] = max(state['maximum'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+        concurrently.run([dict(callback=job) for i in xrange(10)], threads=3)
+        self.assertLessEqual(state['maximum'], 3)
+
+    def test_runTimesOutAndCancelsJobsThatDidNotStart(self):
+        started = []
+
+        def job():
+            started.append(None)
+            time.sleep(0.3)
+        before = time.time()
+        with self.assertRaises(concurrently.TimeoutError):
+            concurrently.run([dict(callback=job) for i in xrange(4)], threads=2, timeout=0.1)
+        self.assertLess(time.time() - before, 0.25)
+        self.assertEquals(len(started), 2)
+
+    def test_failFastRaisesWithoutWaitingForRunningJobs(self):
+        release = threading.Event()
+
+        def fail():
+            raise ValueError()
+        before = time.time()
+        with self.assertRaises(ValueError):
+            concurrently.run([dict(callback=release.wait, args=(5,)), dict(callback=fail)], failFast=True)
+        self.assertLess(time.time() - before, 2)
+        release.set()
+
+    def test_failFastWaitsForRunningJobsUpToStopTimeout(self):
+        finished = []
+
+        def slow():
+            time.sleep(0.3)
+            finished.append(None)
+
+        def fail():
+            time.sleep(0.05)
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            concurrently.run([dict(callback=slow), dict(callback=fail)], failFast=True, stopTimeout=5)
+        self.assertEquals(len(finished), 1)
+        before = time.time()
+        with self.assertRaises(ValueError):
+            concurrently.run([dict(callback=slow), dict(callback=fail)], failFast=True, stopTimeout=0.1)
+        self.assertLess(time.time() - before, 0.25)
+        self.assertEquals(len(finished), 1)
+
+    def test_nestedSubmissionsDoNotDeadlockAFullExecutor(self):
+        tested = concurrently.Executor(maximumThreads=2)
+        results = []
+
+        def parent(number):
+            children = [tested.submit(results.append, args=((number, child),)) for child in xrange(3)]
+            for child in children:
+                child.result(timeout=5)
+        parents = [tested.submit(parent, args=(number,)) for number in xrange(4)]
+        for future in parents:
+            future.result(timeout=5)
+        self.assertEquals(len(results), 12)
+        self.assertEquals(tested.threads(), 2)
+
+    def test_runStartsAllJobsTogetherOnAFullExecutor(self):
+        tested = concurrently.Executor(maximumThreads=1)
+        condition = threading.Condition()
+        arrived = []
+
+        def meet():
+            with condition:
+                arrived.append(None)
+                condition.notify_all()
+                deadline = time.time() + 5
+                while len(arrived) % 3 != 0 and time.time() < deadline:
+                    condition.wait(0.1)
+            if time.time() >= deadline:
+                raise Exception("Not all jobs ran together")
+        meeting = [dict(callback=meet) for i in xrange(3)]
+        with mock.patch.object(concurrently, 'shared', return_value=tested):
+            tested.submit(concurrently.run, args=(meeting,)).result(timeout=10)
+            release = threading.Event()
+            blocking = tested.submit(release.wait)
+            concurrently.run(meeting, timeout=10)
+            release.set()
+            blocking.result(timeout=5)
+        self.assertEquals(len(arrived), 6)
+        self.assertEquals(tested.threads(), 1)
+
+    def test_runningInlineIsOptIn(self):
+        tested = concurrently.Executor(maximumThreads=1)
+
+        def parent(runInlineWhenBusy):
+            child = tested.submit(threading.current_thread, runInlineWhenBusy=runInlineWhenBusy)
+            return child.result(timeout=5) is threading.current_thread()
+        self.assertFalse(tested.submit(parent, args=(False,)).result(timeout=5))
+        self.assertTrue(tested.submit(parent, args=(True,)).result(timeout=5))
+
+    def test_futureCancellationAndTimings(self):
+        tested = concurrently.Executor(maximumThreads=1)
+        release = threading.Event()
+        blocking = tested.submit(release.wait, description="blocking")
+        queued = tested.submit(lambda: 1, description="queued")
+        self.assertTrue(queued.cancel())
+        with self.assertRaises(concurrently.TimeoutError):
+            blocking.result(timeout=0.05)
+        release.set()
+        blocking.result(timeout=5)
+        with self.assertRaises(concurrently.Cancelled):
+            queued.result()
+        self.assertEquals(tested.submit(lambda: 7, description="quick").result(timeout=5), 7)
+        timings = tested.timings()
+        self.assertEquals(timings['blocking']['count'], 1)
+        self.assertGreaterEqual(timings['blocking']['seconds'], 0.05)
+        self.assertNotIn('queued', timings)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import shutil
+import json
+import os
+import tempfile
+from strato.racktest.runner import durationhistory
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix="_testdir")
+        self._filename = os.path.join(self._dir, "history", "durations.json")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def test_scenarioWithoutHistoryGetsDefaultEstimate(self):
+        tested = durationhistory.DurationHistory(self._filename, defaultEstimate=42)
+        self.assertFalse(tested.exists())
+        self.assertEquals(tested.estimate('racktests/1_ping.py'), 42)
+
+    def test_estimateIsAverageOfRecentDurations(self):
+        tested = durationhistory.DurationHistory(self._filename, defaultEstimate=42)
+        tested.update([dict(scenario='a.py', timeTook=10.0), dict(scenario='a.py', timeTook=20.0)])
+        self.assertEquals(tested.estimate('a.py'), 15.0)
+        for i in xrange(100):
+            tested.update([dict(scenario='a.py', timeTook=100.0)])
+        self.assertEquals(tested.estimate('a.py'), 100.0)
+
+    def test_persistsAcrossInstances(self):
+        tested = durationhistory.DurationHistory(self._filename, defaultEstimate=42)
+        tested.update([dict(scenario='a.py', timeTook=10.0)])
+        tested.save()
+        reloaded = durationhistory.DurationHistory(self._filename, defaultEstimate=42)
+        self.assertTrue(reloaded.exists())
+        self.assertEquals(reloaded.estimate('a.py'), 10.0)
+
+    def test_importReport(self):
+        reportFilename = os.path.join(self._dir, "racktestrunnerreport.json")
+        with open(reportFilename, "w") as f:
+            json.dump([dict(scenario='a.py', instance='', passed=True, timeTook=30.0, host='localhost')], f)
+        tested = durationhistory.DurationHistory(self._filename, defaultEstimate=42)
+        tested.importReport(reportFilename)
+        self.assertEquals(tested.estimate('a.py'), 30.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import unittest
+import threading
+import mock
+import time
+from strato.racktest.infra import executioner
+from strato.racktest.infra import rackattackallocation
+from benchmark import fakerackattack
+
+_CREDENTIALS = dict(username="root", password="password", hostname="127.0.0.1", port=22, key=None)
+
+
+class FakeTest:
+    HOSTS = dict()
+
+
+class FakeClient(fakerackattack.Client):
+    "Allocates every rackattack's hosts as long as its slowest host takes, or dies when asked to"
+    def __init__(self, allocationDelays, deaths):
+        fakerackattack.Client.__init__(self, _CREDENTIALS, allocationDelay=0)
+        self._allocationDelays = allocationDelays
+        self._deaths = deaths
+
+    def allocate(self, requirements, allocationInfo):
+        names = sorted(requirements)
+        allocation = fakerackattack.Allocation(
+            "fake-%s" % "-".join(names), names, _CREDENTIALS,
+            max(self._allocationDelays.get(name, 0) for name in names))
+        self.allocations.append(allocation)
+        for name in names:
+            if name in self._deaths:
+                threading.Timer(self._deaths[name], allocation.die, args=("%s is broken" % name,)).start()
+        return allocation
+
+    def allocationOf(self, name):
+        return [allocation for allocation in self.allocations if name in allocation.nodes()][0]
+
+
+class FakeSSH:
+    def __init__(self, name, connect):
+        self._name = name
+        self._connect = connect
+
+    def connect(self):
+        self._connect(self._name)
+
+
+class FakeHost:
+    def __init__(self, node, name, connect):
+        self.node = node
+        self.name = name
+        self.ssh = FakeSSH(name, connect)
+        self.logbeam = mock.Mock()
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tested = executioner.Executioner(FakeTest)
+        self._lock = threading.Lock()
+        self._order = []
+
+    def _record(self, name, delay=0):
+        time.sleep(delay)
+        with self._lock:
+            self._order.append(name)
+
+    def _fail(self):
+        raise Exception("Failing on purpose")
+
+    def _allocatingExecutioner(self, hosts, allocationDelays=dict(), deaths=dict(), connectDelays=dict(),
+                               connectFailures=(), setUpHostDelays=dict()):
+        self.client = FakeClient(allocationDelays, deaths)
+
+        def connect(name):
+            time.sleep(connectDelays.get(name, 0))
+            if name in connectFailures:
+                raise Exception("Unable to connect to %s" % name)
+        test = self
+
+        class Scenario:
+            HOSTS = hosts
+
+            def setUpHost(self, name):
+                test._record(('setUpHost', name, test.client.allocationOf(name).freed()))
+                time.sleep(setUpHostDelays.get(name, 0))
+                test._record(('setUpHostDone', name, test.client.allocationOf(name).freed()))
+
+            def tearDownHost(self, name):
+                test._record(('tearDownHost', name, test.client.allocationOf(name).freed()))
+        patchers = [
+            mock.patch('rackattack.clientfactory.factory', return_value=self.client),
+            mock.patch('strato.racktest.hostundertest.host.Host',
+                       lambda node, name: FakeHost(node, name, connect)),
+            mock.patch('strato.racktest.infra.readinessprober.shared'),
+            mock.patch.object(executioner.Executioner, '_armTestTimer'),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_rackattackRequirements',
+                              lambda self: dict((name, None) for name in self._hosts)),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_rackattackAllocationInfo',
+                              lambda self: None),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_postMortemAllocation'),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_WAIT_TIMEOUT', 0.2),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_CHECK_INTERVAL', 0.05)]
+        mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        mocks[2].return_value.waitForSSH.return_value = 0
+        self._armedAfter = []
+        mocks[3].side_effect = lambda: self._armedAfter.append(list(self._order))
+        self.addCleanup(rackattackallocation.waitForPostMortems)
+        tested = executioner.Executioner(Scenario)
+        tested._hosts = dict()
+        return tested
+
+    def test_cleanUpsWithinAGroupRunLastInFirstOut(self):
+        for name in ['a1', 'a2', 'a3']:
+            self.tested._addCleanup(self._record, name, delay=0.01, cleanupGroup='a')
+        for name in ['b1', 'b2']:
+            self.tested._addCleanup(self._record, name, delay=0.01, cleanupGroup='b')
+        self.tested._cleanUp()
+        self.assertEquals([name for name in self._order if name.startswith('a')], ['a3', 'a2', 'a1'])
+        self.assertEquals([name for name in self._order if name.startswith('b')], ['b2', 'b1'])
+
+    def test_groupsRunConcurrently(self):
+        for group in xrange(4):
+            self.tested._addCleanup(self._record, group, delay=0.2, cleanupGroup=group)
+        before = time.time()
+        self.tested._cleanUp()
+        self.assertLess(time.time() - before, 0.6)
+        self.assertEquals(sorted(self._order), range(4))
+
+    def test_ungroupedCleanUpsKeepTheirPlace(self):
+        self.tested._addCleanup(self._record, 'removeDirectory')
+        self.tested._addCleanup(self._record, 'deleteVolume', cleanupGroup='host1')
+        self.tested._addCleanup(self._record, 'unmount')
+        self.tested._addCleanup(self._record, 'stopService', cleanupGroup='host1')
+        self.tested._addCleanup(self._record, 'stopOtherService', cleanupGroup='host2')
+        self.tested._cleanUp()
+        self.assertEquals(self._order[2:], ['unmount', 'deleteVolume', 'removeDirectory'])
+        self.assertEquals(sorted(self._order[:2]), ['stopOtherService', 'stopService'])
+
+    def test_resultsAreRecorded(self):
+        self.tested._addCleanup(self._record, 'ungrouped')
+        self.tested._addCleanup(self._fail, cleanupGroup='host1')
+        self.tested._cleanUp()
+        results = sorted(self.tested._cleanUpResults, key=lambda result: result['callback'])
+        self.assertEquals([(result['callback'], result['group'], result['failed']) for result in results],
+                          [('_fail', 'host1', True), ('_record', None, False)])
+        self.assertTrue(all(result['seconds'] >= 0 for result in results))
+
+    def test_siblingsStopBeforeTheAllocationOfAFailedHostIsFreed(self):
+        tested = self._allocatingExecutioner(
+            dict(failing=dict(), settingUp=dict(), connecting=dict()),
+            connectDelays=dict(failing=0.1, connecting=0.3), connectFailures=['failing'],
+            setUpHostDelays=dict(settingUp=0.5))
+        tested._createAllocations()
+        allocation = self.client.allocationOf('settingUp')
+        self.assertTrue(allocation.freed())
+        self.assertEquals(self._order, [
+            ('setUpHost', 'settingUp', False), ('setUpHostDone', 'settingUp', False),
+            ('tearDownHost', 'settingUp', False)])
+        self.assertEquals(tested.hosts(), dict())
+        self.assertEquals(len(tested._hostSetUpFailures), 1)
+        self.assertIn("failing", str(tested._hostSetUpFailures[0][1]))
+
+    def test_setUpHostsAreTornDownWhenAnotherRackattackFails(self):
+        tested = self._allocatingExecutioner(
+            dict(ready=dict(rackattack='first'), broken=dict(rackattack='second')),
+            allocationDelays=dict(broken=60), deaths=dict(broken=0.5))
+        with self.assertRaises(Exception) as raised:
+            tested._createAllocations()
+        self.assertIn("broken is broken", str(raised.exception))
+        self.assertEquals(self._order, [
+            ('setUpHost', 'ready', False), ('setUpHostDone', 'ready', False),
+            ('tearDownHost', 'ready', False)])
+        self.assertTrue(self.client.allocationOf('ready').freed())
+
+    def test_failingRackattackAbortsAndFreesTheOthers(self):
+        tested = self._allocatingExecutioner(
+            dict(broken=dict(rackattack='first'), waiting=dict(rackattack='second'),
+                 alsoWaiting=dict(rackattack='third')),
+            allocationDelays=dict(broken=60, waiting=60, alsoWaiting=60), deaths=dict(broken=0.3))
+        before = time.time()
+        with self.assertRaises(Exception) as raised:
+            tested._createAllocations()
+        self.assertLess(time.time() - before, 3)
+        self.assertIn("broken is broken", str(raised.exception))
+        self.assertTrue(self.client.allocationOf('waiting').freed())
+        self.assertTrue(self.client.allocationOf('alsoWaiting').freed())
+        self.assertEquals(self._order, [])
+
+    def test_testTimerIsArmedOnceAllRackattacksAllocated(self):
+        tested = self._allocatingExecutioner(
+            dict(fast=dict(rackattack='first'), slow=dict(rackattack='second')),
+            allocationDelays=dict(slow=0.5))
+        tested._createAllocations()
+        self.assertEquals(self._armedAfter, [
+            [('setUpHost', 'fast', False), ('setUpHostDone', 'fast', False)]])
+
+
+if __name__ == '__main__':
+    unittest.main()
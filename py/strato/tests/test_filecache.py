@@ -1,5 +1,8 @@
 import unittest
 import shutil
+import zipfile
+import StringIO
+import glob
 from strato.racktest.infra.seed import filecache
 import os
 import tempfile
@@ -28,5 +31,41 @@ class Test(unittest.TestCase):
         finally:
             shutil.rmtree(targetDir, ignore_errors=True)
 
+    def test_eggMembersAreStoredOnceAcrossKeys(self):
+        targetDir = tempfile.mkdtemp(suffix="_testdir")
+        try:
+            tested = filecache.FileCache(targetDir)
+            shared = 'x' * 100000
+            first = self._egg({'a/shared.py': shared, 'a/first.py': 'first'})
+            second = self._egg({'a/shared.py': shared, 'a/second.py': 'second'})
+            tested.install(seedcache.SeedID('key1'), {'code': first, 'deps': {}})
+            tested.install(seedcache.SeedID('key2'), {'code': second, 'deps': {}})
+            objects = glob.glob(os.path.join(targetDir, 'objects', '*', '*'))
+            self.assertEqual(3, len(objects))
+            self.assertLess(sum(os.path.getsize(path) for path in objects), len(shared))
+            for key, egg in [('key1', first), ('key2', second)]:
+                assembled = zipfile.ZipFile(StringIO.StringIO(tested.get(seedcache.SeedID(key))))
+                original = zipfile.ZipFile(StringIO.StringIO(egg))
+                self.assertEqual(original.namelist(), assembled.namelist())
+                for name in original.namelist():
+                    self.assertEqual(original.read(name), assembled.read(name))
+            tested.removeKey(seedcache.SeedID('key1').hash)
+            self.assertEqual(0, tested.collectGarbage())
+            tested.collectGarbage(graceSeconds=0)
+            self.assertEqual(2, len(glob.glob(os.path.join(targetDir, 'objects', '*', '*'))))
+            self.assertEqual(second, tested.get(seedcache.SeedID('key2')))
+        finally:
+            shutil.rmtree(targetDir, ignore_errors=True)
+
+    def _egg(self, members):
+        output = StringIO.StringIO()
+        egg = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+        for name, contents in sorted(members.iteritems()):
+            info = zipfile.ZipInfo(name, (2015, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            egg.writestr(info, contents)
+        egg.close()
+        return output.getvalue()
+
 if __name__ == '__main__':
     unittest.main()
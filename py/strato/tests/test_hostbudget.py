@@ -0,0 +1,62 @@
+import unittest
+from strato.racktest.runner import hostbudget
+from strato.racktest.infra import hostsdefinition
+
+
+class Test(unittest.TestCase):
+
+    def test_fitsUntilBudgetIsTaken(self):
+        tested = hostbudget.HostBudget(defaultBudget=7)
+        tested.take(dict(defaultRackattack=3))
+        self.assertTrue(tested.fits(dict(defaultRackattack=3)))
+        tested.take(dict(defaultRackattack=3))
+        self.assertFalse(tested.fits(dict(defaultRackattack=3)))
+        self.assertTrue(tested.fits(dict(defaultRackattack=1)))
+        tested.give(dict(defaultRackattack=3))
+        self.assertTrue(tested.fits(dict(defaultRackattack=3)))
+
+    def test_demandLargerThanBudgetIsClampedToRunAlone(self):
+        tested = hostbudget.HostBudget(defaultBudget=10)
+        hosts = tested.clamped(dict(defaultRackattack=20))
+        self.assertEquals(hosts, dict(defaultRackattack=10))
+        self.assertTrue(tested.fits(hosts))
+        tested.take(dict(defaultRackattack=1))
+        self.assertFalse(tested.fits(hosts))
+
+    def test_budgetIsPerRackattack(self):
+        tested = hostbudget.HostBudget(defaultBudget=5, budgets=dict(rack2=2))
+        tested.take(dict(rack1=5))
+        self.assertFalse(tested.fits(dict(rack1=1)))
+        self.assertTrue(tested.fits(dict(rack2=2)))
+        self.assertFalse(tested.fits(dict(rack2=3)))
+        self.assertEquals(tested.budget('rack2'), 2)
+
+    def test_reservedHostsAreTakenUntilTheirJobIsAdmitted(self):
+        tested = hostbudget.HostBudget(defaultBudget=4)
+        self.assertTrue(tested.reserve('later', dict(defaultRackattack=3)))
+        self.assertFalse(tested.reserve('other', dict(defaultRackattack=2)))
+        self.assertFalse(tested.admit('other', dict(defaultRackattack=2)))
+        self.assertTrue(tested.admit('later', dict(defaultRackattack=3)))
+        tested.unreserve('later')
+        self.assertFalse(tested.fits(dict(defaultRackattack=2)))
+        tested.give(dict(defaultRackattack=3))
+        self.assertTrue(tested.fits(dict(defaultRackattack=4)))
+
+    def test_unreservedHostsAreGivenBack(self):
+        tested = hostbudget.HostBudget(defaultBudget=4)
+        tested.reserve('later', dict(defaultRackattack=3))
+        tested.unreserve('later')
+        self.assertTrue(tested.admit('other', dict(defaultRackattack=4)))
+
+    def test_multiclusterHostsDemand(self):
+        hosts = {'sourceCluster': {'src0': dict(rootfs='rootfs-vanilla'),
+                                   'src1': dict(rootfs='rootfs-vanilla', rackattack='other')},
+                 'destCluster': {'dst0': dict(rootfs='rootfs-vanilla')},
+                 'multicluster': True}
+        self.assertEquals(hostsdefinition.hostsDemand(hosts), dict(defaultRackattack=2, other=1))
+        self.assertEquals(hostsdefinition.hostsDemand(dict(it=dict(rootfs='rootfs-basic'))),
+                          dict(defaultRackattack=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import shutil
+import os
+import tempfile
+from strato.racktest.runner import importgraph
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = os.path.realpath(tempfile.mkdtemp(suffix="_testdir"))
+        self._write("helpers/__init__.py", "")
+        self._write("helpers/network.py", "from helpers import retry\nimport socket\n")
+        self._write("helpers/retry.py", "import time\n")
+        self._write("helpers/disk.py", "from . import retry\n")
+        self._write("helpers/unused.py", "")
+        self._write("racktests/1_network.py", "from helpers import network\n")
+        self._write("racktests/2_disk.py", "import helpers.disk\n")
+        self._write("racktests/3_nothing.py", "import os\n")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _write(self, relativePath, contents):
+        path = os.path.join(self._dir, relativePath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(contents)
+
+    def _path(self, relativePath):
+        return os.path.join(self._dir, relativePath)
+
+    def _graph(self):
+        return importgraph.ImportGraph(
+            self._dir, self._path("graph.json"), searchPath=[self._dir],
+            seedCacheDirectory=self._path("noseedcache"))
+
+    def test_transitiveDependencies(self):
+        dependencies = self._graph().dependencies(self._path("racktests/1_network.py"))
+        self.assertEquals(dependencies, set(self._path(p) for p in [
+            "racktests/1_network.py", "helpers/__init__.py", "helpers/network.py", "helpers/retry.py"]))
+
+    def test_relativeImport(self):
+        dependencies = self._graph().dependencies(self._path("racktests/2_disk.py"))
+        self.assertIn(self._path("helpers/retry.py"), dependencies)
+        self.assertNotIn(self._path("helpers/network.py"), dependencies)
+
+    def test_filesOutsideTheRootAreNotFollowed(self):
+        dependencies = self._graph().dependencies(self._path("racktests/3_nothing.py"))
+        self.assertEquals(dependencies, set([self._path("racktests/3_nothing.py")]))
+
+    def test_importsAreCached(self):
+        graph = self._graph()
+        graph.dependencies(self._path("racktests/1_network.py"))
+        graph.save()
+        self._write("helpers/network.py", "from helpers import unused\n")
+        os.utime(self._path("helpers/network.py"), (0, 0))
+        dependencies = self._graph().dependencies(self._path("racktests/1_network.py"))
+        self.assertIn(self._path("helpers/unused.py"), dependencies)
+        self.assertNotIn(self._path("helpers/retry.py"), dependencies)
+
+    def test_changedFilesFromAList(self):
+        changed = importgraph.changedFiles([self._path("helpers/retry.py")], root=self._dir)
+        self.assertEquals(changed, set([self._path("helpers/retry.py")]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import shutil
+import json
+import os
+import tempfile
+from strato.racktest.runner import livereport
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix="_testdir")
+        self._filename = os.path.join(self._dir, "racktestrunnerlivereport.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _result(self, scenario, passed=True):
+        return dict(scenario=scenario, instance='', passed=passed, timeTook=1.0, host='localhost')
+
+    def test_appendAndRead(self):
+        tested = livereport.LiveReport(self._filename)
+        tested.start(scenarios=['a.py', 'b.py'], instances=[''], runTimestamp='now')
+        tested.append(self._result('a.py'))
+        header, results, footer = livereport.read(self._filename)
+        self.assertEquals(header['scenarios'], ['a.py', 'b.py'])
+        self.assertEquals(results, [self._result('a.py')])
+        self.assertEquals(footer, None)
+        tested.append(self._result('b.py', passed=False))
+        tested.finish(passed=1, total=2)
+        header, results, footer = livereport.read(self._filename)
+        self.assertEquals(len(results), 2)
+        self.assertEquals(footer, dict(passed=1, total=2))
+
+    def test_tailReturnsOnlyNewRecords(self):
+        tested = livereport.LiveReport(self._filename)
+        tested.start(scenarios=['a.py'], instances=[''], runTimestamp='now')
+        records, offset = livereport.tail(self._filename)
+        self.assertEquals(len(records), 1)
+        tested.append(self._result('a.py'))
+        with open(self._filename, "a") as f:
+            f.write('{"type": "res')
+        records, offset = livereport.tail(self._filename, offset)
+        self.assertEquals(len(records), 1)
+        self.assertEquals(records[0]['scenario'], 'a.py')
+        records, offset = livereport.tail(self._filename, offset)
+        self.assertEquals(records, [])
+
+    def test_compactWritesRunnerReport(self):
+        tested = livereport.LiveReport(self._filename)
+        tested.start(scenarios=['a.py'], instances=['_try0', '_try1'], runTimestamp='now')
+        tested.append(self._result('a.py'))
+        tested.append(self._result('a.py'))
+        tested.finish(passed=2, total=2)
+        reportFilename = os.path.join(self._dir, "racktestrunnerreport.json")
+        tested.compact(reportFilename)
+        with open(reportFilename) as f:
+            self.assertEquals(json.load(f), [self._result('a.py'), self._result('a.py')])
+
+    def test_lateFailuresAreAttachedToTheirResult(self):
+        tested = livereport.LiveReport(self._filename)
+        tested.start(scenarios=['a.py', 'b.py'], instances=[''], runTimestamp='now')
+        tested.append(self._result('a.py'))
+        tested.append(self._result('b.py'))
+        tested.lateFailure('a.py', '', 'free allocation 3 from default')
+        tested.finish(passed=2, total=2)
+        header, results, footer = livereport.read(self._filename)
+        self.assertEquals(results[0]['lateFailures'], ['free allocation 3 from default'])
+        self.assertNotIn('lateFailures', results[1])
+        self.assertEquals(footer, dict(passed=2, total=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
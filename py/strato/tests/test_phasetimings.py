@@ -0,0 +1,34 @@
+import unittest
+from strato.racktest.infra import phasetimings
+
+
+class Test(unittest.TestCase):
+
+    def test_measuringAPhaseTwiceAccumulates(self):
+        tested = phasetimings.PhaseTimings()
+        tested.record('run', 2.0)
+        tested.record('run', 3.0)
+        tested.record('connect', 1.0, host='it')
+        tested.record('connect', 4.0, host='other')
+        self.assertEquals(tested.asDict(), dict(
+            phases=dict(run=5.0), hosts=dict(it=dict(connect=1.0), other=dict(connect=4.0))))
+
+    def test_measureRecordsEvenOnException(self):
+        tested = phasetimings.PhaseTimings()
+        with self.assertRaises(ZeroDivisionError):
+            with tested.measure('setUp'):
+                1 / 0
+        self.assertIn('setUp', tested.asDict()['phases'])
+
+    def test_aggregate(self):
+        first = dict(phases=dict(allocation=10.0, run=2.0), hosts=dict(it=dict(connect=1.0)))
+        second = dict(phases=dict(allocation=30.0),
+                      hosts=dict(it=dict(connect=3.0), other=dict(connect=5.0)))
+        result = phasetimings.aggregate([first, second])
+        self.assertEquals(result['allocation'], dict(total=40.0, count=2, mean=20.0, maximum=30.0))
+        self.assertEquals(result['run'], dict(total=2.0, count=1, mean=2.0, maximum=2.0))
+        self.assertEquals(result['connect'], dict(total=9.0, count=3, mean=3.0, maximum=5.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import unittest
+import threading
+import json
+import mock
+import time
+from strato.racktest.runner import preallocator
+from strato.racktest.runner import allocationpool
+from strato.racktest.runner import hostbudget
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._allocated = []
+        self._leases = dict()
+        self._allocations = dict()
+        self._failing = set()
+        self._blocking = dict()
+        patcher = mock.patch('strato.racktest.runner.allocationpool.allocate', side_effect=self._allocate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(preallocator.Preallocator, '_WAIT_INTERVAL', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _allocate(self, hosts):
+        name = hosts.keys()[0]
+        with self._lock:
+            self._allocated.append(name)
+        if name in self._blocking:
+            self._blocking[name].wait()
+        if name in self._failing:
+            raise Exception("Unable to allocate %s" % name)
+        self._allocations[name] = mock.Mock()
+        self._allocations[name].allocationID.return_value = "allocation-of-%s" % name
+        self._leases[name] = allocationpool.Lease(
+            hosts, dict(defaultRackattack=self._allocations[name]), hostsToReinaugurate=[])
+        return self._leases[name]
+
+    def _jobs(self, *names):
+        "Jobs named 'dynamic...' have no statically known hosts"
+        return [dict(key=name, hosts=None if name.startswith('dynamic') else self._hosts(name))
+                for name in names]
+
+    def _hosts(self, name):
+        return {name: dict(rootfs='rootfs-basic')}
+
+    def _waitFor(self, predicate):
+        before = time.time()
+        while not predicate():
+            self.assertLess(time.time() - before, 5)
+            time.sleep(0.01)
+
+    def test_preallocatesAheadInQueueOrder(self):
+        tested = preallocator.Preallocator(
+            self._jobs('first', 'dynamic', 'second', 'third'), maximumOutstanding=2)
+        self._waitFor(lambda: len(self._allocated) == 2)
+        time.sleep(0.1)
+        self.assertEquals(self._allocated, ['first', 'second'])
+        self.assertIs(tested.claim('first'), self._leases['first'])
+        self._waitFor(lambda: len(self._allocated) == 3)
+        self.assertEquals(self._allocated, ['first', 'second', 'third'])
+        self.assertIsNone(tested.claim('dynamic'))
+        tested.close()
+
+    def test_allocationsInProgressCountAgainstTheOutstandingBudget(self):
+        self._blocking['first'] = threading.Event()
+        tested = preallocator.Preallocator(self._jobs('first', 'second'), maximumOutstanding=1)
+        self._waitFor(lambda: len(self._allocated) == 1)
+        time.sleep(0.1)
+        self.assertEquals(self._allocated, ['first'])
+        claimed = []
+        claimer = threading.Thread(target=lambda: claimed.append(tested.claim('first')))
+        claimer.start()
+        time.sleep(0.1)
+        self.assertEquals(claimed, [])
+        self._blocking['first'].set()
+        claimer.join()
+        self.assertIs(claimed[0], self._leases['first'])
+        self._waitFor(lambda: len(self._allocated) == 2)
+        tested.close()
+
+    def test_failedPreallocationFreesItsPlaceAndLetsTheScenarioAllocate(self):
+        self._failing.add('first')
+        tested = preallocator.Preallocator(self._jobs('first', 'second'), maximumOutstanding=1)
+        self._waitFor(lambda: len(self._allocated) == 2)
+        self.assertIsNone(tested.claim('first'))
+        self.assertIs(tested.claim('second'), self._leases['second'])
+        tested.close()
+
+    def test_jobClaimedBeforeItsTurnAllocatesByItself(self):
+        self._blocking['first'] = threading.Event()
+        tested = preallocator.Preallocator(self._jobs('first', 'second'), maximumOutstanding=1)
+        self._waitFor(lambda: len(self._allocated) == 1)
+        self.assertIsNone(tested.claim('second'))
+        self._blocking['first'].set()
+        tested.claim('first')
+        time.sleep(0.1)
+        self.assertEquals(self._allocated, ['first'])
+        tested.close()
+
+    def test_closeFreesUnclaimedPreallocations(self):
+        self._blocking['second'] = threading.Event()
+        tested = preallocator.Preallocator(self._jobs('first', 'second'), maximumOutstanding=2)
+        self._waitFor(lambda: 'first' in self._leases and len(self._allocated) == 2)
+        tested.close()
+        self.assertEquals(self._allocations['first'].free.call_count, 1)
+        self._blocking['second'].set()
+        self._waitFor(lambda: 'second' in self._allocations and
+                      self._allocations['second'].free.call_count == 1)
+
+    def test_preallocationsAreReservedInTheHostBudget(self):
+        budget = hostbudget.HostBudget(defaultBudget=1)
+        tested = preallocator.Preallocator(
+            self._jobs('first', 'second'), maximumOutstanding=2, hostBudget=budget)
+        self._waitFor(lambda: len(self._allocated) == 1)
+        self.assertFalse(budget.fits(dict(defaultRackattack=1)))
+        self.assertTrue(budget.admit('first', dict(defaultRackattack=1)))
+        self.assertIs(tested.claim('first'), self._leases['first'])
+        time.sleep(0.2)
+        self.assertEquals(self._allocated, ['first'])
+        budget.give(dict(defaultRackattack=1))
+        self._waitFor(lambda: len(self._allocated) == 2)
+        self.assertFalse(budget.fits(dict(defaultRackattack=1)))
+        tested.close()
+        self.assertTrue(budget.fits(dict(defaultRackattack=1)))
+
+    def test_claimedLeaseIsHandedOverToThePool(self):
+        tested = preallocator.Preallocator(self._jobs('it'), maximumOutstanding=1)
+        self._waitFor(lambda: 'it' in self._leases)
+        lease = tested.claim('it')
+        self.assertEquals(json.loads(lease.environment()['RACKTEST_ALLOCATION_IDS']),
+                          dict(defaultRackattack="allocation-of-it"))
+        tested.close()
+        self.assertEquals(self._allocations['it'].free.call_count, 0)
+        pool = allocationpool.AllocationPool()
+        pool.release(lease, reusable=True)
+        reused = pool.acquire(self._hosts('it'))
+        self.assertEquals(self._allocated, ['it'])
+        self.assertEquals(reused.environment(), lease.environment())
+        pool.release(reused, reusable=True)
+        pool.close()
+        self.assertEquals(self._allocations['it'].free.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
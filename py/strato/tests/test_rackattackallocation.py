@@ -0,0 +1,106 @@
+import unittest
+import threading
+import tempfile
+import shutil
+import mock
+import gzip
+import time
+import os
+from strato.racktest.infra import rackattackallocation
+from benchmark import fakerackattack
+
+_CREDENTIALS = dict(username="root", password="password", hostname="127.0.0.1", port=22, key=None)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.client = fakerackattack.Client(_CREDENTIALS, allocationDelay=0)
+        patchers = [
+            mock.patch('rackattack.clientfactory.factory', return_value=self.client),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_rackattackRequirements',
+                              lambda self: dict((name, None) for name in self._hosts)),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_rackattackAllocationInfo',
+                              lambda self: None),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_postMortemAllocation'),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_WAIT_TIMEOUT', 0.2),
+            mock.patch.object(rackattackallocation.RackAttackAllocation, '_CHECK_INTERVAL', 0.05)]
+        mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.postMortem = mocks[3]
+        self.addCleanup(rackattackallocation.waitForPostMortems)
+
+    def _allocate(self, allocationDelay, abort=None):
+        self.client._allocationDelay = allocationDelay
+        return rackattackallocation.RackAttackAllocation(hosts=dict(it=dict(), other=dict()), abort=abort)
+
+    def test_completion(self):
+        before = time.time()
+        tested = self._allocate(allocationDelay=0.5)
+        self.assertGreaterEqual(time.time() - before, 0.4)
+        self.assertEquals(sorted(tested.nodes()), ['it', 'other'])
+        self.assertEquals(tested.allocationID(), self.client.allocations[0].id())
+        tested.free()
+        self.assertTrue(self.client.allocations[0].freed())
+        self.assertEquals(tested.nodes(), dict())
+
+    def test_deathIsNoticedWhileWaiting(self):
+        threading.Timer(0.3, lambda: self.client.allocations[0].die("allocation was killed")).start()
+        before = time.time()
+        with mock.patch.object(rackattackallocation.RackAttackAllocation, '_WAIT_TIMEOUT', 60):
+            with self.assertRaises(Exception) as raised:
+                self._allocate(allocationDelay=120)
+        self.assertLess(time.time() - before, 2)
+        self.assertIn("allocation was killed", str(raised.exception))
+        rackattackallocation.waitForPostMortems()
+        self.assertEquals(self.postMortem.call_count, 1)
+
+    def test_noProgressTimesOut(self):
+        with mock.patch.object(rackattackallocation.RackAttackAllocation, '_NO_PROGRESS_TIMEOUT', 0.5):
+            before = time.time()
+            with self.assertRaises(Exception) as raised:
+                self._allocate(allocationDelay=1000)
+        self.assertLess(time.time() - before, 3)
+        self.assertIn("hanged", str(raised.exception))
+        rackattackallocation.waitForPostMortems()
+        self.assertEquals(self.postMortem.call_count, 1)
+
+    def test_abortFreesTheAllocation(self):
+        abort = threading.Event()
+        threading.Timer(0.3, abort.set).start()
+        before = time.time()
+        self.assertRaises(rackattackallocation.AllocationAborted, self._allocate, allocationDelay=60,
+                          abort=abort)
+        self.assertLess(time.time() - before, 2)
+        self.assertTrue(self.client.allocations[0].freed())
+        self.assertEquals(self.postMortem.call_count, 0)
+
+    def test_waitingForPostMortemsIsBounded(self):
+        self.postMortem.side_effect = lambda: time.sleep(5)
+        with mock.patch.object(rackattackallocation.RackAttackAllocation, '_NO_PROGRESS_TIMEOUT', 0.1):
+            self.assertRaises(Exception, self._allocate, allocationDelay=1000)
+        before = time.time()
+        rackattackallocation.waitForPostMortems(timeout=0.2)
+        self.assertLess(time.time() - before, 1)
+
+    def test_writeInChunks(self):
+        directory = tempfile.mkdtemp(suffix="_testdir")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        contents = "".join(chr(i % 256) for i in xrange(2500))
+        with mock.patch.object(rackattackallocation, '_POST_MORTEM_CHUNK_SIZE', 1000):
+            rackattackallocation._writeInChunks(os.path.join(directory, "pack"), contents, compress=False)
+            rackattackallocation._writeInChunks(os.path.join(directory, "pack.gz"), contents, compress=True)
+        with open(os.path.join(directory, "pack"), "rb") as f:
+            self.assertEquals(f.read(), contents)
+        with gzip.open(os.path.join(directory, "pack.gz"), "rb") as f:
+            self.assertEquals(f.read(), contents)
+
+    def test_freeExisting(self):
+        rackattackallocation.freeExisting("allocation-id")
+        self.assertEquals(self.client.allocations[0].id(), "allocation-id")
+        self.assertTrue(self.client.allocations[0].freed())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import threading
+import socket
+import time
+from strato.racktest.infra import readinessprober
+
+
+class FakeServer(threading.Thread):
+    def __init__(self, greeting, delay=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._greeting = greeting
+        self._delay = delay
+        reserve = socket.socket()
+        reserve.bind(("127.0.0.1", 0))
+        self.port = reserve.getsockname()[1]
+        reserve.close()
+        self.start()
+
+    def run(self):
+        time.sleep(self._delay)
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", self.port))
+        listener.listen(5)
+        while True:
+            connection, unused = listener.accept()
+            connection.sendall(self._greeting)
+            time.sleep(0.05)
+            connection.close()
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self.tested = readinessprober.ReadinessProber()
+        self._ready = dict()
+        self._done = threading.Event()
+
+    def tearDown(self):
+        self.tested.close()
+
+    def _onReady(self, name, secondsToReady):
+        self._ready[name] = secondsToReady
+        self._done.set()
+
+    def test_readyOnceBannerArrives(self):
+        server = FakeServer("SSH-2.0-OpenSSH_6.6\r\n", delay=0.5)
+        seconds = self.tested.waitForSSH('it', '127.0.0.1', server.port, timeout=10)
+        self.assertGreaterEqual(seconds, 0.4)
+        self.assertLess(seconds, 5)
+
+    def test_acceptWithoutBannerIsNotReady(self):
+        server = FakeServer("HTTP/1.1 400 Bad Request\r\n")
+        self.tested.watch('it', '127.0.0.1', server.port, self._onReady, timeout=1)
+        self._done.wait(5)
+        self.assertEquals(self._ready, dict(it=None))
+
+    def test_manyHostsAtOnce(self):
+        servers = [FakeServer("SSH-2.0-test\r\n", delay=0.1 * i) for i in xrange(5)]
+        for i, server in enumerate(servers):
+            self.tested.watch('host%d' % i, '127.0.0.1', server.port, self._onReady, timeout=10)
+        before = time.time()
+        while len(self._ready) < 5 and time.time() - before < 10:
+            time.sleep(0.05)
+        self.assertEquals(sorted(self._ready), ['host%d' % i for i in xrange(5)])
+        self.assertTrue(all(seconds is not None for seconds in self._ready.values()))
+
+    def test_timeoutRaises(self):
+        server = FakeServer("", delay=60)
+        self.assertRaises(Exception, self.tested.waitForSSH, 'it', '127.0.0.1', server.port, timeout=0.5)
+
+    def test_abortStopsWaiting(self):
+        server = FakeServer("", delay=60)
+        abort = threading.Event()
+        threading.Timer(0.3, abort.set).start()
+        before = time.time()
+        self.assertRaises(readinessprober.Aborted, self.tested.waitForSSH, 'it', '127.0.0.1', server.port,
+                          timeout=30, abort=abort)
+        self.assertLess(time.time() - before, 2)
+
+    def test_unresolvableHostnameFailsWithoutStoppingTheProber(self):
+        before = time.time()
+        self.assertRaises(Exception, self.tested.waitForSSH, 'bad', 'nonexistent.invalid', 22, timeout=30)
+        self.assertLess(time.time() - before, 10)
+        server = FakeServer("SSH-2.0-test\r\n")
+        self.assertIsNotNone(self.tested.waitForSSH('good', '127.0.0.1', server.port, timeout=10))
+
+    def test_waitTimesOutEvenIfTheProberThreadDied(self):
+        server = FakeServer("", delay=60)
+
+        def fail():
+            raise Exception("prober thread died")
+        self.tested._pollTimeout = fail
+        before = time.time()
+        self.assertRaises(Exception, self.tested.waitForSSH, 'it', '127.0.0.1', server.port, timeout=0.5)
+        self.assertLess(time.time() - before, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
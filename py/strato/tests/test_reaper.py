@@ -0,0 +1,64 @@
+import unittest
+import threading
+from strato.racktest.runner import reaper
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._calls = []
+        self._failures = []
+
+    def _failing(self, times):
+        def callback():
+            self._calls.append(None)
+            if len(self._calls) <= times:
+                raise Exception("Failing on purpose")
+        return callback
+
+    def test_retriesUntilSucceeding(self):
+        tested = reaper.Reaper(attempts=3, threads=1, initialBackoff=0.01)
+        tested.submit("free", self._failing(2), self._failures.append)
+        tested.close()
+        self.assertEquals(len(self._calls), 3)
+        self.assertEquals(self._failures, [])
+
+    def test_reportsFailureAfterLastAttempt(self):
+        tested = reaper.Reaper(attempts=2, threads=1, initialBackoff=0.01)
+        tested.submit("free", self._failing(5), self._failures.append)
+        tested.close()
+        self.assertEquals(len(self._calls), 2)
+        self.assertEquals(self._failures, ["free"])
+
+    def test_closeWaitsForAllSubmittedWork(self):
+        tested = reaper.Reaper(maximumQueued=2, threads=2)
+        done = []
+        lock = threading.Lock()
+
+        def callback():
+            with lock:
+                done.append(None)
+        for i in xrange(10):
+            tested.submit("work %d" % i, callback)
+        tested.close()
+        self.assertEquals(len(done), 10)
+
+    def test_submitBlocksWhileQueueIsFull(self):
+        tested = reaper.Reaper(maximumQueued=1, threads=1)
+        release = threading.Event()
+        tested.submit("blocking", release.wait)
+        tested.submit("queued", lambda: None)
+        submitted = threading.Event()
+
+        def submit():
+            tested.submit("over the bound", lambda: None)
+            submitted.set()
+        threading.Thread(target=submit).start()
+        self.assertFalse(submitted.wait(0.2))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        tested.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import tempfile
+import shutil
+import mock
+import os
+from strato.racktest.infra import rootfslabel
+from strato.racktest.infra import phasetimings
+
+
+class FakeRootfsLabel:
+    def __init__(self, rootfs, product="rootfs"):
+        self._label = "solvent__%s__%s__1234__clean" % (rootfs, product)
+        self._hint = rootfs
+
+    def label(self):
+        return self._label
+
+    def imageHint(self):
+        return self._hint
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix="_testdir")
+        environment = dict(RACKTEST_ROOTFS_LABEL_CACHE=os.path.join(self._dir, "labels.json"))
+        patchers = [
+            mock.patch.dict(os.environ, environment),
+            mock.patch('strato.racktest.infra.rootfslabel.RootfsLabel', side_effect=FakeRootfsLabel),
+            mock.patch('upseto.run.run', return_value="cafebabe\n")]
+        mocks = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.rootfsLabelClass = mocks[1]
+        self.git = mocks[2]
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def test_resolvesEachDistinctRootfsOnce(self):
+        timings = phasetimings.PhaseTimings()
+        result = rootfslabel.resolve(
+            [('rootfs-basic', 'rootfs'), ('rootfs-basic', 'rootfs'), ('rootfs-vanilla', 'rootfs')],
+            phaseTimings=timings)
+        self.assertEquals(self.rootfsLabelClass.call_count, 2)
+        self.assertEquals(result[('rootfs-basic', 'rootfs')].label(),
+                          "solvent__rootfs-basic__rootfs__1234__clean")
+        self.assertEquals(result[('rootfs-vanilla', 'rootfs')].imageHint(), "rootfs-vanilla")
+        self.assertEquals(timings.asDict()['counters'], dict(labelCacheHits=0, labelCacheMisses=2))
+
+    def test_cachedLabelsAreNotResolvedAgain(self):
+        rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        timings = phasetimings.PhaseTimings()
+        result = rootfslabel.resolve([('rootfs-basic', 'rootfs'), ('rootfs-vanilla', 'rootfs')],
+                                     phaseTimings=timings)
+        self.assertEquals(self.rootfsLabelClass.call_count, 2)
+        self.assertEquals(result[('rootfs-basic', 'rootfs')].label(),
+                          "solvent__rootfs-basic__rootfs__1234__clean")
+        self.assertEquals(timings.asDict()['counters'], dict(labelCacheHits=1, labelCacheMisses=1))
+
+    def test_expiredLabelsAreResolvedAgain(self):
+        with mock.patch.dict(os.environ, dict(RACKTEST_ROOTFS_LABEL_CACHE_TTL="0")):
+            rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+            rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        self.assertEquals(self.rootfsLabelClass.call_count, 2)
+
+    def test_cacheWritableByOthersIsIgnored(self):
+        rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        os.chmod(os.path.join(self._dir, "labels.json"), 0666)
+        rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        self.assertEquals(self.rootfsLabelClass.call_count, 2)
+
+    def test_cacheDirectoryIsPrivate(self):
+        filename = os.path.join(self._dir, "cache", "labels.json")
+        with mock.patch.dict(os.environ, dict(RACKTEST_ROOTFS_LABEL_CACHE=filename)):
+            rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        self.assertEquals(os.stat(os.path.dirname(filename)).st_mode & 0777, 0700)
+        self.assertEquals(os.stat(filename).st_mode & 0777, 0600)
+
+    def test_thisIsCachedByGitHead(self):
+        rootfslabel.resolve([('THIS', 'rootfs')])
+        rootfslabel.resolve([('THIS', 'rootfs')])
+        self.assertEquals(self.rootfsLabelClass.call_count, 1)
+        self.git.return_value = "deadbeef\n"
+        rootfslabel.resolve([('THIS', 'rootfs')])
+        self.assertEquals(self.rootfsLabelClass.call_count, 2)
+
+    def test_labelsAreCachedByCheckoutAndManifest(self):
+        checkouts = [os.path.join(self._dir, name) for name in ["checkout1", "checkout2"]]
+        for checkout in checkouts:
+            os.mkdir(checkout)
+            with open(os.path.join(checkout, "solvent.manifest"), "w") as f:
+                f.write("requirements: []\n")
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(checkouts[0])
+        rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        self.assertEquals(self.rootfsLabelClass.call_count, 1)
+        with open("solvent.manifest", "w") as f:
+            f.write("requirements: [rootfs-basic]\n")
+        rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        self.assertEquals(self.rootfsLabelClass.call_count, 2)
+        os.chdir(checkouts[1])
+        rootfslabel.resolve([('rootfs-basic', 'rootfs')])
+        self.assertEquals(self.rootfsLabelClass.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import shutil
+import os
+import tempfile
+from strato.racktest.runner import runhistory
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix="_testdir")
+        self.tested = runhistory.RunHistory(os.path.join(self._dir, "history.sqlite"))
+
+    def tearDown(self):
+        self.tested.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _result(self, timeTook, allocation=10.0, passed=True, scenario='a.py', instance=''):
+        return dict(scenario=scenario, instance=instance, passed=passed, timeTook=timeTook, host='localhost',
+                    phaseTimings=dict(phases=dict(allocation=allocation), hosts=dict()),
+                    nodes=dict(it='rack01-server%d' % int(timeTook)))
+
+    def _recordRuns(self, durations):
+        for index, timeTook in enumerate(durations):
+            self.tested.record("2016_01_%02d" % (index + 1), [self._result(timeTook)])
+
+    def test_recordsResultsAndNodes(self):
+        self.tested.record("2016_01_01", [self._result(30.0), self._result(40.0, scenario='b.py')])
+        self.tested.record("2016_01_02", [self._result(35.0, passed=False)])
+        self.assertEquals(self.tested.runs(), ["2016_01_01", "2016_01_02"])
+        self.assertEquals(self.tested.samples('a.py', '', 'timeTook'), [30.0])
+        self.assertEquals(self.tested.samples('a.py', '', 'timeTook', passedOnly=False), [30.0, 35.0])
+        self.assertEquals(self.tested.nodes('b.py', '', "2016_01_01"), dict(it='rack01-server40'))
+
+    def test_recordingTheSameRunAgainReplaces(self):
+        self.tested.record("2016_01_01", [self._result(30.0)])
+        self.tested.record("2016_01_01", [self._result(31.0)])
+        self.assertEquals(self.tested.samples('a.py', '', 'timeTook'), [31.0])
+
+    def test_slowerScenarioIsARegression(self):
+        self._recordRuns([30.0, 31.0, 29.0, 30.0, 30.0, 90.0])
+        regressions = self.tested.regressions()
+        self.assertEquals(len(regressions), 1)
+        self.assertEquals(regressions[0]['metric'], 'timeTook')
+        self.assertEquals(regressions[0]['value'], 90.0)
+        self.assertEquals(regressions[0]['nodes'], dict(it='rack01-server90'))
+
+    def test_usualDurationIsNotARegression(self):
+        self._recordRuns([30.0, 31.0, 29.0, 30.0, 30.0, 31.0])
+        self.assertEquals(self.tested.regressions(), [])
+
+    def test_tooFewSamples(self):
+        self._recordRuns([30.0, 90.0])
+        self.assertEquals(self.tested.regressions(), [])
+
+    def test_instancesHaveTheirOwnBaseline(self):
+        for index in xrange(6):
+            self.tested.record("2016_01_%02d" % (index + 1), [
+                self._result(30.0 + index % 2), self._result(90.0 - index % 2, instance='_large')])
+        self.assertEquals(self.tested.samples('a.py', '_large', 'timeTook'), [90.0, 89.0] * 3)
+        self.assertEquals(self.tested.regressions(), [])
+        self.tested.record("2016_01_07", [self._result(90.0), self._result(90.0, instance='_large')])
+        self.assertEquals([(r['instance'], r['value']) for r in self.tested.regressions()], [('', 90.0)])
+
+    def test_allocationWaitRegression(self):
+        for index in xrange(5):
+            self.tested.record("2016_01_%02d" % (index + 1), [self._result(30.0, allocation=10.0)])
+        self.tested.record("2016_01_06", [self._result(30.0, allocation=25.0)])
+        self.assertEquals([r['metric'] for r in self.tested.regressions()], ['allocation'])
+
+
+if __name__ == '__main__':
+    unittest.main()
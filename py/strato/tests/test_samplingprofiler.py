@@ -0,0 +1,68 @@
+import unittest
+import threading
+import tempfile
+import shutil
+import time
+import os
+from strato.racktest.infra import samplingprofiler
+
+
+def waitInPredicateLoop(started, stop):
+    started.set()
+    while not stop.is_set():
+        time.sleep(0.005)
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix="_testdir")
+        self._stop = threading.Event()
+        started = threading.Event()
+        self._thread = threading.Thread(target=waitInPredicateLoop, args=(started, self._stop), name="stuck")
+        self._thread.start()
+        started.wait()
+
+    def tearDown(self):
+        self._stop.set()
+        self._thread.join()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def test_countsStacksOfAllThreads(self):
+        tested = samplingprofiler.SamplingProfiler(interval=0.005)
+        tested.start()
+        time.sleep(0.3)
+        tested.stop()
+        self.assertGreater(tested.samples(), 5)
+        stuck = dict((stack, count) for stack, count in tested.folded().iteritems()
+                     if stack.startswith("stuck;"))
+        self.assertGreater(sum(stuck.values()), 5)
+        for stack in stuck:
+            self.assertIn(":waitInPredicateLoop:", stack)
+        self.assertFalse(any(stack.startswith("samplingprofiler;") for stack in tested.folded()))
+
+    def test_dumpWritesFoldedStacks(self):
+        tested = samplingprofiler.SamplingProfiler(interval=0.005)
+        tested.start()
+        time.sleep(0.1)
+        tested.stop()
+        filename = os.path.join(self._dir, "profile.folded")
+        tested.dump(filename)
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        self.assertEquals(len(lines), len(tested.folded()))
+        total = 0
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertEquals(tested.folded()[stack], int(count))
+            total += int(count)
+        self.assertGreaterEqual(total, tested.samples())
+
+    def test_formatThreadStacks(self):
+        dump = samplingprofiler.formatThreadStacks()
+        self.assertIn("Thread 'stuck'", dump)
+        self.assertIn("in waitInPredicateLoop", dump)
+
+
+if __name__ == '__main__':
+    unittest.main()
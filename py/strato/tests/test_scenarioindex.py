@@ -0,0 +1,131 @@
+import unittest
+import shutil
+import os
+import time
+import tempfile
+from strato.racktest.runner import scenarioindex
+
+SIMPLE_SCENARIO = """
+from strato.racktest.infra.suite import *
+
+
+class Test:
+    HOSTS = dict(it=dict(rootfs="rootfs-basic", minimumRAMGB=4))
+    ABORT_TEST_TIMEOUT = 60 * 20
+    REUSABLE_HOSTS = True
+
+    def run(self):
+        pass
+"""
+
+MULTICLUSTER_SCENARIO = """
+class Test:
+    HOSTS_PER_CLUSTER = 2
+    HOSTS = {'sourceCluster': {'src_node%d' % i: {'rootfs': 'rootfs-vanilla'}
+                               for i in range(HOSTS_PER_CLUSTER)},
+             'destCluster': {'dst_node%d' % i: {'rootfs': 'rootfs-basic'}
+                             for i in range(HOSTS_PER_CLUSTER)}}
+    HOSTS.update({'multicluster': True})
+"""
+
+DYNAMIC_SCENARIO = """
+import subprocess
+LABEL = subprocess.check_output(["solvent", "printlabel"]).strip()
+
+
+class Test:
+    HOSTS = dict(it=dict(rootfs=LABEL))
+"""
+
+INHERITED_TIMEOUT_SCENARIO = """
+from racktests import base
+
+
+class Test(base.LongTest):
+    HOSTS = dict(it=dict(rootfs="rootfs-basic"))
+"""
+
+CONDITIONAL_TIMEOUT_SCENARIO = """
+import os
+
+
+class Test:
+    HOSTS = dict(it=dict(rootfs="rootfs-basic"))
+    if os.getenv('SLOW'):
+        ABORT_TEST_TIMEOUT = 4 * 60 * 60
+"""
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(suffix="_testdir")
+        self._root = os.path.join(self._dir, "racktests")
+        self._indexFilename = os.path.join(self._dir, "index.json")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _writeScenario(self, relativePath, contents):
+        path = os.path.join(self._root, relativePath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(contents)
+        return path
+
+    def test_discoversScenariosWithoutDepthLimit(self):
+        shallow = self._writeScenario("1_simple.py", SIMPLE_SCENARIO)
+        deep = self._writeScenario("a/b/c/d/e/2_simple.py", SIMPLE_SCENARIO)
+        self._writeScenario(".hidden/3_simple.py", SIMPLE_SCENARIO)
+        tested = scenarioindex.ScenarioIndex(self._root, self._indexFilename)
+        self.assertEquals(tested.scenarios(), sorted([shallow, deep]))
+
+    def test_initFileIsForbidden(self):
+        self._writeScenario("a/__init__.py", "")
+        tested = scenarioindex.ScenarioIndex(self._root, self._indexFilename)
+        self.assertRaises(Exception, tested.scenarios)
+
+    def test_extractsMetadataWithoutImporting(self):
+        metadata = scenarioindex.extractMetadata(self._writeScenario("1_simple.py", SIMPLE_SCENARIO))
+        self.assertEquals(metadata['hosts'], dict(it=dict(rootfs="rootfs-basic", minimumRAMGB=4)))
+        self.assertEquals(metadata['abortTestTimeout'], 1200)
+        self.assertEquals(metadata['rootfsLabels'], ['rootfs-basic'])
+        self.assertTrue(metadata['reusableHosts'])
+
+    def test_extractsMulticlusterHosts(self):
+        metadata = scenarioindex.extractMetadata(self._writeScenario("1_multi.py", MULTICLUSTER_SCENARIO))
+        self.assertEquals(sorted(metadata['hosts']['sourceCluster'].keys()), ['src_node0', 'src_node1'])
+        self.assertTrue(metadata['hosts']['multicluster'])
+        self.assertEquals(metadata['rootfsLabels'], ['rootfs-basic', 'rootfs-vanilla'])
+        self.assertEquals(metadata['abortTestTimeout'], None)
+        self.assertTrue(metadata['defaultAbortTestTimeout'])
+        self.assertFalse(metadata['reusableHosts'])
+
+    def test_timeoutThatCanNotBeReadIsNotTakenForTheDefault(self):
+        for contents in [INHERITED_TIMEOUT_SCENARIO, CONDITIONAL_TIMEOUT_SCENARIO]:
+            metadata = scenarioindex.extractMetadata(self._writeScenario("1_timeout.py", contents))
+            self.assertEquals(metadata['abortTestTimeout'], None)
+            self.assertFalse(metadata['defaultAbortTestTimeout'])
+        metadata = scenarioindex.extractMetadata(self._writeScenario("1_simple.py", SIMPLE_SCENARIO))
+        self.assertFalse(metadata['defaultAbortTestTimeout'])
+
+    def test_dynamicHostsAreUnknown(self):
+        metadata = scenarioindex.extractMetadata(self._writeScenario("1_dynamic.py", DYNAMIC_SCENARIO))
+        self.assertEquals(metadata['hosts'], None)
+        self.assertEquals(metadata['rootfsLabels'], None)
+
+    def test_indexIsInvalidatedByModificationTime(self):
+        path = self._writeScenario("1_simple.py", SIMPLE_SCENARIO)
+        tested = scenarioindex.ScenarioIndex(self._root, self._indexFilename)
+        self.assertEquals(tested.metadata(path)['abortTestTimeout'], 1200)
+        tested.save()
+        reloaded = scenarioindex.ScenarioIndex(self._root, self._indexFilename)
+        self.assertEquals(reloaded.metadata(path)['abortTestTimeout'], 1200)
+        self._writeScenario("1_simple.py", SIMPLE_SCENARIO.replace("60 * 20", "30"))
+        os.utime(path, (time.time(), os.path.getmtime(path) + 10))
+        self.assertEquals(reloaded.metadata(path)['abortTestTimeout'], 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+import threading
+import signal
+import sys
+import time
+import os
+from strato.racktest.runner import scenarioloop
+from strato.racktest.runner import hostbudget
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._exitCodes = dict()
+        self._running = 0
+        self._maximumRunning = 0
+
+    def _prepare(self, job):
+        with self._lock:
+            self._running += 1
+            self._maximumRunning = max(self._maximumRunning, self._running)
+        return dict(os.environ)
+
+    def _finish(self, job, exitCode):
+        with self._lock:
+            self._running -= 1
+            self._exitCodes[job['scenario']] = exitCode
+
+    def _command(self, job):
+        return ['sh', '-c', job['scenario']]
+
+    def _loop(self, **kwargs):
+        return scenarioloop.ScenarioLoop(
+            prepare=self._prepare, finish=self._finish, command=self._command, **kwargs)
+
+    def _job(self, command, **kwargs):
+        return dict(kwargs, scenario=command, instance='')
+
+    def test_exitCodes(self):
+        self._loop(maximumConcurrent=2).run([self._job('true'), self._job('exit 3'), self._job('sleep 0.2')])
+        self.assertEquals(self._exitCodes, {'true': 0, 'exit 3': 3, 'sleep 0.2': 0})
+
+    def test_concurrencyIsBounded(self):
+        jobs = [self._job('sleep 0.1; echo %d > /dev/null' % i) for i in xrange(6)]
+        self._loop(maximumConcurrent=2).run(jobs)
+        self.assertEquals(len(self._exitCodes), 6)
+        self.assertEquals(self._maximumRunning, 2)
+
+    def test_hostBudget(self):
+        jobs = [self._job('sleep 0.1; echo %d > /dev/null' % i, hosts=dict(defaultRackattack=3))
+                for i in xrange(4)]
+        self._loop(hostBudget=hostbudget.HostBudget(defaultBudget=7)).run(jobs)
+        self.assertEquals(len(self._exitCodes), 4)
+        self.assertEquals(self._maximumRunning, 2)
+
+    def test_heldHostsCountAgainstTheBudget(self):
+        startedAt = dict()
+        released = []
+
+        def prepare(job):
+            startedAt[job['scenario']] = time.time()
+            return dict(os.environ)
+
+        def finish(job, exitCode):
+            if job['scenario'] == 'true':
+                tested.holdHosts(dict(defaultRackattack=3))
+                released.append(time.time() + 0.5)
+                threading.Timer(0.5, tested.releaseHosts, args=(dict(defaultRackattack=3),)).start()
+        tested = scenarioloop.ScenarioLoop(
+            prepare=prepare, finish=finish, command=self._command,
+            hostBudget=hostbudget.HostBudget(defaultBudget=3), maximumConcurrent=1)
+        tested.run([self._job('true', hosts=dict(defaultRackattack=3)),
+                    self._job('true; true', hosts=dict(defaultRackattack=3))])
+        self.assertGreaterEqual(startedAt['true; true'], released[0] - 0.05)
+
+    def test_reservedJobIsAdmittedThoughItsHostsDoNotFit(self):
+        budget = hostbudget.HostBudget(defaultBudget=3)
+        budget.reserve(('true', ''), dict(defaultRackattack=3))
+        self._loop(hostBudget=budget).run([self._job('true', hosts=dict(defaultRackattack=3))])
+        self.assertEquals(self._exitCodes, {'true': 0})
+        self.assertTrue(budget.fits(dict(defaultRackattack=3)))
+
+    def test_timeoutTerminates(self):
+        tested = self._loop()
+        tested._KILL_GRACE = 1
+        before = time.time()
+        tested.run([self._job('sleep 30', timeout=0.2), self._job("trap '' TERM; sleep 30", timeout=0.2)])
+        self.assertLess(time.time() - before, 10)
+        self.assertEquals(self._exitCodes['sleep 30'], -signal.SIGTERM)
+        self.assertEquals(self._exitCodes["trap '' TERM; sleep 30"], -signal.SIGKILL)
+
+    def test_failureToPrepareFinishesWithoutRunning(self):
+        def prepare(job):
+            raise Exception("No hosts")
+        scenarioloop.ScenarioLoop(prepare=prepare, finish=self._finish, command=self._command).run(
+            [self._job('true')])
+        self.assertEquals(self._exitCodes, {'true': None})
+
+    def test_interruptTerminatesRunningScenarios(self):
+        def exitOnInterrupt(*args):
+            sys.exit()
+        previous = signal.signal(signal.SIGINT, exitOnInterrupt)
+        self.addCleanup(signal.signal, signal.SIGINT, previous)
+        interrupt = threading.Timer(0.3, os.kill, args=(os.getpid(), signal.SIGINT))
+        interrupt.start()
+        before = time.time()
+        with self.assertRaises(KeyboardInterrupt):
+            self._loop().run([self._job('sleep 30'), self._job('sleep 0; true')])
+        self.assertLess(time.time() - before, 10)
+        self.assertEquals(self._exitCodes['sleep 30'], -signal.SIGTERM)
+        self.assertIs(signal.getsignal(signal.SIGINT), exitOnInterrupt)
+
+    def test_scenariosPreparedAfterAnInterruptDoNotRun(self):
+        def slowPrepare(job):
+            time.sleep(1)
+            return self._prepare(job)
+        interrupt = threading.Timer(0.3, os.kill, args=(os.getpid(), signal.SIGINT))
+        interrupt.start()
+        with self.assertRaises(KeyboardInterrupt):
+            scenarioloop.ScenarioLoop(prepare=slowPrepare, finish=self._finish, command=self._command).run(
+                [self._job('true'), self._job('exit 3')])
+        self.assertEquals(self._exitCodes, {'true': None, 'exit 3': None})
+
+
+if __name__ == '__main__':
+    unittest.main()